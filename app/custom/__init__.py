@@ -21,6 +21,7 @@
 
 import re
 from jsonpath_ng.ext import parse
+from app.utils.http import http_client, read_response
 
 
 def json_parse(json_obj: dict, expression: str):
@@ -42,3 +43,30 @@ def re_search(text: str, pattern: str):
         return re.search(pattern, text)
     except Exception as e:
         raise type(e)(f"'re_search' exception: {e}") from e
+
+
+# http nodes share a pooled, keep-alive session per host (see app.utils.http)
+# and return the parsed body so the response is read off the event loop
+
+
+def http_request(method: str, url: str, **kwargs):
+    try:
+        return read_response(http_client.request(method, url, **kwargs))
+    except Exception as e:
+        raise type(e)(f"'http_request' exception: {e}") from e
+
+
+def http_get(url: str, params: dict = None, **kwargs):
+    return http_request("GET", url, params=params, **kwargs)
+
+
+def http_post(url: str, data=None, json=None, **kwargs):
+    return http_request("POST", url, data=data, json=json, **kwargs)
+
+
+def http_put(url: str, data=None, json=None, **kwargs):
+    return http_request("PUT", url, data=data, json=json, **kwargs)
+
+
+def http_delete(url: str, **kwargs):
+    return http_request("DELETE", url, **kwargs)
@@ -4,29 +4,132 @@
 import os
 import json
 import asyncio
+from functools import partial
+from contextlib import asynccontextmanager
 
-from fastapi import FastAPI, WebSocket
+from fastapi import FastAPI, Header, HTTPException, Request, WebSocket
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from fastapi.exceptions import RequestValidationError
+from pydantic import ValidationError
+from starlette.requests import ClientDisconnect
 from fastapi.middleware.cors import CORSMiddleware
 
-from app.utils.logs import global_logger, log_queue
+from app.utils.logs import global_logger, log_queue, queue_log
 from app.utils import Process
+from app.utils.batch import read_lines, run_batch
+from app.utils.scheduler import RunScheduler
+from app.utils.workers import WorkerPool, WorkerRun
+from app.utils.run_queue import RunQueue, RunQueueConsumer
+from app.utils.exceptions import RunQueueFullError, WorkerExitError
+from app.utils.updates import UpdateChannel
+from app.utils.http import http_client
+from app.utils.cache import result_cache
+from app.utils.checkpoint import checkpoint_store
+from app.utils.executors import shutdown_process_pool
+from app.utils.resolver import load_class
+from app.utils.metrics import latency, registry
 from app.models import Flow
 
 
-def run_from_file(path: str):
+def run_from_file(path: str, checkpoint_id: str = None):
+    # with a checkpoint_id, the run continues from that checkpoint
     with open(path, "r") as f:
-        process = Process(Flow(**json.loads(f.read())))
+        process = Process(
+            Flow(**json.loads(f.read())), checkpoint_id=checkpoint_id, resume=bool(checkpoint_id)
+        )
     return asyncio.run(process.run())
 
 
+class BatchResponse(StreamingResponse):
+    """Streams a batch's results while its body is still being read. A
+    StreamingResponse listens for the client going away by reading from the
+    request, which would take chunks of the body, so that only starts once
+    body_read is set."""
+
+    def __init__(self, content, body_read: asyncio.Event):
+        super().__init__(content, media_type="application/x-ndjson")
+        self.body_read = body_read
+
+    async def __call__(self, scope, receive, send):
+        streaming = asyncio.create_task(self.stream_response(send))
+        body_read = asyncio.create_task(self.body_read.wait())
+        await asyncio.wait({streaming, body_read}, return_when=asyncio.FIRST_COMPLETED)
+        if not streaming.done():
+            listening = asyncio.create_task(self.listen_for_disconnect(receive))
+            await asyncio.wait({streaming, listening}, return_when=asyncio.FIRST_COMPLETED)
+            # cancelling the stream cancels the runs still in flight
+            listening.cancel()
+            streaming.cancel()
+        body_read.cancel()
+        try:
+            await streaming
+        except asyncio.CancelledError:
+            if not streaming.cancelled():
+                raise
+
+
+async def run_queued(run: dict, pool: WorkerPool = None, checkpoints=None):
+    # queued runs are checkpointed under their id in the queue, so one handed
+    # out again after its server or worker died continues where it got to
+    checkpoints = checkpoints or checkpoint_store
+    resume = run["attempts"] > 1 and bool(checkpoints)
+    if resume:
+        resume = await asyncio.to_thread(checkpoints.exists, run["id"])
+    if pool:
+        return await WorkerRun(
+            pool, run["flow"], run["variables"], run["id"], resume, run_id=run["id"]
+        ).run()
+    flow = Flow(**json.loads(run["flow"]))
+    process = Process(
+        flow,
+        variables=run["variables"],
+        checkpoints=checkpoints,
+        checkpoint_id=run["id"],
+        resume=resume,
+        run_id=run["id"],
+    )
+    return await process.run()
+
+
 def create_app():
     local = os.getenv("PFA_LOCAL", "True").lower() == "true"
-    db_class = os.getenv("PFA_DB_CLASS", "app.utils.SimpleInMemoryDB")
-    module_name, class_name = db_class.rsplit(".", 1)
-    module = __import__(module_name, fromlist=[class_name])
-    db = getattr(module, class_name)()
+    db = load_class(os.getenv("PFA_DB_CLASS", "app.utils.SimpleInMemoryDB"))()
+    ws_queue_size = int(os.getenv("PFA_WS_QUEUE_SIZE", "100"))
+    ws_coalesce = os.getenv("PFA_WS_COALESCE", "False").lower() == "true"
+    # a batch can ask for fewer runs in flight than this, never more
+    batch_concurrency = int(os.getenv("PFA_BATCH_CONCURRENCY", "10"))
+    scheduler = RunScheduler()
+    # with PFA_WORKERS set, runs posted to /api/run go to worker processes
+    workers = int(os.getenv("PFA_WORKERS", "0"))
+    pool = WorkerPool(workers) if workers else None
+    # with PFA_RUN_QUEUE_PATH set, runs posted to /api/run are written to a
+    # durable queue first and a consumer runs them from there
+    run_queue = RunQueue() if os.getenv("PFA_RUN_QUEUE_PATH") else None
+
+    # a run that failed is not run again, unless its worker died under it
+    consumer = (
+        RunQueueConsumer(run_queue, partial(run_queued, pool=pool), retry_on=(WorkerExitError,))
+        if run_queue
+        else None
+    )
+
+    @asynccontextmanager
+    async def lifespan(_: FastAPI):
+        if pool:
+            pool.start()
+        if consumer:
+            consumer_task = asyncio.create_task(consumer.serve())
+        yield
+        if consumer:
+            await consumer.stop()
+            await consumer_task
+            run_queue.close()
+        if pool:
+            await asyncio.to_thread(pool.stop)
+        await asyncio.to_thread(shutdown_process_pool)
+        await asyncio.to_thread(registry.close)
 
-    app = FastAPI()
+    app = FastAPI(lifespan=lifespan)
 
     if local:
         app.add_middleware(
@@ -87,15 +190,203 @@ def create_app():
             raise ReferenceError("No database setup.")
         return db.delete_flow(flow_id)
 
-    @app.post("/api/run")
-    async def api_run(body: Flow = None, flow_id: str = None):
+    def schedule(process: Process | WorkerRun, flow_key: str, priority: int) -> dict:
+        # runs past the scheduler's queue are shed instead of started
+        try:
+            run = scheduler.submit(process, flow_key, priority)
+        except RunQueueFullError as e:
+            raise HTTPException(status_code=429, detail=str(e))
+        response = {"run_id": run.id, "status": run.status}
+        # a run can only be resumed when checkpoints are saved somewhere
+        if checkpoint_store:
+            response["checkpoint_id"] = process.checkpoint_id
+        return response
+
+    async def posted_flow(request: Request, flow_id: str = None) -> tuple[Flow, bytes]:
+        # the flow saved as flow_id or the one posted, along with its json.
+        # it is validated here so a bad flow is answered with a 422 instead of
+        # failing once it reaches a worker
+        if db and flow_id:
+            flow = db.read(flow_id)
+            if not flow:
+                raise AttributeError("Missing flow data.")
+            flow = Flow.model_validate(flow)
+            return flow, flow.model_dump_json().encode()
+        body = await request.body()
+        if not body.strip():
+            raise AttributeError("Missing flow data.")
+        try:
+            return Flow.model_validate_json(body), body
+        except ValidationError as e:
+            errors = e.errors(include_url=False)
+            raise RequestValidationError([{**error, "loc": ("body", *error["loc"])} for error in errors])
+
+    if run_queue:
+
+        @app.post("/api/run")
+        async def api_run(
+            request: Request,
+            flow_id: str = None,
+            priority: int = 0,
+            idempotency_key: str = Header(None),
+        ):
+            # a run posted again with the same Idempotency-Key header is not
+            # queued a second time, the first one's id is returned. a flow that
+            # doesn't validate is never queued, where it would only fail again
+            # on every attempt
+            _, body = await posted_flow(request, flow_id)
+            run_id, added = await asyncio.to_thread(
+                run_queue.put, body, None, idempotency_key, priority
+            )
+            consumer.notify()
+            status = "queued" if added else run_queue.get(run_id)["status"]
+            response = {"run_id": run_id, "status": status}
+            if checkpoint_store:
+                response["checkpoint_id"] = run_id
+            return response
+
+    elif pool:
+
+        @app.post("/api/run")
+        async def api_run(request: Request, flow_id: str = None, priority: int = 0):
+            # the flow is handed over as json, the worker running it parses
+            # it again and keeps it compiled for later runs
+            flow, body = await posted_flow(request, flow_id)
+            return schedule(WorkerRun(pool, body), flow.id or flow.name, priority)
+
+    else:
+
+        @app.post("/api/run")
+        async def api_run(body: Flow = None, flow_id: str = None, priority: int = 0):
+            if db and flow_id:
+                body = db.read(flow_id)
+            if not body:
+                raise AttributeError("Missing flow data.")
+            return schedule(Process(body), body.id or body.name, priority)
+
+    @app.post("/api/run/batch")
+    async def api_run_batch(request: Request, flow_id: str = None, max_concurrency: int = None):
+        # the body is ndjson, one variables object per line to run the flow
+        # with, preceded by the flow itself when no flow_id is given. lines are
+        # read as runs finish and results are streamed back as ndjson in the
+        # order the runs finish
+        body_read = asyncio.Event()
+        concurrency = min(max(max_concurrency or batch_concurrency, 1), batch_concurrency)
+
+        async def body_lines():
+            try:
+                async for line in read_lines(request.stream()):
+                    yield line
+            except ClientDisconnect:
+                pass
+            finally:
+                body_read.set()
+
+        lines = body_lines()
+        if db and flow_id:
+            flow = db.read(flow_id)
+        else:
+            first = await anext(lines, None)
+            try:
+                flow = Flow.model_validate_json(first) if first else None
+            except ValueError as e:
+                raise HTTPException(status_code=422, detail=str(e))
+        if not flow:
+            raise AttributeError("Missing flow data.")
+
+        async def inputs():
+            # a line that isn't a variables object fails its own run only
+            async for line in lines:
+                try:
+                    variables = json.loads(line)
+                    if not isinstance(variables, dict):
+                        raise ValueError("Expected a json object of variables.")
+                    yield variables
+                except ValueError as e:
+                    yield e
+
+        async def results():
+            async for result in run_batch(flow, inputs(), concurrency):
+                yield json.dumps(result, default=str) + "\n"
+
+        return BatchResponse(results(), body_read)
+
+    @app.post("/api/run/resume")
+    async def api_run_resume(
+        checkpoint_id: str, body: Flow = None, flow_id: str = None, priority: int = 0
+    ):
+        # checkpoint_id is the one returned when the run was posted. without
+        # it the run would start over, so that is refused instead
+        if not checkpoint_store:
+            raise HTTPException(status_code=501, detail="Checkpoints are not enabled.")
+        if not await asyncio.to_thread(checkpoint_store.exists, checkpoint_id):
+            raise HTTPException(status_code=404, detail=f"Checkpoint {checkpoint_id} not found.")
         if db and flow_id:
             body = db.read(flow_id)
         if not body:
             raise AttributeError("Missing flow data.")
-        process = Process(body)
-        asyncio.create_task(process.run())
-        return "Started process."
+        process = Process(body, checkpoint_id=checkpoint_id, resume=True)
+        return schedule(process, body.id or body.name, priority)
+
+    @app.get("/api/run/metrics")
+    async def api_run_metrics():
+        metrics = scheduler.metrics()
+        if run_queue:
+            metrics["run_queue"] = await asyncio.to_thread(run_queue.metrics)
+        return metrics
+
+    @app.get("/api/run/{run_id}")
+    async def api_run_status(run_id: str):
+        run = scheduler.get(run_id)
+        if run:
+            return run.to_dict()
+        if run_queue and (queued := await asyncio.to_thread(run_queue.get, run_id)):
+            return queued
+        raise HTTPException(status_code=404, detail=f"Run {run_id} not found.")
+
+    @app.delete("/api/run/{run_id}")
+    async def api_run_cancel(run_id: str):
+        run = scheduler.cancel(run_id)
+        if not run:
+            raise HTTPException(status_code=404, detail=f"Run {run_id} not found.")
+        return {"run_id": run.id, "status": run.status}
+
+    @app.get("/api/http/metrics")
+    async def http_metrics():
+        return http_client.metrics()
+
+    @app.get("/metrics", response_class=PlainTextResponse)
+    async def metrics():
+        text = await asyncio.to_thread(registry.render)
+        return PlainTextResponse(text, media_type="text/plain; version=0.0.4")
+
+    @app.get("/api/latency")
+    async def get_latency(
+        flow: str = None, function: str = None, sort: str = "p99_ms", limit: int = None
+    ):
+        return await asyncio.to_thread(latency.query, flow, function, sort, limit)
+
+    @app.get("/api/latency/export")
+    async def export_latency():
+        return await asyncio.to_thread(latency.export)
+
+    @app.delete("/api/latency")
+    async def reset_latency():
+        latency.reset()
+        return "Cleared latencies."
+
+    @app.get("/api/log/metrics")
+    async def log_metrics():
+        return log_queue.metrics()
+
+    @app.get("/api/cache/metrics")
+    async def cache_metrics():
+        return result_cache.metrics()
+
+    @app.delete("/api/cache")
+    async def cache_clear():
+        result_cache.clear()
+        return "Cleared cache."
 
     @app.websocket("/ws/run")
     async def websocket_run(websocket: WebSocket):
@@ -104,61 +395,74 @@ def create_app():
         process_task = None
         receive_task = asyncio.create_task(websocket.receive_json())
 
-        async def send_update(update):
+        async def send(update):
             if isinstance(update, dict):
                 await websocket.send_json(update)
             else:
                 await websocket.send_text(update)
 
-        while True:
-            if process_task and process_task.done():
-                await log_queue.put((global_logger, "debug", "Process completed"))
-                await send_update("Process completed.")
-                process_task = None
-                process = None
+        # updates are sent by the channel's own task so a run only slows down
+        # when the client falls behind by more than the channel can hold
+        channel = UpdateChannel(send, maxsize=ws_queue_size, coalesce=ws_coalesce).start()
+        send_update = channel.put
 
-            done, pending = await asyncio.wait(
-                [receive_task, process_task] if process_task else [receive_task],
-                return_when=asyncio.FIRST_COMPLETED,
-            )
+        try:
+            while True:
+                if process_task and process_task.done():
+                    queue_log(global_logger, "debug", "Process completed")
+                    await send_update("Process completed.")
+                    process_task = None
+                    process = None
 
-            if process_task in done:
-                await log_queue.put((global_logger, "debug", "Process completed"))
-                await send_update("Process completed.")
-                process_task = None
-                process = None
-                continue
-
-            if receive_task in done:
-                data = done.pop().result()
-
-                if "stop" in data:
-                    if process_task:
-                        process_task.cancel()
-                        await log_queue.put((global_logger, "debug", "Stopping process per user request"))
-                        await send_update("Stopping process per user request.")
-                    else:
-                        await log_queue.put((global_logger, "debug", "No process running."))
-                        await send_update("No process running.")
-                else:
-                    if process_task is None:
-                        try:
-                            flow = Flow(**data)
-                            process = Process(flow, update=send_update, ws=True)
-                            process_task = asyncio.create_task(process.run())
-                            await log_queue.put((global_logger, "debug", "Starting process"))
-                            await send_update("Starting process.")
-                        except Exception as e:
-                            await log_queue.put((global_logger, "debug", f"Invalid flow data: {str(e)}"))
-                            await send_update(f"Invalid flow data: {str(e)}")
+                done, pending = await asyncio.wait(
+                    [receive_task, process_task] if process_task else [receive_task],
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+
+                if process_task in done:
+                    queue_log(global_logger, "debug", "Process completed")
+                    await send_update("Process completed.")
+                    process_task = None
+                    process = None
+                    continue
+
+                if receive_task in done:
+                    data = done.pop().result()
+
+                    if "stop" in data:
+                        if process_task:
+                            process_task.cancel()
+                            queue_log(global_logger, "debug", "Stopping process per user request")
+                            await send_update("Stopping process per user request.")
+                        else:
+                            queue_log(global_logger, "debug", "No process running.")
+                            await send_update("No process running.")
                     else:
-                        await log_queue.put((global_logger, "debug", 
-                            "Process already running. Ignoring new process request."
-                        ))
-                        await send_update(
-                            "Process already running. Ignoring new process request."
-                        )
-
-                receive_task = asyncio.create_task(websocket.receive_json())
+                        if process_task is None:
+                            try:
+                                flow = Flow(**data)
+                                process = Process(flow, update=send_update, ws=True)
+                                process_task = asyncio.create_task(process.run())
+                                queue_log(global_logger, "debug", "Starting process")
+                                await send_update("Starting process.")
+                            except Exception as e:
+                                queue_log(global_logger, "debug", f"Invalid flow data: {str(e)}")
+                                await send_update(f"Invalid flow data: {str(e)}")
+                        else:
+                            queue_log(global_logger, "debug",
+                                "Process already running. Ignoring new process request."
+                            )
+                            await send_update(
+                                "Process already running. Ignoring new process request."
+                            )
+
+                    receive_task = asyncio.create_task(websocket.receive_json())
+        finally:
+            receive_task.cancel()
+            # nobody is listening any more once the client is gone, and the
+            # closed channel no longer fails the run's updates to stop it
+            if process_task:
+                process_task.cancel()
+            await channel.close(drain=False)
 
     return app
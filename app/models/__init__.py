@@ -18,6 +18,11 @@ class NodeData(BaseModel, extra="allow"):
     args: list[Any] | None = None
     kwargs: dict[str, Any] | None = None
     next_function: int | str | None = None
+    cache: bool = False
+    cache_ttl: float | None = None
+    timeout: float | None = None
+    # "thread", "inline" or "process", overrides where a sync function runs
+    executor: str | None = None
 
     @field_validator("args", mode="before")
     def convert_args(cls, v):
@@ -82,6 +87,9 @@ class Signal(BaseModel):
 class Parameters(BaseModel):
     log: Signal | None = None
     metric: Signal | None = None
+    # seconds the whole run, and each node without its own timeout, may take
+    timeout: float | None = None
+    node_timeout: float | None = None
 
 
 class Flow(BaseModel):
@@ -139,6 +147,9 @@ class Flow(BaseModel):
             and not edge.targetHandle.isdigit()
         ]
 
+    def compile(self) -> "CompiledFlow":
+        return CompiledFlow(self)
+
     def get_node(self, node_id: str) -> Node:
         for node in self.nodes:
             if node.id == node_id:
@@ -169,3 +180,48 @@ class Flow(BaseModel):
             if edge.target == edge_id:
                 edges.append(edge)
         return edges
+
+
+class CompiledFlow:
+    """Dict indexes over a Flow's nodes and edges, built once so lookups made
+    while running are O(1) instead of a scan over every edge. Nodes are shared
+    with the flow, arg edges are copies with an int targetHandle."""
+
+    def __init__(self, flow: Flow):
+        self.flow = flow
+        self.start_id = flow.start_id
+        self.nodes: dict[str, Node] = {}
+        self.next_functions: dict[str, str] = {}
+        self.except_edges: dict[str, list[Edge]] = {}
+        self.arg_edges: dict[str, list[Edge]] = {}
+        self.kwarg_edges: dict[str, list[Edge]] = {}
+
+        for node in flow.nodes:
+            self.nodes.setdefault(node.id, node)
+
+        for edge in flow.edges:
+            if edge.targetHandle == "e-in":
+                if edge.sourceHandle == "e-out":
+                    self.next_functions.setdefault(edge.source, edge.target)
+                else:
+                    self.except_edges.setdefault(edge.source, []).append(edge)
+            elif isinstance(edge.targetHandle, int) or edge.targetHandle.isdigit():
+                edge = edge.model_copy(update={"targetHandle": int(edge.targetHandle)})
+                self.arg_edges.setdefault(edge.target, []).append(edge)
+            else:
+                self.kwarg_edges.setdefault(edge.target, []).append(edge)
+
+    def get_node(self, node_id: str) -> Node:
+        node = self.nodes.get(node_id)
+        if node:
+            node.data.next_function = self.next_functions.get(node_id)
+        return node
+
+    def get_except_edges_by_source(self, edge_id: str) -> list[Edge]:
+        return self.except_edges.get(edge_id, [])
+
+    def get_arg_edges_by_target(self, edge_id: str) -> list[Edge]:
+        return self.arg_edges.get(edge_id, [])
+
+    def get_kwarg_edges_by_target(self, edge_id: str) -> list[Edge]:
+        return self.kwarg_edges.get(edge_id, [])
@@ -0,0 +1,86 @@
+# This file is licensed under the CC BY-NC-SA 4.0 license.
+# See https://creativecommons.org/licenses/by-nc-sa/4.0/ for details.
+
+import os
+import asyncio
+from typing import Any, AsyncIterable, AsyncIterator, Iterable
+
+from app.models import Flow
+from app.utils.processor import Process
+
+
+async def _aiter(inputs: Iterable | AsyncIterable) -> AsyncIterator:
+    if hasattr(inputs, "__aiter__"):
+        async for item in inputs:
+            yield item
+    else:
+        for item in inputs:
+            yield item
+
+
+async def read_lines(chunks: AsyncIterable[bytes]) -> AsyncIterator[bytes]:
+    """Yields the non blank lines of a stream of bytes as soon as each one is
+    complete, without holding more of the stream than the line being read."""
+    partial: list[bytes] = []
+    async for chunk in chunks:
+        *lines, rest = chunk.split(b"\n")
+        if lines:
+            lines[0] = b"".join(partial) + lines[0]
+            partial = []
+            for line in lines:
+                if line.strip():
+                    yield line
+        if rest:
+            partial.append(rest)
+    line = b"".join(partial)
+    if line.strip():
+        yield line
+
+
+async def run_batch(
+    flow: Flow,
+    inputs: Iterable[dict[str, Any]] | AsyncIterable[dict[str, Any]],
+    max_concurrency: int = None,
+    **process_kwargs,
+) -> AsyncIterator[dict[str, Any]]:
+    """Runs flow once for every variables dict in inputs, each layered over the
+    flow's own variables, and yields {"index", "variables"} or {"index", "error"}
+    for each run in the order they finish. The flow is compiled once and at
+    most max_concurrency runs (PFA_BATCH_CONCURRENCY) are in flight, inputs are
+    only read as runs finish so they can be a stream of any length. An input
+    that is an exception, such as a line that couldn't be parsed, is reported
+    as the error of its run."""
+    max_concurrency = max_concurrency or int(os.getenv("PFA_BATCH_CONCURRENCY", "10"))
+    graph = flow.compile()
+
+    async def run(index: int, variables: dict[str, Any]) -> dict[str, Any]:
+        try:
+            if isinstance(variables, Exception):
+                raise variables
+            process = Process(flow, variables=variables, graph=graph, **process_kwargs)
+            return {"index": index, "variables": await process.run()}
+        except Exception as e:
+            return {"index": index, "error": str(e)}
+
+    inputs = _aiter(inputs)
+    running = set()
+    index = 0
+    exhausted = False
+    try:
+        while running or not exhausted:
+            while not exhausted and len(running) < max_concurrency:
+                try:
+                    variables = await anext(inputs)
+                except StopAsyncIteration:
+                    exhausted = True
+                    break
+                running.add(asyncio.create_task(run(index, variables)))
+                index += 1
+            if not running:
+                break
+            done, running = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                yield task.result()
+    finally:
+        for task in running:
+            task.cancel()
@@ -0,0 +1,122 @@
+# This file is licensed under the CC BY-NC-SA 4.0 license.
+# See https://creativecommons.org/licenses/by-nc-sa/4.0/ for details.
+
+import os
+import copy
+import json
+import time
+import hashlib
+import threading
+from typing import Any
+from collections import OrderedDict
+
+from app.utils.resolver import load_class
+
+MISSING = object()
+
+
+def _is_json(value: Any) -> bool:
+    # only values that come back from json as they went in, a tuple would
+    # share its key with the same list and an int dict key with a str one
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return True
+    if isinstance(value, list):
+        return all(_is_json(item) for item in value)
+    if isinstance(value, dict):
+        return all(isinstance(k, str) and _is_json(v) for k, v in value.items())
+    return False
+
+
+class MemoryBackend:
+    """In process LRU store, entries expire after their ttl, never with a ttl
+    of 0, and the least recently used entry is dropped once maxsize is
+    reached. Hits are deep copies so a node changing its result can't change
+    the cached one."""
+
+    def __init__(self, maxsize: int = None):
+        self.maxsize = maxsize or int(os.getenv("PFA_CACHE_SIZE", "1024"))
+        self._entries: OrderedDict[str, tuple[float, Any]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+            expires, value = entry
+            if expires and expires <= time.monotonic():
+                del self._entries[key]
+                return default
+            self._entries.move_to_end(key)
+        return copy.deepcopy(value)
+
+    def set(self, key: str, value: Any, ttl: float = None):
+        expires = time.monotonic() + ttl if ttl else 0.0
+        with self._lock:
+            self._entries[key] = (expires, copy.deepcopy(value))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+def load_backend(backend_class: str = None):
+    """The backend named by PFA_CACHE_BACKEND, a MemoryBackend by default. It
+    needs get(key, default), set(key, value, ttl) and clear()."""
+    backend_class = backend_class or os.getenv(
+        "PFA_CACHE_BACKEND", "app.utils.cache.MemoryBackend"
+    )
+    return load_class(backend_class)()
+
+
+class ResultCache:
+    """Process wide cache of node results for nodes marked with cache, keyed
+    by the function name and a hash of its args and kwargs. Entries are kept
+    for ttl seconds (PFA_CACHE_TTL), 0 keeps them until they are dropped."""
+
+    def __init__(self, backend=None, ttl: float = None):
+        self.backend = backend or load_backend()
+        self.ttl = ttl if ttl is not None else float(os.getenv("PFA_CACHE_TTL", "300"))
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(function: str, args: list[Any], kwargs: dict[str, Any]) -> str | None:
+        """The key of a call, or None when an arg isn't a json value, which
+        couldn't be told apart from another by its encoding."""
+        if not (_is_json(args) and _is_json(kwargs)):
+            return None
+        data = json.dumps([function, args, kwargs], sort_keys=True)
+        return f"{function}:{hashlib.sha256(data.encode()).hexdigest()}"
+
+    def get(self, key: str | None) -> Any:
+        # a call without a key is never cached, it always misses
+        value = MISSING if key is None else self.backend.get(key, MISSING)
+        if value is MISSING:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def set(self, key: str, value: Any, ttl: float = None):
+        self.backend.set(key, value, ttl if ttl is not None else self.ttl)
+
+    def clear(self):
+        self.backend.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def metrics(self) -> dict[str, int]:
+        metrics = {"hits": self.hits, "misses": self.misses}
+        if hasattr(self.backend, "__len__"):
+            metrics["size"] = len(self.backend)
+        return metrics
+
+
+result_cache = ResultCache()
@@ -0,0 +1,112 @@
+# This file is licensed under the CC BY-NC-SA 4.0 license.
+# See https://creativecommons.org/licenses/by-nc-sa/4.0/ for details.
+
+import os
+import json
+import time
+import pickle
+import hashlib
+import threading
+from typing import Any
+
+from app.utils.resolver import load_class
+
+
+class FileCheckpointStore:
+    """Keeps the last checkpoint of each run in a directory of its own. Every
+    variable is pickled to a file named after the hash of its content and a
+    manifest maps variable names to those files. A save is given only the
+    variables written since the previous save of the run, the others are kept
+    from the manifest, so values that didn't change aren't pickled again."""
+
+    def __init__(self, directory: str = None):
+        self.directory = directory or os.getenv("PFA_CHECKPOINT_DIR", ".checkpoints")
+        self._lock = threading.Lock()
+
+    def save(self, run_id: str, state: dict[str, Any]):
+        path = self._path(run_id)
+        with self._lock:
+            os.makedirs(path, exist_ok=True)
+            manifest = self._read_manifest(path) or {}
+            files = dict(manifest.get("variables", {}))
+            saved = set(files.values())
+
+            for key, value in state["variables"].items():
+                data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+                digest = hashlib.blake2b(data, digest_size=16).hexdigest()
+                if digest not in saved:
+                    self._write(os.path.join(path, digest), data)
+                    saved.add(digest)
+                files[key] = digest
+
+            manifest = {
+                "node": state["node"],
+                "loops": state["loops"],
+                "variables": files,
+                "saved": time.time(),
+            }
+            self._write(os.path.join(path, "manifest.json"), json.dumps(manifest).encode())
+
+            for name in os.listdir(path):
+                if name != "manifest.json" and name not in manifest["variables"].values():
+                    os.remove(os.path.join(path, name))
+
+    def load(self, run_id: str) -> dict[str, Any] | None:
+        path = self._path(run_id)
+        with self._lock:
+            manifest = self._read_manifest(path)
+            if manifest is None:
+                return None
+            variables = {}
+            for key, digest in manifest["variables"].items():
+                with open(os.path.join(path, digest), "rb") as f:
+                    variables[key] = pickle.load(f)
+        return {"node": manifest["node"], "loops": manifest["loops"], "variables": variables}
+
+    def exists(self, run_id: str) -> bool:
+        return os.path.isfile(os.path.join(self._path(run_id), "manifest.json"))
+
+    def delete(self, run_id: str):
+        path = self._path(run_id)
+        with self._lock:
+            if not os.path.isdir(path):
+                return
+            for name in os.listdir(path):
+                os.remove(os.path.join(path, name))
+            os.rmdir(path)
+
+    def _path(self, run_id: str) -> str:
+        name = hashlib.blake2b(run_id.encode(), digest_size=16).hexdigest()
+        return os.path.join(self.directory, name)
+
+    @staticmethod
+    def _read_manifest(path: str) -> dict[str, Any] | None:
+        try:
+            with open(os.path.join(path, "manifest.json"), "rb") as f:
+                return json.loads(f.read())
+        except FileNotFoundError:
+            return None
+
+    @staticmethod
+    def _write(path: str, data: bytes):
+        # written next to the target then renamed, so a crash mid write
+        # never leaves a half written checkpoint behind
+        with open(f"{path}.tmp", "wb") as f:
+            f.write(data)
+        os.replace(f"{path}.tmp", path)
+
+
+def load_store():
+    """The store named by PFA_CHECKPOINT_STORE, or a FileCheckpointStore when
+    only PFA_CHECKPOINT_DIR is set. Without either, runs aren't checkpointed.
+    It needs save(run_id, state), merging the variables into those of the
+    previous save, load(run_id), exists(run_id) and delete(run_id)."""
+    store_class = os.getenv("PFA_CHECKPOINT_STORE")
+    if store_class:
+        return load_class(store_class)()
+    if os.getenv("PFA_CHECKPOINT_DIR"):
+        return FileCheckpointStore()
+    return None
+
+
+checkpoint_store = load_store()
@@ -88,3 +88,27 @@ class KeywordArgumentError(Exception):
 
 class SetExceptionsError(Exception):
     """Raised when an exception is encountered while executing a sequence action"""
+
+
+class NodeTimeoutError(Exception):
+    """Raised when a node function runs longer than its timeout"""
+
+
+class ProcessTimeoutError(Exception):
+    """Raised when a process runs longer than the flow's timeout"""
+
+
+class RunQueueFullError(Exception):
+    """Raised when a run is submitted while the run queue is full"""
+
+
+class WorkerRunError(Exception):
+    """Raised when a run handed to a worker process fails"""
+
+
+class CheckpointNotFoundError(Exception):
+    """Raised when a run is resumed from a checkpoint that can't be loaded"""
+
+
+class WorkerExitError(WorkerRunError):
+    """Raised when the worker process a run was handed to exits before the run finished"""
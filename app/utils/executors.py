@@ -0,0 +1,256 @@
+# This file is licensed under the CC BY-NC-SA 4.0 license.
+# See https://creativecommons.org/licenses/by-nc-sa/4.0/ for details.
+
+import os
+import time
+import asyncio
+import functools
+import importlib
+import threading
+import contextvars
+import multiprocessing
+from fnmatch import fnmatchcase
+from typing import Any, Callable
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+# functions matching these patterns are cheap enough to call directly on the
+# event loop, everything else that isn't a coroutine goes to the thread pool
+INLINE_FUNCTIONS = [
+    pattern.strip()
+    for pattern in os.getenv("PFA_INLINE_FUNCTIONS", "operator.*,builtins.*").split(",")
+    if pattern.strip()
+]
+
+# modules imported by every worker of the process pool when it starts
+PRELOAD_MODULES = [
+    module.strip()
+    for module in os.getenv("PFA_PRELOAD_MODULES", "").split(",")
+    if module.strip()
+]
+# bytes args and results at least this large go through shared memory
+# instead of being pickled through the pool's pipe
+SHM_THRESHOLD = int(os.getenv("PFA_SHM_THRESHOLD", str(1024 * 1024)))
+
+# the process pool and the worker processes are spawned rather than forked,
+# this process already runs threads
+spawn_context = multiprocessing.get_context("spawn")
+
+_thread_pool: ThreadPoolExecutor | None = None
+_process_pool: ProcessPoolExecutor | None = None
+
+# set for a call on a worker thread once the node times out or its run is
+# stopped. a running thread can't be interrupted, so long running sync
+# functions check cancelled() to give up early
+cancel_event: contextvars.ContextVar[threading.Event | None] = contextvars.ContextVar(
+    "cancel_event", default=None
+)
+
+
+def cancelled() -> bool:
+    event = cancel_event.get()
+    return event is not None and event.is_set()
+
+
+def get_thread_pool() -> ThreadPoolExecutor:
+    global _thread_pool
+    if _thread_pool is None:
+        max_workers = os.getenv("PFA_THREAD_POOL_SIZE")
+        _thread_pool = ThreadPoolExecutor(
+            max_workers=int(max_workers) if max_workers else None,
+            thread_name_prefix="pfa-node",
+        )
+    return _thread_pool
+
+
+def shutdown_thread_pool(wait: bool = True):
+    global _thread_pool
+    if _thread_pool is not None:
+        _thread_pool.shutdown(wait=wait)
+        _thread_pool = None
+
+
+def is_inline(function: str, patterns: list[str] = None) -> bool:
+    patterns = INLINE_FUNCTIONS if patterns is None else patterns
+    return any(fnmatchcase(function, pattern) for pattern in patterns)
+
+
+async def run_in_thread(
+    func: Callable,
+    args: list[Any],
+    kwargs: dict[str, Any],
+    executor: ThreadPoolExecutor = None,
+) -> tuple[Any, float, float]:
+    """Calls a sync function on a worker thread and returns its result along
+    with how long it waited for a free thread and how long it ran. Cancelling
+    the awaiting task sets the call's cancel_event."""
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    event = threading.Event()
+    context.run(cancel_event.set, event)
+    timings = {}
+
+    def call():
+        timings["started"] = time.perf_counter()
+        try:
+            return context.run(func, *args, **kwargs)
+        finally:
+            timings["finished"] = time.perf_counter()
+
+    submitted = time.perf_counter()
+    try:
+        result = await loop.run_in_executor(executor or get_thread_pool(), call)
+    except asyncio.CancelledError:
+        event.set()
+        raise
+    return (
+        result,
+        timings["started"] - submitted,
+        timings["finished"] - timings["started"],
+    )
+
+
+def _preload(modules: list[str]):
+    for module in modules:
+        importlib.import_module(module)
+
+
+def _ping():
+    return os.getpid()
+
+
+def get_process_pool() -> ProcessPoolExecutor:
+    global _process_pool
+    if _process_pool is None:
+        max_workers = os.getenv("PFA_PROCESS_POOL_SIZE")
+        max_workers = int(max_workers) if max_workers else os.cpu_count()
+        _process_pool = ProcessPoolExecutor(
+            max_workers=max_workers,
+            mp_context=spawn_context,
+            initializer=_preload,
+            initargs=(PRELOAD_MODULES,),
+        )
+        # start every worker now, so the first nodes sent to the pool don't
+        # wait on a python interpreter starting up and the preloads
+        for _ in range(max_workers):
+            _process_pool.submit(_ping)
+    return _process_pool
+
+
+def shutdown_process_pool(wait: bool = True):
+    global _process_pool
+    if _process_pool is not None:
+        _process_pool.shutdown(wait=wait)
+        _process_pool = None
+
+
+class SharedBytes:
+    """Stands in for a bytes value placed in shared memory. The side that
+    creates the block leaves it to the other side to unlink, and stops
+    tracking it so the resource tracker doesn't report it as leaked."""
+
+    def __init__(self, name: str, size: int):
+        self.name = name
+        self.size = size
+
+    @classmethod
+    def create(cls, value: bytes, track: bool = True) -> "SharedBytes":
+        shm = SharedMemory(create=True, size=max(len(value), 1))
+        shm.buf[: len(value)] = value
+        shared = cls(shm.name, len(value))
+        shm.close()
+        if not track:
+            resource_tracker.unregister(shm._name, "shared_memory")
+        return shared
+
+    def read(self, unlink: bool = False) -> bytes:
+        shm = SharedMemory(name=self.name)
+        try:
+            return bytes(shm.buf[: self.size])
+        finally:
+            shm.close()
+            if unlink:
+                shm.unlink()
+            else:
+                resource_tracker.unregister(shm._name, "shared_memory")
+
+    def unlink(self):
+        shm = SharedMemory(name=self.name)
+        shm.close()
+        shm.unlink()
+
+
+def _share(value: Any, track: bool = True) -> Any:
+    if isinstance(value, (bytes, bytearray)) and len(value) >= SHM_THRESHOLD:
+        return SharedBytes.create(value, track)
+    return value
+
+
+def _call_in_process(function: str, args: list[Any], kwargs: dict[str, Any]):
+    # runs on a worker of the process pool, the function is looked up there
+    # by name so only its name is pickled
+    from app.utils.resolver import resolve
+    from app.utils.http import Response, read_response
+
+    started = time.time()
+    args = [a.read() if isinstance(a, SharedBytes) else a for a in args]
+    kwargs = {k: v.read() if isinstance(v, SharedBytes) else v for k, v in kwargs.items()}
+    func, is_async, _, _ = resolve(function)
+    result = asyncio.run(func(*args, **kwargs)) if is_async else func(*args, **kwargs)
+    if isinstance(result, Response):
+        result = read_response(result)
+    # the caller unlinks the block once it has read it
+    return _share(result, track=False), started, time.time()
+
+
+def _release(shared: list[SharedBytes], future: Future):
+    # unlinks the blocks of a call that was cancelled while in the pool
+    blocks = list(shared)
+    if not future.cancelled() and future.exception() is None:
+        result = future.result()[0]
+        if isinstance(result, SharedBytes):
+            blocks.append(result)
+    for block in blocks:
+        try:
+            block.unlink()
+        except FileNotFoundError:
+            pass
+
+
+async def run_in_process(
+    function: str,
+    args: list[Any],
+    kwargs: dict[str, Any],
+    executor: ProcessPoolExecutor = None,
+) -> tuple[Any, float, float]:
+    """Calls the function named function on a worker of the process pool and
+    returns its result along with how long it waited for a free worker and
+    how long it ran. Large bytes args and results cross in shared memory."""
+    global _process_pool
+    args = [_share(a) for a in args]
+    kwargs = {k: _share(v) for k, v in kwargs.items()}
+    shared = [v for v in (*args, *kwargs.values()) if isinstance(v, SharedBytes)]
+    submitted = time.time()
+    try:
+        future = (executor or get_process_pool()).submit(_call_in_process, function, args, kwargs)
+        result, started, finished = await asyncio.wrap_future(future)
+    except asyncio.CancelledError:
+        # a call that already started still reads the args and leaves its
+        # result behind, both are unlinked once it is done
+        future.add_done_callback(functools.partial(_release, shared))
+        shared = []
+        raise
+    except BrokenProcessPool:
+        # a worker died, the next call starts a new pool
+        if executor is None and _process_pool is not None:
+            _process_pool.shutdown(wait=False)
+            _process_pool = None
+        raise
+    finally:
+        for value in shared:
+            value.unlink()
+    if isinstance(result, SharedBytes):
+        result = result.read(unlink=True)
+    return result, max(started - submitted, 0.0), finished - started
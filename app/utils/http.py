@@ -0,0 +1,95 @@
+# This file is licensed under the CC BY-NC-SA 4.0 license.
+# See https://creativecommons.org/licenses/by-nc-sa/4.0/ for details.
+
+import os
+import time
+import threading
+from typing import Any
+from urllib.parse import urlsplit
+
+import requests
+from requests import Response
+from requests.adapters import HTTPAdapter
+
+
+def read_response(response: Response) -> Any:
+    """Raises for error statuses and returns the JSON body, or the text when
+    the body isn't JSON."""
+    response.raise_for_status()
+    try:
+        return response.json() or response.text
+    except ValueError:
+        return response.text
+
+
+class HttpClient:
+    """Keeps one pooled, keep-alive session per host so repeated requests to
+    the same API reuse their connections instead of opening new ones, and
+    counts requests, errors, time and connections opened per host."""
+
+    def __init__(self, pool_size: int = None, timeout: float = None):
+        self.pool_size = pool_size or int(os.getenv("PFA_HTTP_POOL_SIZE", "10"))
+        self.timeout = timeout or float(os.getenv("PFA_HTTP_TIMEOUT", "30"))
+        self._sessions: dict[str, requests.Session] = {}
+        self._stats: dict[str, dict[str, float]] = {}
+        self._lock = threading.Lock()
+
+    def session(self, url: str) -> requests.Session:
+        host = self._host(url)
+        session = self._sessions.get(host)
+        if session is None:
+            with self._lock:
+                session = self._sessions.get(host)
+                if session is None:
+                    session = requests.Session()
+                    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+                    session.mount("http://", adapter)
+                    session.mount("https://", adapter)
+                    self._sessions[host] = session
+                    self._stats[host] = {"requests": 0, "errors": 0, "seconds": 0.0}
+        return session
+
+    def request(self, method: str, url: str, **kwargs) -> Response:
+        session = self.session(url)
+        stats = self._stats[self._host(url)]
+        kwargs.setdefault("timeout", self.timeout)
+        start = time.perf_counter()
+        try:
+            return session.request(method, url, **kwargs)
+        except Exception:
+            with self._lock:
+                stats["errors"] += 1
+            raise
+        finally:
+            with self._lock:
+                stats["requests"] += 1
+                stats["seconds"] += time.perf_counter() - start
+
+    def metrics(self) -> dict[str, dict[str, float]]:
+        metrics = {}
+        with self._lock:
+            for host, session in self._sessions.items():
+                connections = 0
+                # http:// and https:// are mounted on the same adapter
+                for adapter in {id(a): a for a in session.adapters.values()}.values():
+                    pools = adapter.poolmanager.pools
+                    for key in pools.keys():
+                        pool = pools.get(key)
+                        connections += pool.num_connections if pool else 0
+                metrics[host] = {**self._stats[host], "connections": connections}
+        return metrics
+
+    def close(self):
+        with self._lock:
+            for session in self._sessions.values():
+                session.close()
+            self._sessions.clear()
+            self._stats.clear()
+
+    @staticmethod
+    def _host(url: str) -> str:
+        parts = urlsplit(url)
+        return f"{parts.scheme}://{parts.netloc}"
+
+
+http_client = HttpClient()
@@ -1,31 +1,184 @@
+import os
+import gzip
+import time
+import reprlib
 import threading
-import requests
 import json
 import logging
-from logging import getLogger, getLevelName, StreamHandler, Formatter, Handler, DEBUG
-from queue import Queue
+from collections import Counter, OrderedDict, deque
+from logging import getLogger, getLevelName, StreamHandler, Formatter, Handler, DEBUG, INFO
 
 from app.models import Parameters
-
-# Global log handler
-log_queue: Queue = Queue()
+from app.utils.http import HttpClient
 
 global_logger = getLogger("PyFlowAutomatorCore")
 global_logger.setLevel(DEBUG)
 global_logger.addHandler(StreamHandler())
 
+# largest rendering of a single value in a log message
+LOG_VALUE_LIMIT = int(os.getenv("PFA_LOG_VALUE_LIMIT", "1000"))
+
+_repr = reprlib.Repr()
+_repr.maxlevel = 3
+_repr.maxstring = LOG_VALUE_LIMIT
+_repr.maxother = LOG_VALUE_LIMIT
+_repr.maxlist = _repr.maxtuple = _repr.maxset = _repr.maxdict = 20
+
+
+class Capped:
+    """Renders a value for a log message capped at `limit` characters instead
+    of stringifying all of it. queue_log renders it when the record is queued,
+    and only if the level is enabled, so the log worker never sees the value
+    itself, which the run may go on to change."""
+
+    __slots__ = ("value", "limit")
+
+    def __init__(self, value, limit: int = None):
+        self.value = value
+        self.limit = limit or LOG_VALUE_LIMIT
+
+    def _render(self) -> str:
+        value = self.value
+        return value if isinstance(value, str) else _repr.repr(value)
+
+    def __str__(self) -> str:
+        text = self._render()
+        if len(text) > self.limit:
+            return f"{text[:self.limit]}...({len(text)} chars)"
+        return text
+
+
+class Lazy(Capped):
+    """Like Capped but the value is built by calling `factory` when rendered."""
+
+    __slots__ = ()
+
+    def _render(self) -> str:
+        value = self.value()
+        return value if isinstance(value, str) else _repr.repr(value)
+
+
+def get_level(log_type: str) -> int:
+    level = getLevelName(log_type.upper())
+    return level if isinstance(level, int) else DEBUG
+
+
+class LogQueue:
+    """A bounded queue of records for the log worker. put never blocks, so it
+    is safe to call from coroutines. When maxsize records are waiting, the
+    drop_oldest policy drops the oldest one and drop_debug drops the oldest
+    record below INFO, or the new one if it is below INFO, and only falls back
+    to the oldest when every waiting record is INFO or above."""
+
+    POLICIES = ("drop_oldest", "drop_debug")
+
+    def __init__(self, maxsize: int = None, policy: str = None):
+        self.maxsize = maxsize or int(os.getenv("PFA_LOG_QUEUE_SIZE", "10000"))
+        self.policy = policy or os.getenv("PFA_LOG_DROP_POLICY", "drop_oldest")
+        if self.policy not in self.POLICIES:
+            raise ValueError(f"Log drop policy must be one of {self.POLICIES}, not {self.policy}")
+        # records below INFO wait apart from the others so drop_debug can drop
+        # them first, the sequence numbers keep get in order across both
+        self._debug: deque[tuple[int, tuple]] = deque()
+        self._other: deque[tuple[int, tuple]] = deque()
+        self._sequence = 0
+        self._not_empty = threading.Condition()
+        self._all_done = threading.Condition(self._not_empty)
+        self.unfinished_tasks = 0
+        self._stats = {"queued": 0, "dropped": 0, "dropped_debug": 0}
+
+    def put(self, item: tuple, level: int = INFO) -> bool:
+        """Queues (logger, log_type, record, *args), False when it was the
+        record dropped to make room."""
+        debug = level < INFO
+        with self._not_empty:
+            self._stats["queued"] += 1
+            if len(self._debug) + len(self._other) >= self.maxsize:
+                if self.policy == "drop_debug" and debug and not self._debug:
+                    self._dropped(True)
+                    return False
+                if self.policy == "drop_debug" and self._debug:
+                    self._debug.popleft()
+                    self._dropped(True)
+                else:
+                    self._dropped(self._pop_oldest()[0])
+                # the dropped record never reaches the worker
+                self.unfinished_tasks -= 1
+            self._sequence += 1
+            (self._debug if debug else self._other).append((self._sequence, item))
+            self.unfinished_tasks += 1
+            self._not_empty.notify()
+        return True
+
+    put_nowait = put
+
+    def get(self) -> tuple:
+        with self._not_empty:
+            while not self._debug and not self._other:
+                self._not_empty.wait()
+            return self._pop_oldest()[1]
+
+    def task_done(self):
+        with self._all_done:
+            self.unfinished_tasks -= 1
+            if self.unfinished_tasks <= 0:
+                self._all_done.notify_all()
+
+    def join(self):
+        with self._all_done:
+            while self.unfinished_tasks:
+                self._all_done.wait()
+
+    def qsize(self) -> int:
+        with self._not_empty:
+            return len(self._debug) + len(self._other)
+
+    def metrics(self) -> dict[str, int | str]:
+        with self._not_empty:
+            return {
+                **self._stats,
+                "waiting": len(self._debug) + len(self._other),
+                "maxsize": self.maxsize,
+                "policy": self.policy,
+            }
+
+    def _pop_oldest(self) -> tuple[bool, tuple]:
+        if not self._other or (self._debug and self._debug[0][0] < self._other[0][0]):
+            return True, self._debug.popleft()[1]
+        return False, self._other.popleft()[1]
+
+    def _dropped(self, debug: bool):
+        self._stats["dropped"] += 1
+        if debug:
+            self._stats["dropped_debug"] += 1
+
+
+log_queue = LogQueue()
+
+
+def queue_log(logger: logging.Logger, log_type: str, record: str, *args) -> bool:
+    """Queues a record for the log worker unless the logger would drop it."""
+    level = get_level(log_type)
+    if not logger.isEnabledFor(level):
+        return False
+    # Capped values are rendered now, on the caller's thread, while they still
+    # hold what was logged
+    args = [str(arg) if isinstance(arg, Capped) else arg for arg in args]
+    return log_queue.put((logger, log_type, record, *args), level)
+
+
 def log_worker():
     while True:
-        logger, log_type, record = log_queue.get()
+        logger, log_type, record, *args = log_queue.get()
         if record is None:
             break
 
         try:
             log_method = getattr(logger, log_type.lower(), None)
             if callable(log_method):
-                log_method(record)
+                log_method(record, *args)
             else:
-                logger.log(getattr(logging, log_type.upper(), DEBUG), record)
+                logger.log(get_level(log_type), record, *args)
         except AttributeError:
             global_logger.error(f"Error in log_worker: AttributeError, log_type={log_type}")
         except Exception as e:
@@ -37,57 +190,255 @@ log_thread = threading.Thread(target=log_worker, daemon=True)
 log_thread.start()
 
 class ProcessLogQueueHandler:
-    loggers: dict[str, logging.Logger] = {}
+    """Hands every run a logger. Loggers are built, with their handlers, once
+    per logger name and log configuration and kept for the runs that follow,
+    so repeated runs neither stack handlers nor grow memory. A run gets a
+    LoggerAdapter over the cached logger carrying its own fields (flow and
+    run_id, usable in a log format), and releases it with delete_logger when
+    it finishes. Past PFA_LOGGER_CACHE cached loggers, the least recently used
+    ones no run is using are dropped and handlers left unused are closed."""
+
+    # the loggers of live runs, by the key create_logger returned
+    loggers: dict[str, logging.LoggerAdapter] = {}
+    cache_size = int(os.getenv("PFA_LOGGER_CACHE", "1000"))
+    _cached: OrderedDict[tuple, logging.Logger] = OrderedDict()
+    _handlers: dict[tuple, list[Handler]] = {}
+    _in_use: Counter = Counter()
+    _keys: dict[str, tuple] = {}
+    _lock = threading.Lock()
+    # every process logger writes to this one
+    _stream_handler = StreamHandler()
 
     @classmethod
-    def create_logger(cls, logger_name: str, parameters: Parameters):
-        logger = getLogger(logger_name)
-        logger.setLevel(DEBUG)
-        logger.addHandler(StreamHandler())
-        if parameters and parameters.log and parameters.log.url:
-            handler = CustomHandler(parameters.log.url)
-            handler.setLevel(getLevelName(parameters.log.level))
-            if isinstance(parameters.log.format, str):
-                formatter = Formatter(fmt=parameters.log.format)
-            elif isinstance(parameters.log.format, dict):
-                formatter = JSONFormatter(parameters.log.format)
-            handler.setFormatter(formatter)
-            logger.addHandler(handler)
-        cls.loggers[logger_name] = logger
-        return cls
-    
+    def create_logger(cls, logger_name: str, parameters: Parameters, run_id: str = None) -> str:
+        config = cls._config(parameters)
+        key = f"{logger_name}:{run_id}" if run_id else logger_name
+        with cls._lock:
+            cached = cls._cached.get((logger_name, config))
+            if cached is None:
+                cached = cls._build(logger_name, config)
+                cls._cached[(logger_name, config)] = cached
+            cls._cached.move_to_end((logger_name, config))
+            if key in cls._keys:
+                cls._in_use[cls._keys[key]] -= 1
+            cls._in_use[(logger_name, config)] += 1
+            cls._keys[key] = (logger_name, config)
+            cls.loggers[key] = logging.LoggerAdapter(
+                cached, {"flow": logger_name, "run_id": run_id or ""}
+            )
+            unused = cls._evict()
+        cls._close(unused)
+        return key
+
     @classmethod
     def delete_logger(cls, logger_name: str):
-        cls.loggers.pop(logger_name, None)
+        with cls._lock:
+            cls.loggers.pop(logger_name, None)
+            cache_key = cls._keys.pop(logger_name, None)
+            if cache_key:
+                cls._in_use[cache_key] -= 1
+                if cls._in_use[cache_key] <= 0:
+                    del cls._in_use[cache_key]
+            unused = cls._evict()
+        cls._close(unused)
+
+    @staticmethod
+    def _config(parameters: Parameters) -> tuple | None:
+        if not (parameters and parameters.log and parameters.log.url):
+            return None
+        log = parameters.log
+        if isinstance(log.format, dict):
+            return (log.url, log.level, json.dumps(log.format, sort_keys=True), True)
+        return (log.url, log.level, log.format, False)
+
+    @classmethod
+    def _build(cls, logger_name: str, config: tuple | None) -> logging.Logger:
+        # made directly rather than through getLogger, which keeps every
+        # logger it made for the life of the process
+        logger = logging.Logger(logger_name)
+        level = get_level(os.getenv("PFA_LOG_LEVEL", "INFO"))
+        if config not in cls._handlers:
+            handlers = [cls._stream_handler]
+            if config:
+                url, log_level, log_format, is_json = config
+                handler = CustomHandler(url)
+                handler.setLevel(getLevelName(log_level))
+                if is_json:
+                    handler.setFormatter(JSONFormatter(json.loads(log_format)))
+                else:
+                    handler.setFormatter(Formatter(fmt=log_format))
+                handlers.append(handler)
+            cls._handlers[config] = handlers
+        for handler in cls._handlers[config]:
+            logger.addHandler(handler)
+        if config:
+            level = min(level, get_level(config[1]))
+        logger.setLevel(level)
+        return logger
+
+    @classmethod
+    def _evict(cls) -> list[Handler]:
+        # called with the lock held, returns the handlers no cached logger
+        # uses anymore for the caller to close once it has let go of it
+        if len(cls._cached) <= cls.cache_size:
+            return []
+        for cache_key in list(cls._cached):
+            if len(cls._cached) <= cls.cache_size:
+                break
+            if not cls._in_use[cache_key]:
+                del cls._in_use[cache_key]
+                del cls._cached[cache_key]
+        configs = {config for _, config in cls._cached}
+        unused = []
+        for config in list(cls._handlers):
+            if config not in configs:
+                unused.extend(h for h in cls._handlers.pop(config) if h is not cls._stream_handler)
+        return unused
+
+    @staticmethod
+    def _close(handlers: list[Handler]):
+        # closing a CustomHandler waits for its last batch to be sent, which
+        # mustn't hold up the event loop the logger was released on
+        if handlers:
+            threading.Thread(
+                target=lambda: [handler.close() for handler in handlers], name="pfa-log-close"
+            ).start()
+
+    @classmethod
+    def is_enabled(cls, logger_name: str, log_type: str) -> bool:
+        logger = cls.loggers.get(logger_name)
+        return bool(logger) and logger.isEnabledFor(get_level(log_type))
 
     @classmethod
-    def log(cls, logger_name: str, log_type: str, record: str):
+    def log(cls, logger_name: str, log_type: str, record: str, *args):
+        # records the logger would drop are never queued, and Capped and Lazy
+        # args are only rendered for the records that are
         logger = cls.loggers.get(logger_name)
         if logger:
-            log_queue.put((logger, log_type, record))
+            queue_log(logger, log_type, record, *args)
 
 class CustomHandler(Handler):
-    def __init__(self, url: str):
+    """Ships formatted records to url in batches from a thread of its own, so
+    a slow or unreachable collector never holds up the log worker. A batch is
+    sent once batch_size records are waiting, and whatever is waiting every
+    flush_interval seconds, one record per line, gzipped, over a kept alive
+    connection. A failed batch is retried with exponential backoff while new
+    records keep buffering, up to max_buffered records, past which the oldest
+    are dropped."""
+
+    def __init__(
+        self,
+        url: str,
+        batch_size: int = None,
+        flush_interval: float = None,
+        max_buffered: int = None,
+        retries: int = None,
+    ):
         super().__init__()
         self.url = url
+        self.batch_size = batch_size or int(os.getenv("PFA_LOG_BATCH_SIZE", "100"))
+        self.flush_interval = flush_interval or float(os.getenv("PFA_LOG_FLUSH_INTERVAL", "1"))
+        self.max_buffered = max_buffered or int(os.getenv("PFA_LOG_BUFFER_SIZE", "10000"))
+        self.retries = retries if retries is not None else int(os.getenv("PFA_LOG_RETRIES", "3"))
+        self._client = HttpClient(pool_size=1)
+        self._records: deque[str] = deque()
+        self._batch: list[str] = []
+        self._wake = threading.Condition()
+        self._closed = False
+        self._stopped = threading.Event()
+        self._stats = {"sent": 0, "batches": 0, "retries": 0, "dropped": 0}
+        self._shipper = threading.Thread(target=self._ship, name="pfa-log-shipper", daemon=True)
+        self._shipper.start()
 
     def emit(self, record):
         try:
             record = self.format(record)
-            if isinstance(record, str):
-                requests.post(self.url, data=record)
-            elif isinstance(record, dict):
-                requests.post(self.url, json=record)
-        except (requests.exceptions.RequestException, Exception) as e:
-            global_logger.error(f"Error in CustomHandler: {str(e)}")
+            if not isinstance(record, str):
+                record = json.dumps(record, default=str)
+            with self._wake:
+                if len(self._records) >= self.max_buffered:
+                    self._records.popleft()
+                    self._stats["dropped"] += 1
+                self._records.append(record)
+                if len(self._records) >= self.batch_size:
+                    self._wake.notify()
+        except Exception:
+            self.handleError(record)
+
+    def flush(self, timeout: float = None):
+        """Waits until every record buffered so far was sent or dropped."""
+        deadline = time.monotonic() + (timeout or self.flush_interval + 5)
+        with self._wake:
+            while (self._records or self._batch) and self._shipper.is_alive():
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                # wakes the shipper to send what is waiting without a full batch
+                self._wake.notify_all()
+                self._wake.wait(min(remaining, 0.05))
+
+    def close(self):
+        with self._wake:
+            self._closed = True
+            self._wake.notify()
+        self._stopped.set()
+        self._shipper.join(self.flush_interval + 5)
+        self._client.close()
+        super().close()
+
+    def metrics(self) -> dict[str, int]:
+        with self._wake:
+            return {**self._stats, "buffered": len(self._records) + len(self._batch)}
+
+    def _ship(self):
+        while True:
+            with self._wake:
+                if not self._closed and len(self._records) < self.batch_size:
+                    self._wake.wait(self.flush_interval)
+                if not self._records:
+                    if self._closed:
+                        return
+                    continue
+                self._batch = [
+                    self._records.popleft()
+                    for _ in range(min(self.batch_size, len(self._records)))
+                ]
+            self._send(self._batch)
+            with self._wake:
+                self._batch = []
+                self._wake.notify_all()
+
+    def _send(self, batch: list[str]):
+        body = gzip.compress("\n".join(batch).encode(), compresslevel=5)
+        content_type = (
+            "application/x-ndjson" if isinstance(self.formatter, JSONFormatter) else "text/plain"
+        )
+        headers = {"Content-Type": content_type, "Content-Encoding": "gzip"}
+        for attempt in range(self.retries + 1):
+            try:
+                self._client.request("POST", self.url, data=body, headers=headers).raise_for_status()
+                with self._wake:
+                    self._stats["sent"] += len(batch)
+                    self._stats["batches"] += 1
+                return
+            except Exception as e:
+                global_logger.error(f"Error in CustomHandler: {str(e)}")
+                if attempt == self.retries:
+                    break
+                with self._wake:
+                    self._stats["retries"] += 1
+                # only this thread waits, records keep buffering meanwhile. a
+                # close cuts the wait short so shutdown isn't held up
+                if self._stopped.wait(min(0.5 * 2**attempt, 30)):
+                    break
+        with self._wake:
+            self._stats["dropped"] += len(batch)
 
 class JSONFormatter(Formatter):
     def __init__(self, fmt: dict):
         super().__init__(json.dumps(fmt))
 
     def format(self, record) -> str:
-        print(f"record: {record}")
-        print(f"record.__dict__: {record.__dict__}")
         record.message = json.dumps(record.getMessage())[1:-1]
         if self.usesTime():
             record.asctime = self.formatTime(record, self.datefmt)
@@ -1,68 +1,522 @@
+# This file is licensed under the CC BY-NC-SA 4.0 license.
+# See https://creativecommons.org/licenses/by-nc-sa/4.0/ for details.
+
+import os
+import bisect
 import threading
-import logging
-import requests
-from time import sleep
-from queue import Queue
-from typing import Any
-
-class Whisperer:
-    # Queues for thread-safe logging and metric sending
-    log_queue: Queue = Queue()
-    metric_queue: Queue = Queue()
-
-    def __init__(self, parameters: dict[str, Any] = None):
-        if parameters:
-            if log_params := parameters.get("log"):
-                self.logger.setLevel(log_params.get("level"))
-                self.logger.setFormatter(logging.Formatter(log_params.get("format", "%(asctime)s - %(name)s - %(levelname)s - %(message)s")))
-                if url := log_params.get("url"):
-                    self.logger.addHandler(logging.StreamHandler(url))
-                    self.logger.addHandler(logging.StreamHandler())
-                else:
-                    self.logger.addHandler(logging.StreamHandler())
-            if metric_params := parameters.get("metric"):
-                self._metrics_url = metric_params.get("url")
-        self.start_signals()
-
-    def log_worker(self):
-        while True:
-            record = self.log_queue.get()
-            print(record)
-            if record is None:
-                break
-            self.logger.info(record) # need to replace this with actual logging logic
-            self.log_queue.task_done()
-
-    def metric_worker(self):
-        while True:
-            record = self.metric_queue.get()
-            print(record)
-            if record is None:
+
+from app.utils.http import HttpClient
+from app.utils.logs import global_logger
+
+# seconds, from a fast inline function to a slow http call
+DEFAULT_BUCKETS = (
+    0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+    0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0,
+)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: tuple[str, ...], values: tuple, extra: str = None) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    """A value per set of label values that only goes up."""
+
+    type = "counter"
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values: dict[tuple, float] = {}
+        # the values as of the last drain
+        self._drained: dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount: float = 1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def value(self, *label_values) -> float:
+        return self._values.get(label_values, 0)
+
+    def render(self) -> list[str]:
+        with self._lock:
+            values = list(self._values.items())
+        return [f"{self.name}{_labels(self.labels, key)} {value}" for key, value in values]
+
+    def drain(self) -> dict[tuple, float]:
+        """Returns what was counted since the last drain, see MetricsRegistry.drain."""
+        with self._lock:
+            changed = {
+                key: value - self._drained.get(key, 0)
+                for key, value in self._values.items()
+                if value != self._drained.get(key, 0)
+            }
+            self._drained = dict(self._values)
+        return changed
+
+    def merge(self, values: dict[tuple, float]):
+        with self._lock:
+            for key, value in values.items():
+                self._values[key] = self._values.get(key, 0) + value
+
+    def reset(self):
+        with self._lock:
+            self._values.clear()
+            self._drained.clear()
+
+
+class Histogram:
+    """Counts observations per bucket, with their sum and count, per set of
+    label values. A bucket counts the observations up to its bound, the
+    cumulative counts Prometheus expects are only added up when rendered."""
+
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labels: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+    ):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        # [counts per bucket and one past the last, sum, count]
+        self._values: dict[tuple, list] = {}
+        # the series as of the last drain
+        self._drained: dict[tuple, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *label_values):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._values.get(label_values)
+            if series is None:
+                series = self._values[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def count(self, *label_values) -> int:
+        series = self._values.get(label_values)
+        return series[2] if series else 0
+
+    def sum(self, *label_values) -> float:
+        series = self._values.get(label_values)
+        return series[1] if series else 0.0
+
+    def render(self) -> list[str]:
+        with self._lock:
+            values = [(key, list(counts), total, count) for key, (counts, total, count) in self._values.items()]
+        lines = []
+        for key, counts, total, count in values:
+            cumulative = 0
+            for bound, bucket in zip((*self.buckets, "+Inf"), counts):
+                cumulative += bucket
+                le = f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{_labels(self.labels, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labels, key)} {total}")
+            lines.append(f"{self.name}_count{_labels(self.labels, key)} {count}")
+        return lines
+
+    def drain(self) -> dict[tuple, list]:
+        """Returns what was observed since the last drain, see MetricsRegistry.drain."""
+        with self._lock:
+            changed = {}
+            for key, (counts, total, count) in self._values.items():
+                drained = self._drained.get(key)
+                if drained is None:
+                    changed[key] = [list(counts), total, count]
+                elif count != drained[2]:
+                    changed[key] = [
+                        [now - before for now, before in zip(counts, drained[0])],
+                        total - drained[1],
+                        count - drained[2],
+                    ]
+            self._drained = {
+                key: [list(counts), total, count] for key, (counts, total, count) in self._values.items()
+            }
+        return changed
+
+    def merge(self, values: dict[tuple, list]):
+        with self._lock:
+            for key, (counts, total, count) in values.items():
+                series = self._values.get(key)
+                if series is None:
+                    series = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+                for index, bucket in enumerate(counts):
+                    series[0][index] += bucket
+                series[1] += total
+                series[2] += count
+
+    def reset(self):
+        with self._lock:
+            self._values.clear()
+            self._drained.clear()
+
+
+class MetricsRegistry:
+    """The counters and histograms of this process, rendered in the
+    Prometheus text format for /metrics and for pushing to a metric url.
+    The registry holds the series of every flow, so it is only pushed to the
+    urls of allowed_urls (PFA_METRIC_URLS)."""
+
+    def __init__(self, allowed_urls: list[str] = None):
+        self._metrics: dict[str, Counter | Histogram] = {}
+        self._pushers: dict[str, "MetricsPusher"] = {}
+        self._lock = threading.Lock()
+        if allowed_urls is None:
+            allowed_urls = os.getenv("PFA_METRIC_URLS", "").split(",")
+        self.allowed_urls = {url.strip() for url in allowed_urls if url.strip()}
+
+    def counter(self, name: str, help: str, labels: tuple[str, ...] = ()) -> Counter:
+        return self._register(Counter, name, help, labels)
+
+    def histogram(
+        self,
+        name: str,
+        help: str,
+        labels: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+    ) -> Histogram:
+        return self._register(Histogram, name, help, labels, buckets=buckets)
+
+    def render(self) -> str:
+        lines = []
+        for metric in list(self._metrics.values()):
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        for metric in list(self._metrics.values()):
+            metric.reset()
+
+    def drain(self) -> dict[str, dict]:
+        """Returns everything recorded since the last drain, for a process
+        that isn't served at /metrics, such as a worker, to hand over to the
+        one that is with merge. Its own values are left as they are, so what
+        it pushes keeps counting up."""
+        return {name: metric.drain() for name, metric in list(self._metrics.items())}
+
+    def merge(self, drained: dict[str, dict]):
+        for name, values in drained.items():
+            metric = self._metrics.get(name)
+            if metric is not None and values:
+                metric.merge(values)
+
+    def push_to(self, url: str) -> "MetricsPusher | None":
+        """Starts pushing the registry to url, once per url however many runs
+        ask for it, or returns None when url isn't allowed. Each caller
+        releases the pusher once done with it, and a pusher no one uses stops
+        at its next interval."""
+        if url not in self.allowed_urls:
+            return None
+        with self._lock:
+            pusher = self._pushers.get(url)
+            if pusher is None:
+                pusher = self._pushers[url] = MetricsPusher(self, url)
+            pusher.users += 1
+        return pusher
+
+    def release(self, pusher: "MetricsPusher"):
+        with self._lock:
+            pusher.users -= 1
+
+    def close(self):
+        with self._lock:
+            pushers = list(self._pushers.values())
+            self._pushers.clear()
+        for pusher in pushers:
+            pusher.close()
+
+    def _register(self, metric_class, name: str, help: str, labels: tuple[str, ...], **kwargs):
+        metric = self._metrics.get(name)
+        if metric is None:
+            with self._lock:
+                metric = self._metrics.get(name)
+                if metric is None:
+                    metric = self._metrics[name] = metric_class(name, help, labels, **kwargs)
+        if not isinstance(metric, metric_class):
+            raise ValueError(f"Metric {name} is already registered as a {metric.type}")
+        return metric
+
+    def _stop_unused(self, pusher: "MetricsPusher") -> bool:
+        # pushers stop themselves, so one isn't started and stopped each run
+        with self._lock:
+            if pusher.users > 0:
+                return False
+            if self._pushers.get(pusher.url) is pusher:
+                del self._pushers[pusher.url]
+            return True
+
+
+class MetricsPusher:
+    """Posts the whole registry to url every interval seconds from a thread of
+    its own, so runs never wait on the sink. Every push carries the totals so
+    far, so a failed one is not retried, the next push backs off instead, up
+    to 8 intervals apart while the sink keeps failing. It stops once it has
+    no users left, after a last push."""
+
+    def __init__(self, registry: MetricsRegistry, url: str, interval: float = None):
+        self.registry = registry
+        self.url = url
+        self.interval = interval or float(os.getenv("PFA_METRIC_PUSH_INTERVAL", "10"))
+        self.pushes = 0
+        self.failures = 0
+        self.users = 0
+        self._client = HttpClient(pool_size=1)
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._push_forever, name="pfa-metrics", daemon=True)
+        self._thread.start()
+
+    def push(self):
+        response = self._client.request(
+            "POST",
+            self.url,
+            data=self.registry.render().encode(),
+            headers={"Content-Type": "text/plain; version=0.0.4"},
+        )
+        response.raise_for_status()
+        self.pushes += 1
+
+    def close(self):
+        self._stopped.set()
+        self._thread.join(5)
+
+    def _push_forever(self):
+        delay = self.interval
+        while not self._stopped.wait(delay):
+            if self.registry._stop_unused(self):
                 break
+            try:
+                self.push()
+                delay = self.interval
+            except Exception as e:
+                self.failures += 1
+                delay = min(delay * 2, self.interval * 8)
+                global_logger.error(f"Error in MetricsPusher: {str(e)}")
+        try:
+            # the last totals go out when it stops
+            self.push()
+        except Exception:
+            pass
+        self._client.close()
+
+
+registry = MetricsRegistry()
+
+node_duration = registry.histogram(
+    "pfa_node_duration_seconds", "Time node functions took to run.", ("function",)
+)
+node_queue_wait = registry.histogram(
+    "pfa_node_queue_wait_seconds",
+    "Time node functions waited for a free thread or process.",
+    ("function",),
+)
+node_errors = registry.counter(
+    "pfa_node_errors_total", "Node function calls that raised.", ("function", "error")
+)
+run_duration = registry.histogram("pfa_run_duration_seconds", "Time runs took.", ("flow",))
+runs = registry.counter("pfa_runs_total", "Runs by the way they ended.", ("flow", "status"))
+
+
+class LatencyHistogram:
+    """Nanosecond latencies in log-linear buckets, like an HDR histogram: 16
+    buckets per power of two, so a percentile is within about 6% of the true
+    value, in a fixed list of counters whatever the range. Latencies above
+    MAX_NS, about 18 minutes, are counted in the last bucket.
 
-            if not self._metrics_url:
-                self.logger.debug("No metrics URL provided. Skipping metric sending.")
-                self.metric_queue.task_done()
+    record takes no lock, it is on the hot path of every node. Records come
+    from event loop threads, and a count lost to two threads recording at
+    the very same moment doesn't move a percentile."""
+
+    SUB_BITS = 5
+    SUB_COUNT = 1 << SUB_BITS
+    SUB_HALF = SUB_COUNT >> 1
+    MAX_NS = (1 << 40) - 1
+    SIZE = (MAX_NS.bit_length() - SUB_BITS + 2) * SUB_HALF
+
+    def __init__(self):
+        self.counts = [0] * self.SIZE
+        self.total = 0
+        self.min = self.MAX_NS
+        self.max = 0
+
+    def record(self, ns: int):
+        if ns < self.SUB_COUNT:
+            index = ns if ns > 0 else 0
+        else:
+            if ns > self.MAX_NS:
+                ns = self.MAX_NS
+            shift = ns.bit_length() - self.SUB_BITS
+            index = (shift + 1) * self.SUB_HALF + (ns >> shift) - self.SUB_HALF
+        self.counts[index] += 1
+        self.total += ns
+        if ns > self.max:
+            self.max = ns
+        if ns < self.min:
+            self.min = ns
+
+    @property
+    def count(self) -> int:
+        return sum(self.counts)
+
+    @classmethod
+    def bounds(cls, index: int) -> tuple[int, int]:
+        """The lowest value of a bucket and the lowest of the next one."""
+        if index < cls.SUB_COUNT:
+            return index, index + 1
+        shift = index // cls.SUB_HALF - 1
+        mantissa = index % cls.SUB_HALF + cls.SUB_HALF
+        return mantissa << shift, (mantissa + 1) << shift
+
+    def percentile(self, q: float) -> int:
+        """The value q percent of the recorded latencies are at or below, the
+        middle of its bucket, kept within the recorded min and max."""
+        counts = list(self.counts)
+        count = sum(counts)
+        if not count:
+            return 0
+        rank = max(1, round(q / 100 * count))
+        if rank >= count:
+            return self.max
+        seen = 0
+        for index, bucket in enumerate(counts):
+            seen += bucket
+            if seen >= rank:
+                lower, upper = self.bounds(index)
+                return min(max((lower + upper - 1) // 2, self.min), self.max)
+        return self.max
+
+    def merge(self, other: "LatencyHistogram"):
+        for index, bucket in enumerate(list(other.counts)):
+            if bucket:
+                self.counts[index] += bucket
+        self.total += other.total
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    def summary(self) -> dict[str, float | int]:
+        ms = 1_000_000
+        count = self.count
+        return {
+            "count": count,
+            "mean_ms": self.total / count / ms if count else 0.0,
+            "min_ms": self.min / ms if count else 0.0,
+            "p50_ms": self.percentile(50) / ms,
+            "p90_ms": self.percentile(90) / ms,
+            "p99_ms": self.percentile(99) / ms,
+            "p999_ms": self.percentile(99.9) / ms,
+            "max_ms": self.max / ms,
+        }
+
+    def export(self) -> dict:
+        counts = list(self.counts)
+        count = sum(counts)
+        return {
+            "count": count,
+            "total_ns": self.total,
+            "min_ns": self.min if count else 0,
+            "max_ns": self.max,
+            # the lowest value of each bucket that has any, and its count
+            "buckets": {self.bounds(index)[0]: bucket for index, bucket in enumerate(counts) if bucket},
+        }
+
+
+class LatencyRecorder:
+    """A LatencyHistogram per flow and function. Past max_series pairs, new
+    ones are counted as dropped instead of recorded."""
+
+    def __init__(self, max_series: int = None):
+        self.max_series = max_series or int(os.getenv("PFA_LATENCY_MAX_SERIES", "10000"))
+        self.dropped = 0
+        self._histograms: dict[tuple[str, str], LatencyHistogram] = {}
+        self._lock = threading.Lock()
+
+    def record(self, flow: str, function: str, ns: int):
+        histogram = self._histograms.get((flow, function))
+        if histogram is None:
+            with self._lock:
+                histogram = self._histograms.get((flow, function))
+                if histogram is None:
+                    if len(self._histograms) >= self.max_series:
+                        self.dropped += 1
+                        return
+                    histogram = self._histograms[(flow, function)] = LatencyHistogram()
+        histogram.record(ns)
+
+    def get(self, flow: str, function: str) -> LatencyHistogram | None:
+        return self._histograms.get((flow, function))
+
+    def query(
+        self, flow: str = None, function: str = None, sort: str = "p99_ms", limit: int = None
+    ) -> list[dict]:
+        """Summaries of the flows and functions matching flow and function,
+        slowest first by sort. Without flow, a function's histograms of every
+        flow are merged into one."""
+        selected: dict[tuple[str, str], LatencyHistogram] = {}
+        for (series_flow, series_function), histogram in list(self._histograms.items()):
+            if flow is not None and series_flow != flow:
+                continue
+            if function is not None and series_function != function:
                 continue
+            if flow is not None:
+                selected[(series_flow, series_function)] = histogram
+                continue
+            merged = selected.setdefault(("*", series_function), LatencyHistogram())
+            merged.merge(histogram)
+        rows = [
+            {"flow": series_flow, "function": series_function, **histogram.summary()}
+            for (series_flow, series_function), histogram in selected.items()
+        ]
+        rows.sort(key=lambda row: row.get(sort, 0), reverse=True)
+        return rows[:limit] if limit else rows
+
+    def export(self) -> list[dict]:
+        """Every histogram with its buckets, which can be merged elsewhere."""
+        return [
+            {"flow": flow, "function": function, "unit": "ns", **histogram.export()}
+            for (flow, function), histogram in list(self._histograms.items())
+        ]
 
-            for i in range(10):
-                try:
-                    requests.post(self._metrics_url, data=record).raise_for_status()
-                except requests.exceptions.RequestException as e:
-                    if i == 10:
-                        self.logger.error(f"Max retries exceeded (10). Failed to send metric {record}")
-                        break
-                    self.logger.error(f"Retry {i}. Failed to send metric: {e}")
-                    sleep(2)
-                    continue
-            self.metric_queue.task_done()
+    def drain(self) -> tuple[dict[tuple[str, str], LatencyHistogram], int]:
+        """Takes the histograms and the dropped count recorded since the last
+        drain, for a process whose latencies aren't served, such as a worker,
+        to hand over to the one that serves them with merge."""
+        with self._lock:
+            histograms, self._histograms = self._histograms, {}
+            dropped, self.dropped = self.dropped, 0
+        return histograms, dropped
 
-    def start_signals(self):
-        # Start the log and metric worker threads
-        log_thread = threading.Thread(target=self.log_worker, daemon=True)
-        log_thread.start()
+    def merge(self, histograms: dict[tuple[str, str], LatencyHistogram], dropped: int = 0):
+        with self._lock:
+            self.dropped += dropped
+            for key, other in histograms.items():
+                histogram = self._histograms.get(key)
+                if histogram is None:
+                    if len(self._histograms) >= self.max_series:
+                        self.dropped += other.count
+                        continue
+                    histogram = self._histograms[key] = LatencyHistogram()
+                histogram.merge(other)
 
-        metric_thread = threading.Thread(target=self.metric_worker, daemon=True)
-        metric_thread.start()
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+            self.dropped = 0
 
 
+latency = LatencyRecorder()
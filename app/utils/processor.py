@@ -1,12 +1,17 @@
 # This file is licensed under the CC BY-NC-SA 4.0 license.
 # See https://creativecommons.org/licenses/by-nc-sa/4.0/ for details.
 
+import os
 import time
-import json
+import uuid
 import inspect
 import asyncio
-import threading
+import weakref
+from collections import Counter
+from contextlib import nullcontext
+from contextvars import ContextVar
 from typing import Any, Callable
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from requests import Response
 from app.utils.exceptions import (
     ArgumentError,
@@ -19,12 +24,35 @@ from app.utils.exceptions import (
     BranchError,
     ForEachError,
     SequenceError,
+    ParallelError,
     JSONExtractionError,
+    NodeTimeoutError,
+    ProcessTimeoutError,
+    CheckpointNotFoundError,
+)
+
+from app.models import CompiledFlow, Edge, Flow, Node
+from app.utils.logs import ProcessLogQueueHandler, Capped, Lazy
+from app.utils.executors import is_inline, run_in_process, run_in_thread
+from app.utils.scope import Scope
+from app.utils.resolver import resolve, resolve_flow
+from app.utils.snapshot import failure_snapshot
+from app.utils.http import read_response
+from app.utils.cache import MISSING, ResultCache, result_cache
+from app.utils.checkpoint import checkpoint_store
+from app.utils.metrics import (
+    latency,
+    node_duration,
+    node_errors,
+    node_queue_wait,
+    registry,
+    run_duration,
+    runs,
 )
 
-from app.models import Flow, Node
-from app.utils.logs import ProcessLogQueueHandler
 
+# an except edge with this source handle is followed when the node times out
+TIMEOUT_HANDLE = "__timeout__"
 
 custom_functions = [
     "branch",
@@ -35,6 +63,20 @@ custom_functions = [
 ]
 
 
+def call_and_read(func: Callable, args: list[Any], kwargs: dict[str, Any]) -> Any:
+    # a requests.Response is read on the calling (worker) thread
+    r = func(*args, **kwargs)
+    return read_response(r) if isinstance(r, Response) else r
+
+
+def format_duration(duration: float) -> str:
+    if duration < 0.001:
+        return f"{duration * 1000000:.2f}μs"
+    if duration < 1:
+        return f"{duration * 1000:.2f}ms"
+    return f"{duration:.2f}s"
+
+
 class Process:
     def __init__(
         self,
@@ -42,71 +84,364 @@ class Process:
         update: Callable[[dict[str, Any]], None] = None,
         allow_list: list = None,
         ws: bool = False,
+        max_concurrency: int = None,
+        executor: ThreadPoolExecutor = None,
+        inline_functions: list[str] = None,
+        process_executor: ProcessPoolExecutor = None,
+        cache: ResultCache = None,
+        checkpoints=None,
+        checkpoint_id: str = None,
+        resume: bool = False,
+        variables: dict[str, Any] = None,
+        graph: CompiledFlow = None,
+        run_id: str = None,
     ):
         self._flow = flow
+        # runs of one flow can share a graph compiled once
+        self._graph: CompiledFlow = graph or flow.compile()
         self._update = update
-        self._variables = self._flow.variables.copy()
-        self._allow_list = allow_list.extend(custom_functions) if allow_list else None
+        # writes land in the top layer, the flow's own variables are never
+        # copied. variables given for this run sit between the two
+        if variables:
+            self._root_variables = Scope({}, variables, self._flow.variables)
+        else:
+            self._root_variables = Scope({}, self._flow.variables)
+        # loop iterations and parallel branches run in a child layer of the
+        # scope they started from, the layer for the current task is kept here
+        self._scope: ContextVar[Scope | None] = ContextVar(
+            f"scope_{id(self)}", default=None
+        )
+        self._allow_list = [*allow_list, *custom_functions] if allow_list else None
         self.ws = ws
 
-        # Create a unique logger for this process
-        self.logger_name = f"ProcessLogger.{flow.name}.{flow.id}"
-        self.logger = ProcessLogQueueHandler.create_logger(self.logger_name, flow.parameters)
+        # caps how many node functions of this process run at once when
+        # independent upstream producers are evaluated concurrently
+        self.max_concurrency = max_concurrency or int(
+            os.getenv("PFA_MAX_CONCURRENCY", "10")
+        )
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        # loop iterations and parallel branches are already bounded by their
+        # own max_concurrency, so each gets a limit of its own instead of
+        # sharing the one of the process, which would cap them at it
+        self._limit: ContextVar[asyncio.Semaphore | None] = ContextVar(
+            f"limit_{id(self)}", default=None
+        )
+        # sync functions run on this pool (the shared one when not given)
+        # unless they match one of the inline patterns
+        self._executor = executor
+        self._inline_functions = inline_functions
+        # nodes whose executor is "process" run on this pool of processes
+        # (the shared one when not given)
+        self._process_executor = process_executor
+        # results of nodes marked with cache are shared across runs
+        self._cache = cache or result_cache
+        self._producing: dict[tuple[int, str], asyncio.Task] = {}
+        self._resolving_path: ContextVar[tuple[str, ...]] = ContextVar(
+            f"resolving_path_{id(self)}", default=()
+        )
+        parameters = flow.parameters
+        self._timeout = parameters.timeout if parameters else None
+        self._node_timeout = parameters.node_timeout if parameters else None
+
+        # with a store, the variables, the node the run is on and the index of
+        # running loops are saved every PFA_CHECKPOINT_INTERVAL seconds so a
+        # run started with resume and the same checkpoint_id can continue from
+        # there. each run has a checkpoint of its own unless one is given, and
+        # an id of its own unless whoever started it already handed one out
+        self.run_id = run_id or uuid.uuid4().hex
+        self.checkpoint_id = checkpoint_id or self.run_id
+        self._checkpoints = checkpoints or checkpoint_store
+        self._checkpoint_interval = float(os.getenv("PFA_CHECKPOINT_INTERVAL", "30"))
+        self._last_checkpoint = time.monotonic()
+        self._resume = resume
+        self._position = flow.start_id
+        self._loops: dict[str, int] = {}
+
+        # runs of a flow share its cached logger, each through a logger of its
+        # own that is released when the run is done or the process is dropped
+        self.logger = ProcessLogQueueHandler
+        self.logger_name = self.logger.create_logger(
+            f"ProcessLogger.{flow.name}.{flow.id}", flow.parameters, run_id=self.run_id
+        )
+        self._release_logger = weakref.finalize(
+            self, ProcessLogQueueHandler.delete_logger, self.logger_name
+        )
+
+        # run metrics are labelled by flow, node metrics by function. a flow
+        # can pick one of the urls the server allows to push them to, it is
+        # released with the logger
+        self._metric_flow = flow.name or flow.id or ""
+        self._release_pusher = None
+        if parameters and parameters.metric and parameters.metric.url:
+            pusher = registry.push_to(parameters.metric.url)
+            if pusher:
+                self._release_pusher = weakref.finalize(self, registry.release, pusher)
+            else:
+                self.logger.log(
+                    self.logger_name, "warning",
+                    "Metrics are not pushed to %s, it isn't in PFA_METRIC_URLS", parameters.metric.url,
+                )
 
-        self.logger.log(self.logger_name, "info", f"Process initialized: {self._flow.name}")
+        self.logger.log(self.logger_name, "info", "Process initialized: %s", self._flow.name)
+
+    @property
+    def _variables(self) -> Scope:
+        scope = self._scope.get()
+        return self._root_variables if scope is None else scope
 
     async def run(self):
+        start = time.perf_counter()
+        status = "cancelled"
         try:
             self.logger.log(self.logger_name, "info", "Running process")
-            await self._run_function(self._flow.start_id)
+            # checked before anything is resolved, resolving imports modules
+            self._check_allow_list()
+            resolve_flow(self._graph, skip=custom_functions)
+            if self._resume:
+                self._restore()
+            try:
+                await asyncio.wait_for(
+                    self._run_function(self._position, chain=True), self._timeout
+                )
+            except TimeoutError:
+                raise ProcessTimeoutError(
+                    f"Process did not complete within {self._timeout}s"
+                )
             self.logger.log(self.logger_name, "info", "Running process completed")
-            return self._variables
+            status = "completed"
+            if self._checkpointing:
+                await asyncio.to_thread(self._checkpoints.delete, self.checkpoint_id)
+            return self._variables.to_dict()
         except Exception as e:
+            status = "failed"
+            # a resume that found nothing to resume from leaves no checkpoint
+            if not isinstance(e, CheckpointNotFoundError):
+                await self._checkpoint(force=True)
             if self._update:
-                self.logger.log(self.logger_name, "error", f"ERROR: {repr(e)}")
+                self.logger.log(self.logger_name, "error", "ERROR: %r", e)
                 await self._update(f"ERROR: {repr(e)}")
-            error = json.loads(
-                json.dumps(
-                    {
-                        "error": repr(e),
-                        "dump": {
-                            "flow": self._flow.model_dump(),
-                            "variables": self._variables,
-                        },
-                    },
-                    default=lambda o: repr(o),
-                    indent=4,
+            error = failure_snapshot(e, self._flow, self._variables)
+            self.logger.log(self.logger_name, "error", "%s", error)
+            raise ProcessRunError(error)
+        finally:
+            run_duration.observe(time.perf_counter() - start, self._metric_flow)
+            runs.inc(self._metric_flow, status)
+            self._release_logger()
+            if self._release_pusher:
+                self._release_pusher()
+
+    def _check_allow_list(self):
+        if not self._allow_list:
+            return
+        for node in self._graph.nodes.values():
+            if node.func and node.func != "__ignore__" and node.func not in self._allow_list:
+                raise InvalidFunction(
+                    f"Function {node.func} of {node.id} not in allow list {self._allow_list}"
                 )
+
+    @property
+    def _checkpointing(self) -> bool:
+        return bool(self._checkpoints and self.checkpoint_id)
+
+    def _restore(self):
+        # starting over instead would run every node before the checkpoint,
+        # and their side effects, a second time
+        if not self._checkpointing:
+            raise CheckpointNotFoundError("Checkpoints are not enabled, no run can be resumed.")
+        state = self._checkpoints.load(self.checkpoint_id)
+        if not state:
+            raise CheckpointNotFoundError(f"No checkpoint {self.checkpoint_id} to resume from.")
+        self._root_variables.changes.update(state["variables"])
+        self._loops = dict(state["loops"])
+        self._position = state["node"]
+        self.logger.log(self.logger_name, "info", "Resuming from checkpoint at %s", self._position)
+
+    async def _checkpoint(self, force: bool = False):
+        # only the root scope is saved, so a loop iteration or parallel branch
+        # cut off by a restart runs again from its start
+        if not self._checkpointing:
+            return
+        now = time.monotonic()
+        if not force and now - self._last_checkpoint < self._checkpoint_interval:
+            return
+        self._last_checkpoint = now
+        # the store keeps the variables of the previous save, only those
+        # written since are passed on
+        changed = self._root_variables.clear_dirty()
+        variables = self._root_variables.changes
+        state = {
+            "node": self._position,
+            "loops": dict(self._loops),
+            "variables": {key: variables[key] for key in changed if key in variables},
+        }
+        try:
+            await asyncio.to_thread(self._checkpoints.save, self.checkpoint_id, state)
+            self.logger.log(
+                self.logger_name, "info" if force else "debug",
+                "Saved checkpoint %s at %s", self.checkpoint_id, self._position,
             )
-            self.logger.log(self.logger_name, "error", error)
-            raise ProcessRunError(error)
+        except Exception as e:
+            # saved with the next checkpoint instead
+            self._root_variables.dirty |= changed
+            self.logger.log(self.logger_name, "warning", "Unable to save checkpoint: %r", e)
+
+    async def _run_function(self, function_id: str, chain: bool = False):
+        # nodes are driven from an explicit stack instead of recursing into
+        # upstream producers and next functions, so the depth of the python
+        # stack stays the same however long the flow is. a frame is
+        # [function_id, sources] where sources are the producers it waits on.
+        # with chain, a next function reached from the bottom of the stack is
+        # where the run is at for checkpoints
+        stack = [[function_id, ()]]
+        resolving = Counter()
+        while stack:
+            frame = stack[-1]
+            function_id, pending = frame
+            try:
+                node = self._graph.get_node(function_id)
+                if not node:
+                    raise FunctionRunError(f"Function {function_id} not found in flow")
+
+                if sources := self._get_missing_sources(function_id):
+                    for source in sources:
+                        if source in pending:
+                            raise ArgumentError(
+                                f"Function {source} did not produce a value for {function_id}"
+                            )
+                        if resolving[source] or source in self._resolving_path.get():
+                            raise ArgumentError(
+                                f"Circular dependency between {function_id} and {source}"
+                            )
+                    if not pending:
+                        resolving[function_id] += 1
+                    frame[1] = sources
+
+                    if len(sources) == 1 and not self._producing:
+                        stack.append([sources[0], ()])
+                    else:
+                        path = tuple(k for k, v in resolving.items() if v)
+                        await self._produce(path, sources)
+                    continue
 
-    async def _run_function(self, function_id: str):
+                stack.pop()
+                if pending:
+                    resolving[function_id] -= 1
+
+                if next_action := await self._run_node(function_id, node):
+                    stack.append([next_action, ()])
+                    if chain and len(stack) == 1:
+                        self._position = next_action
+                        await self._checkpoint()
+            except (
+                FunctionCallError,
+                FunctionRunError,
+                ArgumentError,
+                KeywordArgumentError,
+                SetExceptionsError,
+                InvalidFunction,
+                ModuleNotFoundError,
+                BranchError,
+                ForEachError,
+                SequenceError,
+                ParallelError,
+                JSONExtractionError,
+                NodeTimeoutError,
+            ):
+                raise
+            except Exception as e:
+                raise FunctionRunError(e)
+
+    def _get_missing_sources(self, function_id: str) -> tuple[str, ...]:
+        sources = {}
+        for edges in (
+            self._graph.get_arg_edges_by_target(function_id),
+            self._graph.get_kwarg_edges_by_target(function_id),
+        ):
+            for edge in edges:
+                if self._edge_value(edge) is MISSING:
+                    sources[edge.source] = None
+        return tuple(sources)
+
+    def _source_value(self, function_id: str, edge: Edge) -> Any:
+        value = self._edge_value(edge)
+        if value is MISSING:
+            raise ValueError(f"Function {edge.source} did not produce a value for {function_id}")
+        return value
+
+    def _edge_value(self, edge: Edge) -> Any:
+        # an edge reads the variable its sourceHandle names when there is one,
+        # else the result of its source, MISSING until that has run
+        if (
+            edge.sourceHandle
+            and edge.sourceHandle != "__ignore__"
+            and edge.sourceHandle in self._variables
+        ):
+            return self._variables[edge.sourceHandle]
+        return self._variables.get(edge.source, MISSING)
+
+    async def _produce(self, path: tuple[str, ...], sources: tuple[str, ...]):
+        # runs producers that do not depend on each other as concurrent tasks.
+        # a producer already being run by another task is awaited instead of
+        # being started a second time
+        path = self._resolving_path.get() + path
+        scope = id(self._variables)
+        tasks = []
+        for source in sources:
+            task = self._producing.get((scope, source))
+            if not task:
+                token = self._resolving_path.set(path)
+                task = asyncio.create_task(self._run_function(source))
+                self._resolving_path.reset(token)
+                self._producing[(scope, source)] = task
+                task.add_done_callback(
+                    lambda _, key=(scope, source): self._producing.pop(key, None)
+                )
+            tasks.append(task)
         try:
-            self.logger.log(self.logger_name, "info", f"Loading function: {function_id}")
-            if self.ws:
-                # need to sleep so there is time to send the update to the client before the next function is called
-                await asyncio.sleep(0.1)
-            node = self._flow.get_node(function_id)
-            self.logger.log(self.logger_name, "info", f"Running function: {function_id}:{node.model_dump_json()}")
-            if self._allow_list:
-                if node.func not in self._allow_list:
-                    raise InvalidFunction(
-                        f"Function {node.type} not in allow list {self._allow_list}"
-                    )
+            await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            raise
 
+    async def _run_node(self, function_id: str, node: Node):
+        try:
+            self.logger.log(self.logger_name, "info", "Loading function: %s", function_id)
+            self.logger.log(self.logger_name, "info", "Running function: %s", function_id)
+            # the dump of the node costs as much as a small node, so only at DEBUG
+            self.logger.log(self.logger_name, "debug", "Node %s: %s", function_id, Lazy(node.model_dump_json))
             self._set_exceptions(function_id, node)
-            args = await self._get_args(function_id, node)
-            kwargs = await self._get_kwargs(function_id, node)
-            response, duration = await self._call_function(
-                function_id, node.func, args, kwargs
+            args = self._get_args(function_id, node)
+            kwargs = self._get_kwargs(function_id, node)
+            call = self._call_function(
+                function_id,
+                node.func,
+                args,
+                kwargs,
+                node.data.cache,
+                node.data.cache_ttl,
+                node.data.executor,
             )
+            # the flow wide node_timeout is not applied to custom functions
+            # since their time includes every node they drive
+            timeout = node.data.timeout
+            if timeout is None and node.func not in custom_functions:
+                timeout = self._node_timeout
+            if timeout:
+                try:
+                    response, duration, queue_wait = await asyncio.wait_for(call, timeout)
+                except TimeoutError:
+                    return await self._timed_out(function_id, node, timeout)
+            else:
+                response, duration, queue_wait = await call
+            # the node is shared by every run of the flow, so a branch returns
+            # the node it picked instead of setting it on the node
+            next_function = response if node.func == "branch" else node.next
 
             if isinstance(response, Response):
-                response.raise_for_status()
-                response = response.json() or response.text
+                response = read_response(response)
 
-            self.logger.log(self.logger_name, "debug", f"Response: {response}")
+            self.logger.log(self.logger_name, "debug", "Response: %s", Capped(response))
 
             self._variables[function_id] = response
 
@@ -114,22 +449,14 @@ class Process:
                 message = {
                     "function_id": function_id,
                     "function_name": node.func,
-                    "duration": f"{duration * 1000000:.2f}μs"
-                    if duration < 0.001
-                    else (
-                        f"{duration * 1000:.2f}ms"
-                        if duration < 1
-                        else f"{duration:.2f}s"
-                    ),
+                    "duration": format_duration(duration),
+                    "queue_wait": format_duration(queue_wait),
                     "response": response,
                 }
                 await self._update(message)
 
-            self.logger.log(self.logger_name, "info", f"Running function completed: {function_id}")
-
-            if next_action := node.next:
-                await self._run_function(next_action)
-            
+            self.logger.log(self.logger_name, "info", "Running function completed: %s", function_id)
+            return next_function
         except (
             FunctionCallError,
             ArgumentError,
@@ -140,106 +467,176 @@ class Process:
             BranchError,
             ForEachError,
             SequenceError,
+            ParallelError,
             JSONExtractionError,
+            NodeTimeoutError,
         ):
             raise
         except Exception as e:
             raise FunctionRunError(e)
 
-    async def _get_args(self, function_id: str, node: Node):
-        try:
-            self.logger.log(self.logger_name, "debug", f"Getting args for {function_id}")
-            args = node.args or []
-            for edge in self._flow.get_arg_edges_by_target(function_id):
-                if (
-                    edge.sourceHandle
-                    and edge.sourceHandle != "__ignore__"
-                    and edge.sourceHandle in self._variables
-                ):
-                    args[edge.targetHandle] = self._variables[edge.sourceHandle]
-                    continue
-
-                if edge.source not in self._variables:
-                    await self._run_function(edge.source)
+    async def _timed_out(self, function_id: str, node: Node, timeout: float) -> str:
+        # a timed out node continues with the target of its __timeout__ edge
+        # when it has one, the error message is stored as its result
+        error = NodeTimeoutError(f"Function {function_id} timed out after {timeout}s")
+        node_errors.inc(node.func, type(error).__name__)
+        next_function = next(
+            (
+                edge.target
+                for edge in self._graph.get_except_edges_by_source(function_id)
+                if edge.sourceHandle == TIMEOUT_HANDLE
+            ),
+            None,
+        )
+        if not next_function:
+            raise error
+
+        self.logger.log(self.logger_name, "warning", "%s, continuing with %s", error, next_function)
+        self._variables[function_id] = str(error)
+        if self._update:
+            await self._update(
+                {"function_id": function_id, "function_name": node.func, "error": str(error)}
+            )
+        return next_function
 
-                args[edge.targetHandle] = self._variables[edge.source]
-            self.logger.log(self.logger_name, "debug", f"Got args for {function_id}: {args}")
+    def _get_args(self, function_id: str, node: Node):
+        try:
+            self.logger.log(self.logger_name, "debug", "Getting args for %s", function_id)
+            args = list(node.args or [])
+            for edge in self._graph.get_arg_edges_by_target(function_id):
+                # _run_function runs every missing source before the node
+                args[edge.targetHandle] = self._source_value(function_id, edge)
+            self.logger.log(self.logger_name, "debug", "Got args for %s: %s", function_id, Capped(args))
             return args
         except Exception as e:
             raise ArgumentError(e)
 
-    async def _get_kwargs(self, function_id: str, node: Node):
+    def _get_kwargs(self, function_id: str, node: Node):
         try:
-            self.logger.log(self.logger_name, "debug", f"Getting kwargs for {function_id}")
-            kwargs = node.kwargs or {}
-            for edge in self._flow.get_kwarg_edges_by_target(function_id):
-                if (
-                    edge.sourceHandle
-                    and edge.sourceHandle != "__ignore__"
-                    and edge.sourceHandle in self._variables
-                ):
-                    kwargs[edge.targetHandle] = self._variables[edge.sourceHandle]
-                    continue
-
-                if edge.source not in self._variables:
-                    await self._run_function(edge.source)
-
-                kwargs[edge.targetHandle] = self._variables[edge.source]
-            self.logger.log(self.logger_name, "debug", f"Got kwargs for {function_id}: {kwargs}")
+            self.logger.log(self.logger_name, "debug", "Getting kwargs for %s", function_id)
+            kwargs = dict(node.kwargs or {})
+            for edge in self._graph.get_kwarg_edges_by_target(function_id):
+                # _run_function runs every missing source before the node
+                kwargs[edge.targetHandle] = self._source_value(function_id, edge)
+            self.logger.log(self.logger_name, "debug", "Got kwargs for %s: %s", function_id, Capped(kwargs))
             return kwargs
         except Exception as e:
             raise KeywordArgumentError(e)
 
     def _set_exceptions(self, function_id: str, node: Node):
         try:
-            self.logger.log(self.logger_name, "debug", f"Setting exceptions for {function_id}")
-            for edge in self._flow.get_except_edges_by_source(function_id):
+            self.logger.log(self.logger_name, "debug", "Setting exceptions for %s", function_id)
+            for edge in self._graph.get_except_edges_by_source(function_id):
+                if edge.sourceHandle == TIMEOUT_HANDLE:
+                    continue
                 if not node.kwargs:
                     node.data.kwargs = {}
                 node.kwargs[edge.sourceHandle] = edge.target
-            self.logger.log(self.logger_name, "debug", f"Set exceptions for {function_id}")
+            self.logger.log(self.logger_name, "debug", "Set exceptions for %s", function_id)
         except Exception as e:
             raise SetExceptionsError(e)
 
     async def _call_function(
-        self, function_id: str, function: str, args: list[Any], kwargs: dict[str, Any]
+        self,
+        function_id: str,
+        function: str,
+        args: list[Any],
+        kwargs: dict[str, Any],
+        cache: bool = False,
+        cache_ttl: float = None,
+        executor: str = None,
     ):
         try:
-            self.logger.log(self.logger_name, "debug", f"Calling function: {function_id}:{function}")
+            self.logger.log(self.logger_name, "debug", "Calling function: %s:%s", function_id, function)
             if function in custom_functions:
                 func_name = function
                 func = getattr(self, function)
+                is_async = inspect.iscoroutinefunction(func)
                 args.insert(0, function_id)
             else:
-                module_name, func_name = function.rsplit(".", 1)
-                if module_name == "custom":
-                    module_name = "app.custom"
-                module = __import__(module_name, fromlist=[func_name])
-                func = getattr(module, func_name)
-
-            self.logger.log(self.logger_name, "debug", 
-                f"Calling {function_id}:{func_name} with args: {args} and kwargs: {str(kwargs)[0:100]}"
+                func, is_async, _, func_name = resolve(function)
+
+            self.logger.log(self.logger_name, "debug",
+                "Calling %s:%s with args: %s and kwargs: %s",
+                function_id, func_name, Capped(args), Capped(kwargs, 100),
             )
 
-            if inspect.iscoroutinefunction(func):
-                start = time.time()
-                r = await func(*args, **kwargs)
-                self.logger.log(self.logger_name, "debug", f"Function {function_id}:{func_name} completed")
-                return r, time.time() - start
+            # a hit skips the call, and the wait for a slot, entirely. calls
+            # with args that have no key always miss and aren't stored
+            key = None
+            if cache and function not in custom_functions:
+                key = self._cache.key(function, args, kwargs)
+                r = self._cache.get(key)
+                if r is not MISSING:
+                    self.logger.log(self.logger_name, "debug", "Function %s:%s served from cache", function_id, func_name)
+                    return r, 0.0, 0.0
+
+            # custom functions only drive other nodes, so they don't take a slot
+            if function in custom_functions:
+                limit = nullcontext()
             else:
-                start = time.time()
-                r = func(*args, **kwargs)
-                self.logger.log(self.logger_name, "debug", f"Function {function_id}:{func_name} completed")
-                return r, time.time() - start
+                limit = self._limit.get() or self._semaphore
+            async with limit:
+                if executor == "process" and function not in custom_functions:
+                    # cpu bound calls run on another process so they don't
+                    # hold the GIL that the event loop and the threads need
+                    r, queue_wait, duration = await run_in_process(
+                        function, args, kwargs, self._process_executor
+                    )
+                    elapsed = int(duration * 1_000_000_000)
+                    node_queue_wait.observe(queue_wait, function)
+                    self.logger.log(self.logger_name, "debug",
+                        "Function %s:%s completed in a process, waited %.2fms ran %.2fms",
+                        function_id, func_name, queue_wait * 1000, duration * 1000,
+                    )
+                elif is_async:
+                    start = time.perf_counter_ns()
+                    r = await func(*args, **kwargs)
+                    elapsed = time.perf_counter_ns() - start
+                    duration, queue_wait = elapsed / 1_000_000_000, 0.0
+                    self.logger.log(self.logger_name, "debug", "Function %s:%s completed", function_id, func_name)
+                elif (
+                    function in custom_functions
+                    or executor == "inline"
+                    or (executor != "thread" and is_inline(function, self._inline_functions))
+                ):
+                    start = time.perf_counter_ns()
+                    r = func(*args, **kwargs)
+                    elapsed = time.perf_counter_ns() - start
+                    duration, queue_wait = elapsed / 1_000_000_000, 0.0
+                    self.logger.log(self.logger_name, "debug", "Function %s:%s completed", function_id, func_name)
+                else:
+                    # blocking calls like requests.get run on a worker thread so
+                    # they don't hold up every other process on the event loop
+                    r, queue_wait, duration = await run_in_thread(
+                        call_and_read, [func, args, kwargs], {}, self._executor
+                    )
+                    elapsed = int(duration * 1_000_000_000)
+                    node_queue_wait.observe(queue_wait, function)
+                    self.logger.log(self.logger_name, "debug",
+                        "Function %s:%s completed, waited %.2fms ran %.2fms",
+                        function_id, func_name, queue_wait * 1000, duration * 1000,
+                    )
+
+            node_duration.observe(duration, function)
+            latency.record(self._metric_flow, function, elapsed)
+            if key:
+                if isinstance(r, Response):
+                    r = read_response(r)
+                self._cache.set(key, r, cache_ttl)
+            return r, duration, queue_wait
         except (
             ModuleNotFoundError,
             BranchError,
             ForEachError,
             SequenceError,
+            ParallelError,
             JSONExtractionError,
-        ):
+        ) as e:
+            node_errors.inc(function, type(e).__name__)
             raise
         except Exception as e:
+            node_errors.inc(function, type(e).__name__)
             raise FunctionCallError(e)
 
     # these are custom functions that need to use self because they will modify the class instance
@@ -250,17 +647,12 @@ class Process:
         self, action_id: str, condition: bool, true: str = None, false: str = None
     ) -> str:
         try:
-            node = self._flow.get_node(action_id)
+            self._graph.get_node(action_id)
 
             if not isinstance(condition, bool):
                 raise ValueError("Condition must be a boolean")
 
-            if condition:
-                node.data.next_function = true
-                return node.data.next_function
-
-            node.data.next_function = false
-            return node.data.next_function
+            return true if condition else false
         except Exception as e:
             raise BranchError(f"Unable to process branch: {e}")
 
@@ -269,42 +661,104 @@ class Process:
         action_id: str,
         array: list,
         next_function: str,
+        max_concurrency: int = None,
     ):
+        # every iteration runs in a child layer of the current scope holding
+        # the item, so starting one costs the same however many variables
+        # there are. only the globals it changed are written back, the rest
+        # of what it wrote lands in f"{action_id}__{index}". sequential
+        # iterations write both back as soon as they finish, so the next one
+        # sees them. with max_concurrency above 1 the iterations run as
+        # concurrent tasks that all start from the globals as they were when
+        # the loop started and their writes are applied after every iteration
+        # is done, in index order, so the highest index wins on a conflict
         try:
             if not isinstance(array, list):
                 raise ValueError("array must be a list")
 
-            global_variable_keys = [k for k in self._variables.keys() if "__" not in k]
-            original_globals = {k: self._variables[k] for k in global_variable_keys}
-            iteration_results = {}
+            variables = self._variables
 
-            for index, item in enumerate(array):
-                self._variables = original_globals.copy()
-                self._variables[action_id] = item
-                await self._run_function(next_function)
-                local_variables = self._variables.copy()
-                iteration_results.update(
-                    {
-                        f"{action_id}__{index}": {
-                            k: v
-                            for k, v in local_variables.items()
-                            if k not in global_variable_keys
-                        }
-                    }
-                )
-                original_globals.update(
-                    {
-                        k: v
-                        for k, v in local_variables.items()
-                        if k in global_variable_keys
-                    }
+            if max_concurrency and max_concurrency > 1:
+                await self._for_each_concurrent(
+                    action_id, array, next_function, max_concurrency, variables
                 )
+                return "Completed"
 
-            self._variables.update(iteration_results)
+            # a loop on the root scope is checkpointed after every iteration and
+            # a resumed one skips the iterations it already ran
+            root = variables is self._root_variables
+            start = self._loops.get(action_id, 0) if root else 0
+            for index, item in enumerate(array):
+                if index < start:
+                    continue
+                scope = variables.new_child({action_id: item})
+                token = self._scope.set(scope)
+                try:
+                    await self._run_function(next_function)
+                finally:
+                    self._scope.reset(token)
+                global_writes, results = self._split_changes(action_id, scope, variables)
+                variables.update(global_writes)
+                variables[f"{action_id}__{index}"] = results
+                if root:
+                    self._loops[action_id] = index + 1
+                    await self._checkpoint()
+
+            self._loops.pop(action_id, None)
             return "Completed"
         except Exception as e:
             raise ForEachError(e)
 
+    async def _for_each_concurrent(
+        self,
+        action_id: str,
+        array: list,
+        next_function: str,
+        max_concurrency: int,
+        variables: Scope,
+    ):
+        limit = asyncio.Semaphore(max_concurrency)
+
+        async def run_iteration(item: Any):
+            async with limit:
+                scope = variables.new_child({action_id: item})
+                self._scope.set(scope)
+                self._limit.set(asyncio.Semaphore(self.max_concurrency))
+                await self._run_function(next_function)
+                return scope
+
+        tasks = [asyncio.create_task(run_iteration(item)) for item in array]
+        try:
+            scopes = await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            raise
+
+        global_writes = {}
+        iteration_results = {}
+        for index, scope in enumerate(scopes):
+            writes, results = self._split_changes(action_id, scope, variables)
+            global_writes.update(writes)
+            iteration_results[f"{action_id}__{index}"] = results
+
+        variables.update(global_writes)
+        variables.update(iteration_results)
+
+    @staticmethod
+    def _split_changes(
+        action_id: str, scope: Scope, variables: Scope
+    ) -> tuple[dict[str, Any], dict[str, Any]]:
+        # keys an iteration wrote that already existed outside the loop are
+        # globals, everything else is a result of the iteration
+        global_writes, results = {}, {}
+        for k, v in scope.changes.items():
+            if k != action_id and k in variables:
+                global_writes[k] = v
+            else:
+                results[k] = v
+        return global_writes, results
+
     async def sequence(self, _: str, array: list[str]):
         try:
             if not isinstance(array, list):
@@ -316,24 +770,59 @@ class Process:
         except Exception as e:
             raise SequenceError(e)
         
-    async def parallel(self, _: str, array: list[str]):
+    async def parallel(
+        self,
+        _: str,
+        array: list[str],
+        max_concurrency: int = None,
+        fail_fast: bool = True,
+    ):
+        # every branch runs as its own task against a copy of the current
+        # variables. once they are done, the keys each branch wrote are merged
+        # back in the order of array, so the last branch wins on a conflict.
+        # with fail_fast the first error cancels the other branches, otherwise
+        # every branch runs to the end and the successful ones are merged
+        # before the errors are raised
         try:
             if not isinstance(array, list):
                 raise ValueError("array must be a list")
-            
-            threads = []
-            for item in array:
-                thread = threading.Thread(target=self._run_function, args=(item,))
-                threads.append(thread)
-                thread.start()
 
-            # Wait for all threads to complete
-            for thread in threads:
-                thread.join()
+            variables = self._variables
+            limit = asyncio.Semaphore(max_concurrency) if max_concurrency else nullcontext()
+
+            async def run_branch(function_id: str):
+                async with limit:
+                    scope = variables.new_child()
+                    self._scope.set(scope)
+                    self._limit.set(asyncio.Semaphore(self.max_concurrency))
+                    await self._run_function(function_id)
+                    return scope
+
+            tasks = [asyncio.create_task(run_branch(item)) for item in array]
+            if fail_fast:
+                try:
+                    scopes = await asyncio.gather(*tasks)
+                except BaseException:
+                    for task in tasks:
+                        task.cancel()
+                    raise
+            else:
+                scopes = await asyncio.gather(*tasks, return_exceptions=True)
+
+            errors = []
+            for scope in scopes:
+                if isinstance(scope, BaseException):
+                    errors.append(scope)
+                    continue
+                variables.update(scope.changes)
+            if errors:
+                raise ParallelError(errors)
 
             return "Completed"
+        except ParallelError:
+            raise
         except Exception as e:
-            raise SequenceError(e)
+            raise ParallelError(e)
 
     def set_variable(self, _: str, variable_name: str, value: Any):
         self._variables[variable_name] = value
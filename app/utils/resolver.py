@@ -0,0 +1,77 @@
+# This file is licensed under the CC BY-NC-SA 4.0 license.
+# See https://creativecommons.org/licenses/by-nc-sa/4.0/ for details.
+
+import inspect
+import importlib
+from types import ModuleType
+from typing import Callable, Iterable, NamedTuple
+
+from app.models import CompiledFlow
+from app.utils.exceptions import FunctionLoadError
+
+
+class ResolvedFunction(NamedTuple):
+    func: Callable
+    is_async: bool
+    module: ModuleType
+    name: str
+
+
+# process wide, keyed by the function string of NodeData
+_functions: dict[str, ResolvedFunction] = {}
+
+
+def resolve(function: str) -> ResolvedFunction:
+    resolved = _functions.get(function)
+    # a reloaded module gets new function objects, so an entry whose function
+    # is no longer the one on its module is stale and gets resolved again
+    if resolved and getattr(resolved.module, resolved.name, None) is resolved.func:
+        return resolved
+
+    module_name, func_name = function.rsplit(".", 1)
+    if module_name == "custom":
+        module_name = "app.custom"
+    module = __import__(module_name, fromlist=[func_name])
+    func = getattr(module, func_name)
+    resolved = ResolvedFunction(func, inspect.iscoroutinefunction(func), module, func_name)
+    _functions[function] = resolved
+    return resolved
+
+
+def load_class(path: str) -> type:
+    """The class at a dotted path. Settings such as PFA_DB_CLASS,
+    PFA_CACHE_BACKEND and PFA_CHECKPOINT_STORE name one this way, so any class
+    with the same methods as the default can be used in its place."""
+    module_name, class_name = path.rsplit(".", 1)
+    module = __import__(module_name, fromlist=[class_name])
+    return getattr(module, class_name)
+
+
+def invalidate(module_name: str = None):
+    """Drops cached functions of the given module, or all of them."""
+    for function, resolved in list(_functions.items()):
+        if module_name is None or resolved.module.__name__ == module_name:
+            _functions.pop(function, None)
+
+
+def reload_custom():
+    """Reloads app.custom so edited custom functions are picked up."""
+    import app.custom
+
+    importlib.reload(app.custom)
+    invalidate(app.custom.__name__)
+
+
+def resolve_flow(graph: CompiledFlow, skip: Iterable[str] = ()):
+    """Resolves every function of a flow ahead of time so a bad function name
+    fails before any node runs."""
+    skip = set(skip)
+    for node in graph.nodes.values():
+        if not node.func or node.func == "__ignore__" or node.func in skip:
+            continue
+        try:
+            resolve(node.func)
+        except Exception as e:
+            raise FunctionLoadError(
+                f"Unable to load function {node.func} of {node.id}: {repr(e)}"
+            ) from e
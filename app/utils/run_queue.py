@@ -0,0 +1,295 @@
+# This file is licensed under the CC BY-NC-SA 4.0 license.
+# See https://creativecommons.org/licenses/by-nc-sa/4.0/ for details.
+
+import os
+import json
+import time
+import uuid
+import sqlite3
+import asyncio
+import threading
+from typing import Any, Awaitable, Callable
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id TEXT PRIMARY KEY,
+    idempotency_key TEXT UNIQUE,
+    flow TEXT NOT NULL,
+    variables TEXT,
+    priority INTEGER NOT NULL DEFAULT 0,
+    status TEXT NOT NULL DEFAULT 'queued',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    receipt TEXT,
+    visible_at REAL NOT NULL,
+    created REAL NOT NULL,
+    updated REAL NOT NULL,
+    result TEXT,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS runs_ready ON runs (status, visible_at, priority, created);
+"""
+
+
+class RunQueue:
+    """A durable queue of runs in a SQLite database in WAL mode, so runs that
+    were accepted survive a crash and several processes can share it.
+
+    take() leases runs for visibility_timeout seconds and gives each lease a
+    receipt. A run that isn't acked or nacked with that receipt before the
+    lease runs out is handed out again, so every run is delivered at least
+    once. After max_attempts deliveries it is marked failed. A run put twice
+    with the same idempotency key is only queued once."""
+
+    def __init__(
+        self,
+        path: str = None,
+        visibility_timeout: float = None,
+        max_attempts: int = None,
+    ):
+        self.path = path or os.getenv("PFA_RUN_QUEUE_PATH", "runs.db")
+        self.visibility_timeout = visibility_timeout or float(
+            os.getenv("PFA_RUN_QUEUE_VISIBILITY", "300")
+        )
+        self.max_attempts = max_attempts or int(os.getenv("PFA_RUN_QUEUE_ATTEMPTS", "3"))
+        self._lock = threading.Lock()
+        # autocommit, every write below opens its own transaction
+        self._db = sqlite3.connect(
+            self.path, isolation_level=None, check_same_thread=False, timeout=30
+        )
+        self._db.row_factory = sqlite3.Row
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(SCHEMA)
+
+    def put(
+        self,
+        flow: bytes | str,
+        variables: dict[str, Any] = None,
+        idempotency_key: str = None,
+        priority: int = 0,
+    ) -> tuple[str, bool]:
+        """Queues a run of the flow json and returns its id and whether it was
+        added, False when a run with the same idempotency key already exists."""
+        if isinstance(flow, bytes):
+            flow = flow.decode()
+        run_id = uuid.uuid4().hex
+        now = time.time()
+        with self._lock:
+            cursor = self._db.execute(
+                "INSERT INTO runs (id, idempotency_key, flow, variables, priority, visible_at, created, updated)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?) ON CONFLICT (idempotency_key) DO NOTHING",
+                (run_id, idempotency_key, flow, json.dumps(variables), priority, now, now, now),
+            )
+            if cursor.rowcount:
+                return run_id, True
+            row = self._db.execute(
+                "SELECT id FROM runs WHERE idempotency_key = ?", (idempotency_key,)
+            ).fetchone()
+        return row["id"], False
+
+    def take(self, limit: int = 1, visibility_timeout: float = None) -> list[dict[str, Any]]:
+        """Leases up to limit runs that are ready, highest priority first then
+        oldest first, including runs whose previous lease ran out."""
+        now = time.time()
+        visible_at = now + (visibility_timeout or self.visibility_timeout)
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                # runs that were handed out max_attempts times already give up
+                self._db.execute(
+                    "UPDATE runs SET status = 'failed', receipt = NULL, updated = ?,"
+                    " error = COALESCE(error, 'Lease expired after ' || attempts || ' attempts')"
+                    " WHERE status = 'running' AND visible_at <= ? AND attempts >= ?",
+                    (now, now, self.max_attempts),
+                )
+                rows = self._db.execute(
+                    "SELECT id, flow, variables, priority, attempts FROM runs"
+                    " WHERE status IN ('queued', 'running') AND visible_at <= ?"
+                    " ORDER BY priority DESC, created LIMIT ?",
+                    (now, limit),
+                ).fetchall()
+                runs = []
+                for row in rows:
+                    receipt = uuid.uuid4().hex
+                    self._db.execute(
+                        "UPDATE runs SET status = 'running', receipt = ?, visible_at = ?,"
+                        " attempts = attempts + 1, updated = ? WHERE id = ?",
+                        (receipt, visible_at, now, row["id"]),
+                    )
+                    runs.append(
+                        {
+                            "id": row["id"],
+                            "receipt": receipt,
+                            "flow": row["flow"],
+                            "variables": json.loads(row["variables"]),
+                            "priority": row["priority"],
+                            "attempts": row["attempts"] + 1,
+                        }
+                    )
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+        return runs
+
+    def extend(self, run_id: str, receipt: str, visibility_timeout: float = None) -> bool:
+        """Pushes the end of a lease back, for runs that take longer than the
+        visibility timeout. False when the lease was lost."""
+        visible_at = time.time() + (visibility_timeout or self.visibility_timeout)
+        return self._update(
+            "UPDATE runs SET visible_at = ? WHERE id = ? AND receipt = ? AND status = 'running'",
+            (visible_at, run_id, receipt),
+        )
+
+    def ack(self, run_id: str, receipt: str, result: Any = None) -> bool:
+        """Marks a leased run completed. False when the lease was lost, the run
+        was then handed out again and that delivery decides its outcome."""
+        return self._update(
+            "UPDATE runs SET status = 'completed', receipt = NULL, result = ?, updated = ?"
+            " WHERE id = ? AND receipt = ? AND status = 'running'",
+            (json.dumps(result, default=str), time.time(), run_id, receipt),
+        )
+
+    def fail(self, run_id: str, receipt: str, error: str = None) -> bool:
+        """Marks a leased run failed with error, whatever attempts it has left."""
+        return self._update(
+            "UPDATE runs SET status = 'failed', receipt = NULL, error = ?, updated = ?"
+            " WHERE id = ? AND receipt = ? AND status = 'running'",
+            (error, time.time(), run_id, receipt),
+        )
+
+    def nack(self, run_id: str, receipt: str, error: str = None, delay: float = 0) -> bool:
+        """Hands a leased run back to be tried again after delay seconds, or
+        marks it failed once it was tried max_attempts times."""
+        now = time.time()
+        return self._update(
+            "UPDATE runs SET receipt = NULL, error = ?, updated = ?, visible_at = ?,"
+            " status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'queued' END"
+            " WHERE id = ? AND receipt = ? AND status = 'running'",
+            (error, now, now + delay, self.max_attempts, run_id, receipt),
+        )
+
+    def get(self, run_id: str) -> dict[str, Any] | None:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT id, status, priority, attempts, created, updated, result, error"
+                " FROM runs WHERE id = ?",
+                (run_id,),
+            ).fetchone()
+        if not row:
+            return None
+        run = {"run_id": row["id"], **dict(row)}
+        del run["id"]
+        run["result"] = json.loads(run["result"]) if run["result"] else None
+        return run
+
+    def purge(self, older_than: float) -> int:
+        """Deletes completed and failed runs last updated older_than seconds ago."""
+        with self._lock:
+            cursor = self._db.execute(
+                "DELETE FROM runs WHERE status IN ('completed', 'failed') AND updated < ?",
+                (time.time() - older_than,),
+            )
+        return cursor.rowcount
+
+    def metrics(self) -> dict[str, int]:
+        now = time.time()
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT CASE WHEN status = 'queued' AND visible_at > ? THEN 'delayed' ELSE status END,"
+                " COUNT(*) FROM runs GROUP BY 1",
+                (now,),
+            ).fetchall()
+        metrics = {"queued": 0, "delayed": 0, "running": 0, "completed": 0, "failed": 0}
+        metrics.update({status: count for status, count in rows})
+        return metrics
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def _update(self, sql: str, parameters: tuple) -> bool:
+        with self._lock:
+            return bool(self._db.execute(sql, parameters).rowcount)
+
+
+class RunQueueConsumer:
+    """Leases runs from a RunQueue in batches and runs them with runner, at
+    most max_runs at a time. A run's lease is extended while it runs, it is
+    acked with its result when it completes and marked failed when it fails,
+    running it again would only repeat the nodes before the failure. Only an
+    error of retry_on, such as the worker running it dying, hands it back, to
+    be tried again after retry_delay seconds, doubled with each attempt."""
+
+    def __init__(
+        self,
+        queue: RunQueue,
+        runner: Callable[[dict[str, Any]], Awaitable[Any]],
+        max_runs: int = None,
+        batch_size: int = None,
+        poll_interval: float = None,
+        retry_on: tuple[type[Exception], ...] = (),
+        retry_delay: float = None,
+    ):
+        self.queue = queue
+        self.runner = runner
+        self.max_runs = max_runs or int(os.getenv("PFA_MAX_RUNS", "10"))
+        self.batch_size = batch_size or int(os.getenv("PFA_RUN_QUEUE_BATCH", "10"))
+        self.poll_interval = poll_interval or float(os.getenv("PFA_RUN_QUEUE_POLL", "0.5"))
+        self.retry_on = retry_on
+        self.retry_delay = retry_delay or float(os.getenv("PFA_RUN_QUEUE_RETRY_DELAY", "1"))
+        self._running: set[asyncio.Task] = set()
+        self._wake = asyncio.Event()
+        self._stopped = False
+
+    def notify(self):
+        """Wakes the consumer up early, e.g. right after a put."""
+        self._wake.set()
+
+    async def serve(self):
+        while not self._stopped:
+            free = self.max_runs - len(self._running)
+            runs = []
+            if free > 0:
+                runs = await asyncio.to_thread(self.queue.take, min(free, self.batch_size))
+            for run in runs:
+                task = asyncio.create_task(self._run(run))
+                self._running.add(task)
+                task.add_done_callback(self._done)
+            if len(runs) < min(free, self.batch_size) or free <= 0:
+                self._wake.clear()
+                try:
+                    await asyncio.wait_for(self._wake.wait(), self.poll_interval)
+                except TimeoutError:
+                    pass
+
+    async def stop(self):
+        # leases of runs cut off here run out and the runs are handed out again
+        self._stopped = True
+        self._wake.set()
+        for task in list(self._running):
+            task.cancel()
+        await asyncio.gather(*self._running, return_exceptions=True)
+
+    def _done(self, task: asyncio.Task):
+        self._running.discard(task)
+        self._wake.set()
+
+    async def _run(self, run: dict[str, Any]):
+        heartbeat = asyncio.create_task(self._heartbeat(run))
+        try:
+            result = await self.runner(run)
+        except self.retry_on as e:
+            delay = self.retry_delay * 2 ** (run["attempts"] - 1)
+            await asyncio.to_thread(self.queue.nack, run["id"], run["receipt"], str(e), delay)
+        except Exception as e:
+            await asyncio.to_thread(self.queue.fail, run["id"], run["receipt"], str(e))
+        else:
+            await asyncio.to_thread(self.queue.ack, run["id"], run["receipt"], result)
+        finally:
+            heartbeat.cancel()
+
+    async def _heartbeat(self, run: dict[str, Any]):
+        while True:
+            await asyncio.sleep(self.queue.visibility_timeout / 2)
+            await asyncio.to_thread(self.queue.extend, run["id"], run["receipt"])
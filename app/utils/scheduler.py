@@ -0,0 +1,177 @@
+# This file is licensed under the CC BY-NC-SA 4.0 license.
+# See https://creativecommons.org/licenses/by-nc-sa/4.0/ for details.
+
+import os
+import time
+import heapq
+import asyncio
+import itertools
+from typing import Any
+from collections import OrderedDict, deque
+
+from app.utils.processor import Process
+from app.utils.exceptions import RunQueueFullError
+
+
+class Run:
+    def __init__(self, process: Process, flow_key: str | None, priority: int):
+        # the id the run logs under, its failure snapshot included
+        self.id = process.run_id
+        self.process = process
+        self.flow_key = flow_key
+        self.priority = priority
+        self.status = "queued"
+        self.submitted = time.time()
+        self.started: float | None = None
+        self.finished: float | None = None
+        self.result: Any = None
+        self.error: str | None = None
+        self.task: asyncio.Task | None = None
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            "run_id": self.id,
+            "flow": self.flow_key,
+            "priority": self.priority,
+            "status": self.status,
+            "submitted": self.submitted,
+            "started": self.started,
+            "finished": self.finished,
+            "result": self.result,
+            "error": self.error,
+        }
+
+
+class RunScheduler:
+    """Admits runs into a bounded queue and starts them, highest priority first
+    then in order of submission, while fewer than max_runs are running and
+    their flow has fewer than max_runs_per_flow running. A submission past
+    max_queued raises RunQueueFullError. Finished runs are kept for polling
+    until history newer ones have finished."""
+
+    def __init__(
+        self,
+        max_runs: int = None,
+        max_queued: int = None,
+        max_runs_per_flow: int = None,
+        history: int = None,
+    ):
+        self.max_runs = max_runs or int(os.getenv("PFA_MAX_RUNS", "10"))
+        self.max_queued = max_queued or int(os.getenv("PFA_RUN_QUEUE_SIZE", "100"))
+        # 0 means a flow can use every slot
+        self.max_runs_per_flow = (
+            max_runs_per_flow
+            if max_runs_per_flow is not None
+            else int(os.getenv("PFA_MAX_RUNS_PER_FLOW", "0"))
+        )
+        self.history = history or int(os.getenv("PFA_RUN_HISTORY", "1000"))
+        self._queue: list[tuple[int, int, Run]] = []
+        self._order = itertools.count()
+        self._queued = 0
+        self._running: dict[str | None, int] = {}
+        self._runs: OrderedDict[str, Run] = OrderedDict()
+        self._finished: deque[str] = deque()
+        self._waits: deque[float] = deque(maxlen=1000)
+        self._counts = {"submitted": 0, "rejected": 0, "completed": 0, "failed": 0, "cancelled": 0}
+
+    def submit(self, process: Process, flow_key: str = None, priority: int = 0) -> Run:
+        if self._queued >= self.max_queued:
+            self._counts["rejected"] += 1
+            raise RunQueueFullError(
+                f"Run queue is full ({self.max_queued} runs waiting), try again later."
+            )
+        run = Run(process, flow_key, priority)
+        self._runs[run.id] = run
+        heapq.heappush(self._queue, (-priority, next(self._order), run))
+        self._queued += 1
+        self._counts["submitted"] += 1
+        self._dispatch()
+        return run
+
+    def get(self, run_id: str) -> Run | None:
+        return self._runs.get(run_id)
+
+    def cancel(self, run_id: str) -> Run | None:
+        run = self._runs.get(run_id)
+        if not run:
+            return None
+        if run.status == "queued":
+            # left in the heap and skipped when it comes up
+            self._queued -= 1
+            self._finish(run, "cancelled")
+        elif run.status == "running":
+            run.task.cancel()
+        return run
+
+    def metrics(self) -> dict[str, Any]:
+        now = time.time()
+        oldest = min(
+            (run.submitted for _, _, run in self._queue if run.status == "queued"),
+            default=None,
+        )
+        waits = list(self._waits)
+        return {
+            "queued": self._queued,
+            "running": sum(self._running.values()),
+            "max_queued": self.max_queued,
+            "max_runs": self.max_runs,
+            "max_runs_per_flow": self.max_runs_per_flow,
+            **self._counts,
+            "oldest_queued_seconds": now - oldest if oldest else 0.0,
+            "wait_seconds_avg": sum(waits) / len(waits) if waits else 0.0,
+            "wait_seconds_max": max(waits, default=0.0),
+        }
+
+    def _dispatch(self):
+        # runs whose flow is at its limit are set aside and put back, so a
+        # busy flow doesn't hold up the runs of other flows behind it
+        deferred = []
+        while self._queue and sum(self._running.values()) < self.max_runs:
+            entry = heapq.heappop(self._queue)
+            run = entry[2]
+            if run.status != "queued":
+                continue
+            if (
+                self.max_runs_per_flow
+                and self._running.get(run.flow_key, 0) >= self.max_runs_per_flow
+            ):
+                deferred.append(entry)
+                continue
+            self._start(run)
+        for entry in deferred:
+            heapq.heappush(self._queue, entry)
+
+    def _start(self, run: Run):
+        self._queued -= 1
+        self._running[run.flow_key] = self._running.get(run.flow_key, 0) + 1
+        run.status = "running"
+        run.started = time.time()
+        self._waits.append(run.started - run.submitted)
+        run.task = asyncio.create_task(run.process.run())
+        # a callback rather than a wrapper coroutine, so a run cancelled before
+        # its task got to start is still accounted for
+        run.task.add_done_callback(lambda task, run=run: self._done(run, task))
+
+    def _done(self, run: Run, task: asyncio.Task):
+        if task.cancelled():
+            status = "cancelled"
+        elif task.exception():
+            status = "failed"
+            run.error = str(task.exception())
+        else:
+            status = "completed"
+            run.result = task.result()
+        self._running[run.flow_key] -= 1
+        if not self._running[run.flow_key]:
+            del self._running[run.flow_key]
+        self._finish(run, status)
+        self._dispatch()
+
+    def _finish(self, run: Run, status: str):
+        run.status = status
+        run.finished = time.time()
+        run.process = None
+        self._counts[status] += 1
+        self._finished.append(run.id)
+        while len(self._finished) > self.history:
+            self._runs.pop(self._finished.popleft(), None)
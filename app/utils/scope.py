@@ -0,0 +1,33 @@
+# This file is licensed under the CC BY-NC-SA 4.0 license.
+# See https://creativecommons.org/licenses/by-nc-sa/4.0/ for details.
+
+from collections import ChainMap
+from typing import Any
+
+
+class Scope(ChainMap):
+    """Layered variables of a process. Reads fall through to the parent layers
+    and writes always go to the top layer, so entering a loop iteration or a
+    parallel branch is a new_child() call instead of a copy of every variable,
+    and the top layer holds exactly the keys that were written in it. The keys
+    written since the last clear_dirty() are kept in dirty, so a checkpoint
+    only saves the variables that changed since the previous one."""
+
+    def __init__(self, *maps):
+        super().__init__(*maps)
+        self.dirty: set[str] = set()
+
+    def __setitem__(self, key: str, value: Any):
+        self.maps[0][key] = value
+        self.dirty.add(key)
+
+    @property
+    def changes(self) -> dict[str, Any]:
+        return self.maps[0]
+
+    def clear_dirty(self) -> set[str]:
+        dirty, self.dirty = self.dirty, set()
+        return dirty
+
+    def to_dict(self) -> dict[str, Any]:
+        return dict(self)
@@ -0,0 +1,137 @@
+# This file is licensed under the CC BY-NC-SA 4.0 license.
+# See https://creativecommons.org/licenses/by-nc-sa/4.0/ for details.
+
+import os
+import json
+import uuid
+import reprlib
+from pathlib import Path
+from datetime import datetime, timezone
+from typing import Any, Mapping
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from app.models import Flow
+from app.utils.logs import global_logger
+
+# largest rendering of a single variable in a snapshot
+SNAPSHOT_VALUE_LIMIT = int(os.getenv("PFA_SNAPSHOT_VALUE_LIMIT", "1000"))
+# largest total rendering of the variables in a snapshot
+SNAPSHOT_LIMIT = int(os.getenv("PFA_SNAPSHOT_LIMIT", "100000"))
+# when set, the full flow and variables of a failed run are written here
+DUMP_DIR = os.getenv("PFA_DUMP_DIR")
+
+# items of a container rendered before it is cut
+MAX_ITEMS = 20
+
+# one thread so several failing runs don't serialize huge dumps all at once
+_dump_writer: ThreadPoolExecutor | None = None
+
+
+def _render(value: Any, limit: int) -> str:
+    renderer = reprlib.Repr()
+    renderer.maxlevel = 3
+    renderer.maxstring = renderer.maxother = limit
+    renderer.maxlist = renderer.maxtuple = renderer.maxset = renderer.maxdict = MAX_ITEMS
+    return renderer.repr(value)
+
+
+def snapshot_value(key: str, value: Any, limit: int = None) -> Any:
+    """A bounded stand-in for a variable. Small scalars are kept as is,
+    everything else is rendered with a bounded repr, and values that don't fit
+    in `limit` become a reference holding their type, size and a preview."""
+    limit = limit or SNAPSHOT_VALUE_LIMIT
+    if value is None or isinstance(value, (bool, int, float)):
+        return value
+    if isinstance(value, str) and len(value) <= limit:
+        return value
+    if not isinstance(value, (str, bytes, bytearray)):
+        text = _render(value, limit)
+        # containers longer than the repr shows are cut as well
+        cut = hasattr(value, "__len__") and len(value) > MAX_ITEMS
+        if len(text) <= limit and not cut:
+            return text
+    else:
+        text = value[:limit]
+        text = text if isinstance(text, str) else repr(text)
+    return {
+        "$ref": key,
+        "type": type(value).__name__,
+        "size": len(value) if hasattr(value, "__len__") else None,
+        "preview": text[:limit],
+    }
+
+
+def failure_snapshot(
+    error: Exception,
+    flow: Flow,
+    variables: Mapping[str, Any],
+    value_limit: int = None,
+    limit: int = None,
+    dump_dir: str = None,
+) -> dict[str, Any]:
+    """Builds the bounded snapshot of a failed run that is logged and raised.
+    With `dump_dir` the full flow and variables are also written to a file by a
+    background thread, and the snapshot points at it."""
+    limit = limit or SNAPSHOT_LIMIT
+    dump_dir = dump_dir or DUMP_DIR
+
+    snapshot_variables = {}
+    omitted = 0
+    size = 0
+    for key, value in variables.items():
+        if size >= limit:
+            omitted += 1
+            continue
+        value = snapshot_value(key, value, value_limit)
+        snapshot_variables[key] = value
+        # every rendered value is already bounded, so measuring it is cheap
+        size += len(key) + len(value if isinstance(value, str) else repr(value))
+    if omitted:
+        snapshot_variables["__omitted__"] = omitted
+
+    snapshot = {
+        "error": repr(error),
+        "dump": {
+            "flow": {
+                "id": flow.id,
+                "name": flow.name,
+                "start_id": flow.start_id,
+                "nodes": len(flow.nodes),
+                "edges": len(flow.edges),
+            },
+            "variables": snapshot_variables,
+        },
+    }
+
+    if dump_dir:
+        path = Path(dump_dir) / (
+            f"{flow.id or 'flow'}-{datetime.now(timezone.utc):%Y%m%dT%H%M%S}"
+            f"-{uuid.uuid4().hex[:8]}.json"
+        )
+        snapshot["dump"]["file"] = str(path)
+        write_dump(path, error, flow, dict(variables))
+
+    return snapshot
+
+
+def write_dump(path: Path, error: Exception, flow: Flow, variables: dict[str, Any]) -> Future:
+    global _dump_writer
+    if _dump_writer is None:
+        _dump_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="pfa-dump")
+
+    def write():
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            with open(path, "w") as f:
+                json.dump(
+                    {
+                        "error": repr(error),
+                        "dump": {"flow": flow.model_dump(), "variables": variables},
+                    },
+                    f,
+                    default=lambda o: repr(o),
+                )
+        except Exception as e:
+            global_logger.error(f"Error writing failure dump {path}: {str(e)}")
+
+    return _dump_writer.submit(write)
@@ -0,0 +1,102 @@
+# This file is licensed under the CC BY-NC-SA 4.0 license.
+# See https://creativecommons.org/licenses/by-nc-sa/4.0/ for details.
+
+import asyncio
+from collections import deque
+from typing import Any, Awaitable, Callable
+
+from app.utils.logs import global_logger
+
+
+class UpdateChannel:
+    """Bounded queue of updates drained by a dedicated sender task, so a
+    process only waits on the client when the client has fallen `maxsize`
+    updates behind. With `coalesce` a node update that is still waiting to be
+    sent is replaced in place by a newer update of the same node, so high
+    frequency updates (e.g. a node inside a loop) don't pile up."""
+
+    def __init__(
+        self,
+        send: Callable[[Any], Awaitable[None]],
+        maxsize: int = 100,
+        coalesce: bool = False,
+    ):
+        self._send = send
+        self._maxsize = maxsize
+        self._coalesce = coalesce
+        self._updates: deque[list[Any]] = deque()
+        self._waiting: dict[str, list[Any]] = {}
+        self._ready = asyncio.Event()
+        self._space = asyncio.Event()
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._closed = False
+        self._task: asyncio.Task | None = None
+
+    def start(self):
+        if not self._task:
+            self._task = asyncio.create_task(self._sender())
+        return self
+
+    async def put(self, update: Any):
+        if self._closed:
+            return
+
+        function_id = update.get("function_id") if isinstance(update, dict) else None
+        if self._coalesce and (slot := self._waiting.get(function_id)):
+            slot[0] = update
+            return
+
+        while len(self._updates) >= self._maxsize and not self._closed:
+            self._space.clear()
+            await self._space.wait()
+        if self._closed:
+            return
+
+        slot = [update, function_id]
+        self._updates.append(slot)
+        if self._coalesce and function_id is not None:
+            self._waiting[function_id] = slot
+        self._idle.clear()
+        self._ready.set()
+
+    async def join(self):
+        """Waits until every queued update has been sent."""
+        await self._idle.wait()
+
+    async def close(self, drain: bool = True):
+        if drain and not self._closed:
+            await self.join()
+        self._closed = True
+        self._space.set()
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _sender(self):
+        while True:
+            while not self._updates:
+                self._idle.set()
+                self._ready.clear()
+                await self._ready.wait()
+
+            slot = self._updates.popleft()
+            if self._waiting.get(slot[1]) is slot:
+                del self._waiting[slot[1]]
+            self._space.set()
+
+            try:
+                await self._send(slot[0])
+            except Exception as e:
+                # the client is gone, stop holding up whoever is producing
+                global_logger.error(f"Error in UpdateChannel: {str(e)}")
+                self._closed = True
+                self._updates.clear()
+                self._waiting.clear()
+                self._space.set()
+                self._idle.set()
+                return
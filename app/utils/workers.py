@@ -0,0 +1,292 @@
+# This file is licensed under the CC BY-NC-SA 4.0 license.
+# See https://creativecommons.org/licenses/by-nc-sa/4.0/ for details.
+
+import os
+import json
+import uuid
+import asyncio
+import hashlib
+import threading
+from multiprocessing.connection import wait
+from typing import Any
+from collections import OrderedDict
+
+from app.models import Flow
+from app.utils.metrics import latency, registry
+from app.utils.executors import spawn_context
+from app.utils.processor import Process
+from app.utils.exceptions import WorkerExitError, WorkerRunError
+
+
+async def _serve(tasks, results, max_runs: int, cache_size: int):
+    # a worker pulls a run off its queue only when it has room for it
+    loop = asyncio.get_running_loop()
+    limit = asyncio.Semaphore(max_runs)
+    flows: OrderedDict[str, tuple[Flow, Any]] = OrderedDict()
+    running = set()
+
+    async def run(
+        job_id: str,
+        flow_json: bytes,
+        variables: dict[str, Any] | None,
+        checkpoint_id: str | None,
+        resume: bool,
+        run_id: str | None,
+    ):
+        try:
+            key = hashlib.blake2b(flow_json, digest_size=16).hexdigest()
+            if key in flows:
+                flows.move_to_end(key)
+                flow, graph = flows[key]
+            else:
+                flow = Flow(**json.loads(flow_json))
+                graph = flow.compile()
+                flows[key] = (flow, graph)
+                if len(flows) > cache_size:
+                    flows.popitem(last=False)
+            process = Process(
+                flow,
+                variables=variables,
+                graph=graph,
+                checkpoint_id=checkpoint_id,
+                resume=resume,
+                run_id=run_id,
+            )
+            result = await process.run()
+            # results go back as json so anything a node returned can cross
+            result = json.loads(json.dumps(result, default=str))
+            results.send((job_id, True, result, (registry.drain(), latency.drain())))
+        except Exception as e:
+            results.send((job_id, False, str(e), (registry.drain(), latency.drain())))
+        finally:
+            limit.release()
+
+    while True:
+        await limit.acquire()
+        job = await loop.run_in_executor(None, tasks.get)
+        if job is None:
+            break
+        task = asyncio.create_task(run(*job))
+        running.add(task)
+        task.add_done_callback(running.discard)
+    await asyncio.gather(*running)
+
+
+def _worker(tasks, results, max_runs: int, cache_size: int):
+    asyncio.run(_serve(tasks, results, max_runs, cache_size))
+
+
+class _Worker:
+    # a worker process with a queue of runs and a pipe of results of its own,
+    # so one that dies takes no lock shared with the others with it and the
+    # pool knows which runs it had
+    def __init__(self, process, tasks, results):
+        self.process = process
+        self.tasks = tasks
+        self.results = results
+        self.jobs: set[str] = set()
+
+
+class WorkerPool:
+    """Runs flows on a pool of worker processes, each running up to max_runs
+    flows on an event loop of its own and keeping the last cache_size flows it
+    parsed and compiled. Flows are handed over as json so they are parsed on
+    the workers too, each to the worker with the fewest runs. A worker that
+    exits fails the runs it had with WorkerRunError and is replaced. A run
+    cancelled here still runs to the end on its worker, its result is
+    dropped."""
+
+    def __init__(self, workers: int = None, max_runs: int = None, cache_size: int = None):
+        self.workers = workers or int(os.getenv("PFA_WORKERS", "0")) or os.cpu_count()
+        self.max_runs = max_runs or int(os.getenv("PFA_WORKER_RUNS", "10"))
+        self.cache_size = cache_size or int(os.getenv("PFA_WORKER_FLOW_CACHE", "100"))
+        self._context = spawn_context
+        self._workers: list[_Worker] = []
+        self._pending: dict[str, tuple[asyncio.AbstractEventLoop, asyncio.Future]] = {}
+        self._lock = threading.Lock()
+        self._stopping = False
+        self._wake = None
+        self._watcher = None
+
+    def start(self) -> "WorkerPool":
+        if self._workers:
+            return self
+        self._stopping = False
+        self._workers = [self._spawn() for _ in range(self.workers)]
+        wake, self._wake = self._context.Pipe(duplex=False)
+        self._watcher = threading.Thread(target=self._watch, args=(wake,), daemon=True)
+        self._watcher.start()
+        return self
+
+    async def run(
+        self,
+        flow_json: bytes | str,
+        variables: dict[str, Any] = None,
+        checkpoint_id: str = None,
+        resume: bool = False,
+        run_id: str = None,
+    ) -> dict[str, Any]:
+        if isinstance(flow_json, str):
+            flow_json = flow_json.encode()
+        job_id = uuid.uuid4().hex
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        with self._lock:
+            if not self._workers:
+                raise WorkerRunError("Worker pool is not running.")
+            worker = min(self._workers, key=lambda w: len(w.jobs))
+            worker.jobs.add(job_id)
+            self._pending[job_id] = (loop, future)
+            worker.tasks.put((job_id, flow_json, variables, checkpoint_id, resume, run_id))
+        try:
+            return await future
+        finally:
+            with self._lock:
+                self._pending.pop(job_id, None)
+
+    def stop(self):
+        if not self._workers:
+            return
+        with self._lock:
+            self._stopping = True
+            workers = list(self._workers)
+        for worker in workers:
+            try:
+                worker.tasks.put(None)
+            except ValueError:
+                # closed, its worker died and was just replaced
+                pass
+        for worker in workers:
+            worker.process.join(timeout=5)
+            if worker.process.is_alive():
+                worker.process.terminate()
+        self._wake.send(None)
+        self._watcher.join()
+        self._wake.close()
+        with self._lock:
+            for worker in self._workers:
+                # a replacement started while stopping never got its None
+                if worker.process.is_alive():
+                    worker.process.terminate()
+                self._close(worker)
+            self._workers = []
+            for loop, future in self._pending.values():
+                loop.call_soon_threadsafe(
+                    self._resolve, future, False, WorkerExitError("Worker pool stopped.")
+                )
+            self._pending.clear()
+
+    def _spawn(self) -> _Worker:
+        tasks = self._context.Queue()
+        results, sender = self._context.Pipe(duplex=False)
+        process = self._context.Process(
+            target=_worker,
+            args=(tasks, sender, self.max_runs, self.cache_size),
+            daemon=True,
+        )
+        process.start()
+        # the worker holds the only sending end, so the pipe ends when it does
+        sender.close()
+        return _Worker(process, tasks, results)
+
+    def _watch(self, wake):
+        # reads the results of every worker and replaces the ones that exit,
+        # until stop() is done with them
+        stopped = set()
+        while True:
+            with self._lock:
+                live = [worker for worker in self._workers if worker not in stopped]
+            workers = {worker.results: worker for worker in live}
+            exits = {worker.process.sentinel: worker for worker in live}
+            for ready in wait([wake, *workers, *exits]):
+                if ready is wake:
+                    wake.close()
+                    return
+                if ready in workers:
+                    self._read(workers[ready])
+                elif self._stopping:
+                    self._read(exits[ready])
+                    stopped.add(exits[ready])
+                else:
+                    self._replace(exits[ready])
+
+    def _read(self, worker: _Worker):
+        try:
+            while worker.results.poll():
+                job_id, ok, value, (metrics, latencies) = worker.results.recv()
+                # what the run recorded is served by this process
+                registry.merge(metrics)
+                latency.merge(*latencies)
+                self._done(worker, job_id, ok, value)
+        except (EOFError, OSError):
+            # the worker is gone, its sentinel is ready too
+            pass
+
+    def _replace(self, worker: _Worker):
+        # results it sent before it exited are still delivered, the runs it
+        # had left fail once it is swapped out, and no run is given to it after
+        self._read(worker)
+        worker.process.join()
+        replacement = self._spawn()
+        with self._lock:
+            self._workers[self._workers.index(worker)] = replacement
+            jobs = list(worker.jobs)
+        error = WorkerExitError(
+            f"Worker {worker.process.pid} exited with code {worker.process.exitcode}."
+        )
+        for job_id in jobs:
+            self._done(worker, job_id, False, error)
+        self._close(worker)
+
+    def _done(self, worker: _Worker, job_id: str, ok: bool, value: Any):
+        with self._lock:
+            worker.jobs.discard(job_id)
+            pending = self._pending.get(job_id)
+        if pending:
+            loop, future = pending
+            loop.call_soon_threadsafe(self._resolve, future, ok, value)
+
+    @staticmethod
+    def _close(worker: _Worker):
+        worker.results.close()
+        # runs still buffered for a dead worker are never sent
+        worker.tasks.cancel_join_thread()
+        worker.tasks.close()
+
+    @staticmethod
+    def _resolve(future: asyncio.Future, ok: bool, value: Any):
+        if future.done():
+            return
+        if ok:
+            future.set_result(value)
+        elif isinstance(value, WorkerRunError):
+            future.set_exception(value)
+        else:
+            future.set_exception(WorkerRunError(value))
+
+
+class WorkerRun:
+    """A run handed to a WorkerPool, with the same run() as a Process so the
+    scheduler can queue it the same way."""
+
+    def __init__(
+        self,
+        pool: WorkerPool,
+        flow_json: bytes | str,
+        variables: dict[str, Any] = None,
+        checkpoint_id: str = None,
+        resume: bool = False,
+        run_id: str = None,
+    ):
+        self.pool = pool
+        self.flow_json = flow_json
+        self.variables = variables
+        # picked here so they can be returned before the run reaches a worker
+        self.run_id = run_id or uuid.uuid4().hex
+        self.checkpoint_id = checkpoint_id or self.run_id
+        self.resume = resume
+
+    async def run(self) -> dict[str, Any]:
+        return await self.pool.run(
+            self.flow_json, self.variables, self.checkpoint_id, self.resume, self.run_id
+        )
@@ -0,0 +1,77 @@
+# This file is licensed under the CC BY-NC-SA 4.0 license.
+# See https://creativecommons.org/licenses/by-nc-sa/4.0/ for details.
+
+# Compares runs per second of one flow over many variable sets, built as a new
+# Flow and Process per record against run_batch compiling the flow once.
+# Run from the root of the project: python -m benchmarks.bench_batch
+
+import os
+import sys
+import time
+import asyncio
+import argparse
+
+from app.models import Flow
+from app.utils import Process
+from app.utils.batch import run_batch
+from app.utils.logs import log_queue
+from benchmarks.bench_engine import chain_flow
+
+
+def input_flow(steps: int) -> Flow:
+    data = chain_flow(steps).model_dump()
+    data["name"] = "bench_batch"
+    data["nodes"][0]["data"]["args"] = [None, 1]
+    data["edges"].append(
+        {"id": "x", "source": "start", "sourceHandle": "x", "target": "0", "targetHandle": "0"}
+    )
+    data["variables"] = {"x": 0}
+    return Flow(**data)
+
+
+async def one_by_one(data: dict, inputs: list[dict], max_concurrency: int):
+    limit = asyncio.Semaphore(max_concurrency)
+
+    async def run(variables: dict):
+        async with limit:
+            flow = Flow(**{**data, "variables": variables})
+            return await Process(flow).run()
+
+    return await asyncio.gather(*(run(variables) for variables in inputs))
+
+
+async def batched(flow: Flow, inputs: list[dict], max_concurrency: int):
+    return [result async for result in run_batch(flow, inputs, max_concurrency)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Batch execution benchmark.")
+    parser.add_argument("--runs", type=int, default=2000)
+    parser.add_argument("--steps", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=10)
+    args = parser.parse_args()
+
+    # the process loggers write to stderr, keep it out of the results
+    os.environ.setdefault("PFA_LOG_LEVEL", "WARNING")
+    stderr, sys.stderr = sys.stderr, open(os.devnull, "w")
+
+    flow = input_flow(args.steps)
+    data = flow.model_dump()
+    inputs = [{"x": i} for i in range(args.runs)]
+
+    results = []
+    start = time.perf_counter()
+    asyncio.run(one_by_one(data, inputs, args.concurrency))
+    results.append(("one by one", time.perf_counter() - start))
+    start = time.perf_counter()
+    asyncio.run(batched(flow, inputs, args.concurrency))
+    results.append(("run_batch", time.perf_counter() - start))
+    log_queue.join()
+
+    sys.stderr = stderr
+    for name, seconds in results:
+        print(f"{name:>10}: {args.runs / seconds:8.0f} runs/s, {seconds:6.2f}s for {args.runs} runs")
+
+
+if __name__ == "__main__":
+    main()
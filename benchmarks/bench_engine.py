@@ -0,0 +1,71 @@
+# This file is licensed under the CC BY-NC-SA 4.0 license.
+# See https://creativecommons.org/licenses/by-nc-sa/4.0/ for details.
+
+# Measures the per-step overhead of the process engine on long linear flows.
+# Run from the root of the project: python -m benchmarks.bench_engine
+
+import time
+import asyncio
+import logging
+import argparse
+
+from app.models import Flow
+from app.utils import Process
+
+
+def chain_flow(steps: int) -> Flow:
+    """A linear flow of `steps` operator.add nodes, each adding 1 to the result
+    of the node before it."""
+    nodes = [
+        {
+            "id": str(i),
+            "type": "Add",
+            "data": {"function": "operator.add", "args": [0 if i == 0 else None, 1]},
+        }
+        for i in range(steps)
+    ]
+    edges = []
+    for i in range(1, steps):
+        edges.append(
+            {
+                "id": f"e{i - 1}-{i}",
+                "source": str(i - 1),
+                "sourceHandle": "e-out",
+                "target": str(i),
+                "targetHandle": "e-in",
+            }
+        )
+        edges.append(
+            {
+                "id": f"a{i - 1}-{i}",
+                "source": str(i - 1),
+                "sourceHandle": "__ignore__",
+                "target": str(i),
+                "targetHandle": "0",
+            }
+        )
+    return Flow(start_id="0", nodes=nodes, edges=edges, variables={})
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Process engine benchmark.")
+    parser.add_argument("--steps", type=int, nargs="+", default=[1000, 10000])
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+
+    for steps in args.steps:
+        flow = chain_flow(steps)
+        process = Process(flow)
+        start = time.perf_counter()
+        variables = asyncio.run(process.run())
+        elapsed = time.perf_counter() - start
+        assert variables[str(steps - 1)] == steps
+        print(
+            f"{steps:>7} steps: {elapsed:8.3f}s total, "
+            f"{elapsed / steps * 1000000:8.2f}μs per step"
+        )
+
+
+if __name__ == "__main__":
+    main()
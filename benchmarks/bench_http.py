@@ -0,0 +1,74 @@
+# This file is licensed under the CC BY-NC-SA 4.0 license.
+# See https://creativecommons.org/licenses/by-nc-sa/4.0/ for details.
+
+# Compares a new connection per request (plain requests.post) to the pooled
+# client behind the custom http_* functions, against a local echo_server.
+# Run from the root of the project: python -m benchmarks.bench_http
+
+import io
+import sys
+import time
+import socket
+import argparse
+import threading
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
+
+import uvicorn
+import requests
+
+from echo_server import create_app
+from app import custom
+from app.utils.http import http_client
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(port: int) -> uvicorn.Server:
+    config = uvicorn.Config(create_app(), host="127.0.0.1", port=port, log_level="error")
+    server = uvicorn.Server(config)
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.01)
+    return server
+
+
+def timed(func, url: str, requests_: int, workers: int) -> float:
+    start = time.perf_counter()
+    with ThreadPoolExecutor(workers) as pool:
+        list(pool.map(lambda i: func(url, json={"i": i}), range(requests_)))
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pooled http client benchmark.")
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--workers", type=int, default=1)
+    args = parser.parse_args()
+
+    port = free_port()
+    server = start_server(port)
+    url = f"http://127.0.0.1:{port}/log"
+
+    # echo_server prints every request, keep it out of the results
+    with contextlib.redirect_stdout(io.StringIO()):
+        results = [
+            ("requests.post", timed(requests.post, url, args.requests, args.workers)),
+            ("http_post", timed(custom.http_post, url, args.requests, args.workers)),
+        ]
+    server.should_exit = True
+
+    for name, seconds in results:
+        print(
+            f"{name:>14}: {seconds / args.requests * 1000:8.3f}ms per request, "
+            f"{args.requests / seconds:8.0f} requests/s"
+        )
+    print(f"pooled client: {http_client.metrics()}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
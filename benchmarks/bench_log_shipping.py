@@ -0,0 +1,76 @@
+# This file is licensed under the CC BY-NC-SA 4.0 license.
+# See https://creativecommons.org/licenses/by-nc-sa/4.0/ for details.
+
+# Compares posting every log record on its own, as CustomHandler used to, to
+# the batched and gzipped CustomHandler, against a local echo_server.
+# Run from the root of the project: python -m benchmarks.bench_log_shipping
+
+import io
+import time
+import logging
+import argparse
+import contextlib
+
+import requests
+
+from app.utils.logs import CustomHandler
+from benchmarks.bench_http import free_port, start_server
+
+
+def records(count: int) -> list[logging.LogRecord]:
+    return [
+        logging.LogRecord("bench", logging.INFO, __file__, 0, "Running function: %s", (f"node {i}",), None)
+        for i in range(count)
+    ]
+
+
+def per_record(url: str, count: int) -> tuple[float, float]:
+    formatter = logging.Formatter("%(asctime)s %(levelname)s %(message)s")
+    start = time.perf_counter()
+    for record in records(count):
+        requests.post(url, data=formatter.format(record))
+    seconds = time.perf_counter() - start
+    # the log worker was blocked for the whole time
+    return seconds, seconds
+
+
+def batched(url: str, count: int, batch_size: int) -> tuple[float, float]:
+    handler = CustomHandler(url, batch_size=batch_size)
+    handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(message)s"))
+    start = time.perf_counter()
+    for record in records(count):
+        handler.emit(record)
+    emitted = time.perf_counter() - start
+    handler.flush(timeout=600)
+    seconds = time.perf_counter() - start
+    assert handler.metrics()["sent"] == count, handler.metrics()
+    handler.close()
+    return emitted, seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Log shipping benchmark.")
+    parser.add_argument("--records", type=int, default=5000)
+    parser.add_argument("--batch-size", type=int, nargs="+", default=[10, 100, 1000])
+    args = parser.parse_args()
+
+    port = free_port()
+    server = start_server(port)
+    url = f"http://127.0.0.1:{port}/log"
+
+    # echo_server prints every record, keep it out of the results
+    with contextlib.redirect_stdout(io.StringIO()):
+        results = [("per record", *per_record(url, args.records))]
+        for batch_size in args.batch_size:
+            results.append((f"batches of {batch_size}", *batched(url, args.records, batch_size)))
+    server.should_exit = True
+
+    for name, emitted, seconds in results:
+        print(
+            f"{name:>17}: {args.records / seconds:8.0f} records/s shipped, "
+            f"{emitted / args.records * 1000000:8.1f}μs per record on the log worker"
+        )
+
+
+if __name__ == "__main__":
+    main()
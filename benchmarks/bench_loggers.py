@@ -0,0 +1,74 @@
+# This file is licensed under the CC BY-NC-SA 4.0 license.
+# See https://creativecommons.org/licenses/by-nc-sa/4.0/ for details.
+
+# Runs the same small flow many times and prints, every tenth of the runs, the
+# time per run, the memory held and the loggers and handlers alive, which
+# should all stay flat however many runs came before.
+# Run from the root of the project: python -m benchmarks.bench_loggers
+
+import os
+import sys
+import time
+import asyncio
+import argparse
+import tracemalloc
+
+from app.models import Flow
+from app.utils import Process
+from app.utils.logs import ProcessLogQueueHandler, log_queue
+
+
+def small_flow() -> Flow:
+    return Flow(
+        name="bench_loggers",
+        start_id="a",
+        nodes=[
+            {"id": "a", "type": "Add", "data": {"function": "operator.add", "args": [1, 2]}},
+            {"id": "b", "type": "Add", "data": {"function": "operator.add", "args": [3, 4]}},
+        ],
+        edges=[{"id": "ab", "source": "a", "sourceHandle": "e-out", "target": "b", "targetHandle": "e-in"}],
+        variables={},
+    )
+
+
+async def run(flow: Flow, runs: int):
+    for _ in range(runs):
+        await Process(flow).run()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Logger lifecycle benchmark.")
+    parser.add_argument("--runs", type=int, default=100000)
+    parser.add_argument("--level", default="INFO")
+    args = parser.parse_args()
+
+    # the process loggers write to stderr, keep it out of the results
+    os.environ.setdefault("PFA_LOG_LEVEL", args.level)
+    stderr, sys.stderr = sys.stderr, open(os.devnull, "w")
+    ProcessLogQueueHandler._stream_handler.setStream(sys.stderr)
+
+    flow = small_flow()
+    step = max(args.runs // 10, 1)
+    results = []
+    tracemalloc.start()
+    for done in range(step, args.runs + 1, step):
+        start = time.perf_counter()
+        asyncio.run(run(flow, step))
+        log_queue.join()
+        seconds = time.perf_counter() - start
+        handlers = sum(len(logger.handlers) for logger in ProcessLogQueueHandler._cached.values())
+        results.append(
+            (done, seconds / step, tracemalloc.get_traced_memory()[0], len(ProcessLogQueueHandler.loggers), handlers)
+        )
+    tracemalloc.stop()
+
+    sys.stderr = stderr
+    for done, per_run, memory, loggers, handlers in results:
+        print(
+            f"{done:>8} runs: {per_run * 1000000:8.1f}μs per run, {memory / 1024:8.0f}KiB traced, "
+            f"{loggers} live loggers, {handlers} handlers"
+        )
+
+
+if __name__ == "__main__":
+    main()
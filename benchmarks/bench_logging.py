@@ -0,0 +1,85 @@
+# This file is licensed under the CC BY-NC-SA 4.0 license.
+# See https://creativecommons.org/licenses/by-nc-sa/4.0/ for details.
+
+# Compares the per-step overhead of a run with process debug logs on and off.
+# Every node returns the same large tuple, which the debug logs render.
+# Run from the root of the project: python -m benchmarks.bench_logging
+
+import os
+import sys
+import time
+import asyncio
+import argparse
+
+from app.models import Flow
+from app.utils import Process
+from app.utils.logs import log_queue
+
+
+def payload_flow(steps: int, payload: int) -> Flow:
+    nodes = [
+        {
+            "id": str(i),
+            "type": "Tuple",
+            "data": {
+                "function": "builtins.tuple",
+                "args": [list(range(payload)) if i == 0 else None],
+            },
+        }
+        for i in range(steps)
+    ]
+    edges = []
+    for i in range(1, steps):
+        edges.append(
+            {
+                "id": f"e{i - 1}-{i}",
+                "source": str(i - 1),
+                "sourceHandle": "e-out",
+                "target": str(i),
+                "targetHandle": "e-in",
+            }
+        )
+        edges.append(
+            {
+                "id": f"a{i - 1}-{i}",
+                "source": str(i - 1),
+                "sourceHandle": "__ignore__",
+                "target": str(i),
+                "targetHandle": "0",
+            }
+        )
+    return Flow(start_id="0", nodes=nodes, edges=edges, variables={})
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Process logging benchmark.")
+    parser.add_argument("--steps", type=int, default=2000)
+    parser.add_argument("--payload", type=int, default=10000)
+    args = parser.parse_args()
+
+    # the process loggers write to stderr, keep it out of the results
+    stderr, sys.stderr = sys.stderr, open(os.devnull, "w")
+
+    results = []
+    for level in ("DEBUG", "INFO", "WARNING"):
+        os.environ["PFA_LOG_LEVEL"] = level
+        flow = payload_flow(args.steps, args.payload)
+        flow.name = f"bench_logging_{level}"
+        process = Process(flow)
+        start = time.perf_counter()
+        asyncio.run(process.run())
+        run = time.perf_counter() - start
+        log_queue.join()
+        drained = time.perf_counter() - start
+        results.append((level, run, drained))
+
+    sys.stderr = stderr
+    for level, run, drained in results:
+        print(
+            f"{level:>8}: {run / args.steps * 1000000:8.2f}μs per step on the loop, "
+            f"{drained / args.steps * 1000000:8.2f}μs per step including log output"
+        )
+
+
+if __name__ == "__main__":
+    main()
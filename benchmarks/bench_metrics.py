@@ -0,0 +1,57 @@
+# This file is licensed under the CC BY-NC-SA 4.0 license.
+# See https://creativecommons.org/licenses/by-nc-sa/4.0/ for details.
+
+# Measures what recording a metric or a latency costs on the hot path, and how
+# long rendering /metrics and querying latencies take with many functions.
+# Run from the root of the project: python -m benchmarks.bench_metrics
+
+import time
+import argparse
+
+from app.utils.metrics import LatencyRecorder, MetricsRegistry
+
+
+def per_call(func, calls: int) -> float:
+    start = time.perf_counter_ns()
+    for _ in range(calls):
+        func()
+    return (time.perf_counter_ns() - start) / calls
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Metrics benchmark.")
+    parser.add_argument("--calls", type=int, default=1000000)
+    parser.add_argument("--functions", type=int, nargs="+", default=[10, 100, 1000])
+    args = parser.parse_args()
+
+    registry = MetricsRegistry()
+    counter = registry.counter("bench_total", "Calls.", ("function",))
+    histogram = registry.histogram("bench_seconds", "Durations.", ("function",))
+    print(f"counter inc:       {per_call(lambda: counter.inc('operator.add'), args.calls):8.0f}ns per call")
+    print(f"histogram observe: {per_call(lambda: histogram.observe(0.003, 'operator.add'), args.calls):8.0f}ns per call")
+    recorder = LatencyRecorder()
+    print(f"latency record:    {per_call(lambda: recorder.record('flow', 'requests.get', 3000000), args.calls):8.0f}ns per call")
+
+    for functions in args.functions:
+        registry.reset()
+        for i in range(functions):
+            counter.inc(f"module.function_{i}")
+            histogram.observe(i / functions, f"module.function_{i}")
+        start = time.perf_counter()
+        text = registry.render()
+        seconds = time.perf_counter() - start
+        print(f"render {functions:>5} functions: {seconds * 1000:8.2f}ms, {len(text)} bytes")
+
+    for functions in args.functions:
+        recorder.reset()
+        for i in range(functions):
+            for ns in range(1000, 1000000, 10000):
+                recorder.record("flow", f"module.function_{i}", ns)
+        start = time.perf_counter()
+        recorder.query(sort="p99_ms", limit=10)
+        seconds = time.perf_counter() - start
+        print(f"query  {functions:>5} functions: {seconds * 1000:8.2f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+# This file is licensed under the CC BY-NC-SA 4.0 license.
+# See https://creativecommons.org/licenses/by-nc-sa/4.0/ for details.
+
+# Compares runs per second of concurrent runs of a cpu bound node on the thread
+# pool against "executor": "process", then the time a large bytes payload takes
+# to get to a process and back, pickled through the pipe or in shared memory.
+# Run from the root of the project: python -m benchmarks.bench_process_pool
+
+import os
+import sys
+import time
+import asyncio
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from app.models import Flow
+from app.utils import Process
+from app.utils import executors
+
+
+def burn(n: int) -> int:
+    total = 0
+    for i in range(n):
+        total += i * i % 7
+    return total
+
+
+def echo(data: bytes) -> bytes:
+    return data
+
+
+def burn_flow(work: int, executor: str) -> Flow:
+    return Flow(
+        name="bench_process_pool",
+        start_id="burn",
+        nodes=[
+            {
+                "id": "burn",
+                "type": "Burn",
+                "data": {"function": "benchmarks.bench_process_pool.burn", "args": [work], "executor": executor},
+            }
+        ],
+        edges=[],
+        variables={},
+    )
+
+
+def new_pool(workers: int) -> ProcessPoolExecutor:
+    pool = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn"))
+    # start every process so start up isn't part of the result
+    list(pool.map(burn, [0] * workers))
+    return pool
+
+
+async def run_flows(flow: Flow, runs: int, pool: ProcessPoolExecutor):
+    return await asyncio.gather(
+        *(Process(flow, process_executor=pool).run() for _ in range(runs))
+    )
+
+
+async def round_trips(data: bytes, count: int, pool: ProcessPoolExecutor):
+    for _ in range(count):
+        await executors.run_in_process("benchmarks.bench_process_pool.echo", [data], {}, pool)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Process pool benchmark.")
+    parser.add_argument("--runs", type=int, default=40)
+    parser.add_argument("--work", type=int, default=500000)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--payload", type=int, default=64 * 1024 * 1024)
+    parser.add_argument("--trips", type=int, default=10)
+    args = parser.parse_args()
+
+    # the process loggers write to stderr, keep it out of the results
+    os.environ.setdefault("PFA_LOG_LEVEL", "WARNING")
+    stderr, sys.stderr = sys.stderr, open(os.devnull, "w")
+
+    results = []
+    pool = new_pool(args.workers)
+    for executor in ("thread", "process"):
+        flow = burn_flow(args.work, executor)
+        start = time.perf_counter()
+        asyncio.run(run_flows(flow, args.runs, pool))
+        seconds = time.perf_counter() - start
+        results.append(f"{executor:>7}: {args.runs / seconds:8.1f} runs/s, {seconds:6.2f}s for {args.runs} runs")
+    pool.shutdown()
+
+    data = os.urandom(args.payload)
+    for name, threshold in (("pickled", args.payload + 1), ("shm", args.payload)):
+        # the processes read the threshold for results when they start
+        os.environ["PFA_SHM_THRESHOLD"] = str(threshold)
+        executors.SHM_THRESHOLD = threshold
+        pool = new_pool(1)
+        start = time.perf_counter()
+        asyncio.run(round_trips(data, args.trips, pool))
+        seconds = time.perf_counter() - start
+        results.append(f"{name:>7}: {seconds / args.trips * 1000:8.1f}ms per round trip of {args.payload} bytes")
+        pool.shutdown()
+
+    sys.stderr = stderr
+    for result in results:
+        print(result)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+# This file is licensed under the CC BY-NC-SA 4.0 license.
+# See https://creativecommons.org/licenses/by-nc-sa/4.0/ for details.
+
+# Measures time and memory per for_each iteration as the number of global
+# variables grows. Both should stay flat since an iteration only adds a layer.
+# Run from the root of the project: python -m benchmarks.bench_scopes
+
+import time
+import asyncio
+import logging
+import argparse
+import tracemalloc
+
+from app.models import Flow
+from app.utils import Process
+
+
+def loop_flow(iterations: int, globals_count: int) -> Flow:
+    variables = {f"global_{i}": "x" * 1024 for i in range(globals_count)}
+    return Flow(
+        start_id="loop",
+        nodes=[
+            {
+                "id": "loop",
+                "type": "ForEach",
+                "data": {
+                    "function": "for_each",
+                    "kwargs": {"array": list(range(iterations)), "next_function": "body"},
+                },
+            },
+            {"id": "body", "type": "Add", "data": {"function": "operator.add", "args": [None, 1]}},
+        ],
+        edges=[
+            {
+                "id": "loop-body",
+                "source": "loop",
+                "sourceHandle": "__ignore__",
+                "target": "body",
+                "targetHandle": "0",
+            }
+        ],
+        variables=variables,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="for_each scope benchmark.")
+    parser.add_argument("--iterations", type=int, default=2000)
+    parser.add_argument("--globals", type=int, nargs="+", default=[10, 1000, 10000])
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+
+    for globals_count in args.globals:
+        process = Process(loop_flow(args.iterations, globals_count))
+        tracemalloc.start()
+        start = time.perf_counter()
+        asyncio.run(process.run())
+        elapsed = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(
+            f"{globals_count:>6} globals: "
+            f"{elapsed / args.iterations * 1000000:8.2f}μs per iteration, "
+            f"{peak / args.iterations:8.0f}B peak per iteration"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+# This file is licensed under the CC BY-NC-SA 4.0 license.
+# See https://creativecommons.org/licenses/by-nc-sa/4.0/ for details.
+
+# Compares runs per second of a cpu bound flow run in this process against a
+# WorkerPool with an increasing number of worker processes.
+# Run from the root of the project: python -m benchmarks.bench_workers
+
+import os
+import sys
+import time
+import asyncio
+import argparse
+
+from app.models import Flow
+from app.utils import Process
+from app.utils.workers import WorkerPool
+
+
+def burn(n: int) -> int:
+    total = 0
+    for i in range(n):
+        total += i * i % 7
+    return total
+
+
+def cpu_flow(steps: int, work: int) -> Flow:
+    nodes = [
+        {"id": str(i), "type": "Burn", "data": {"function": "benchmarks.bench_workers.burn", "args": [work]}}
+        for i in range(steps)
+    ]
+    edges = [
+        {"id": f"e{i - 1}-{i}", "source": str(i - 1), "sourceHandle": "e-out", "target": str(i), "targetHandle": "e-in"}
+        for i in range(1, steps)
+    ]
+    return Flow(name="bench_workers", start_id="0", nodes=nodes, edges=edges, variables={})
+
+
+async def in_process(flow_json: str, runs: int):
+    async def run():
+        return await Process(Flow.model_validate_json(flow_json)).run()
+
+    return await asyncio.gather(*(run() for _ in range(runs)))
+
+
+async def on_pool(pool: WorkerPool, flow_json: str, runs: int):
+    return await asyncio.gather(*(pool.run(flow_json) for _ in range(runs)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Worker pool benchmark.")
+    parser.add_argument("--runs", type=int, default=200)
+    parser.add_argument("--steps", type=int, default=5)
+    parser.add_argument("--work", type=int, default=200000)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    args = parser.parse_args()
+
+    # the process loggers write to stderr, keep it out of the results
+    os.environ.setdefault("PFA_LOG_LEVEL", "WARNING")
+    stderr, sys.stderr = sys.stderr, open(os.devnull, "w")
+
+    flow_json = cpu_flow(args.steps, args.work).model_dump_json()
+    results = []
+    start = time.perf_counter()
+    asyncio.run(in_process(flow_json, args.runs))
+    results.append(("in process", time.perf_counter() - start))
+    for workers in args.workers:
+        pool = WorkerPool(workers=workers).start()
+        # warm up so process start up isn't part of the result
+        asyncio.run(on_pool(pool, flow_json, workers))
+        start = time.perf_counter()
+        asyncio.run(on_pool(pool, flow_json, args.runs))
+        results.append((f"{workers} workers", time.perf_counter() - start))
+        pool.stop()
+
+    sys.stderr = stderr
+    for name, seconds in results:
+        print(f"{name:>10}: {args.runs / seconds:8.1f} runs/s, {seconds:6.2f}s for {args.runs} runs")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,8 @@
 # This file is licensed under the CC BY-NC-SA 4.0 license.
 # See https://creativecommons.org/licenses/by-nc-sa/4.0/ for details.
+import gzip
+import json
+
 from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
 
@@ -21,10 +24,17 @@ def create_app():
     async def log(request: Request):
         print(f"request headers: {dict(request.headers.items())}")
         print(f"request query params: {dict(request.query_params.items())}")
+        body = await request.body()
+        # batches of records from the log handler are gzipped, one per line
+        if request.headers.get("content-encoding") == "gzip":
+            body = gzip.decompress(body)
+            for line in body.decode().splitlines():
+                print(f"request record: {line}")
+            return "received"
         try:
-            print(f"request json: {await request.json()}")
+            print(f"request json: {json.loads(body)}")
         except:
-            print(f"request body: {await request.body()}")
+            print(f"request body: {body}")
         return "received"
 
     return app
@@ -20,6 +20,13 @@ parser.add_argument(
     default=None,
     help="Run a Python script instead of the server. Provide the file path.",
 )
+parser.add_argument(
+    "--resume",
+    type=str,
+    default=None,
+    metavar="CHECKPOINT_ID",
+    help="Continue the script from the checkpoint with this id, logged when a run fails.",
+)
 parser.add_argument(
     "--out",
     type=str,
@@ -48,12 +55,60 @@ Environment Variables:
                 defaults to SimpleInMemoryDB
     PFA_HOST: host to use when starting http/ws server
     PFA_PORT: port to use when starting http/ws server
+    PFA_MAX_CONCURRENCY: max node functions a single process runs at once when
+                independent upstream producers are evaluated concurrently (default 10)
+    PFA_THREAD_POOL_SIZE: worker threads used to run sync (blocking) node functions
+                off the event loop (defaults to the ThreadPoolExecutor default)
+    PFA_INLINE_FUNCTIONS: comma separated patterns of cheap sync functions that are
+                called directly on the event loop (default "operator.*,builtins.*")
+    PFA_WS_QUEUE_SIZE: updates a websocket run can queue before it waits on the client (default 100)
+    PFA_WS_COALESCE: set to True to replace a node's queued websocket update with its newer one
+    PFA_LOG_LEVEL: level of the process loggers, records below it are never built (default INFO)
+    PFA_LOG_VALUE_LIMIT: max characters a single value (args, responses) renders to in a log (default 1000)
+    PFA_SNAPSHOT_VALUE_LIMIT: max characters a variable renders to in the snapshot of a failed run (default 1000)
+    PFA_SNAPSHOT_LIMIT: max total characters of the variables in the snapshot of a failed run (default 100000)
+    PFA_DUMP_DIR: when set, the full flow and variables of a failed run are written to a file here
+    PFA_HTTP_POOL_SIZE: keep-alive connections the http_* functions keep open per host (default 10)
+    PFA_HTTP_TIMEOUT: seconds the http_* functions wait on a server before failing (default 30)
+    PFA_CACHE_BACKEND: class used to store the results of nodes marked with cache (default app.utils.cache.MemoryBackend)
+    PFA_CACHE_SIZE: max results the in memory cache keeps before dropping the least recently used (default 1024)
+    PFA_CACHE_TTL: seconds a cached result is kept when the node doesn't set cache_ttl, 0 for no expiry (default 300)
+    PFA_CHECKPOINT_DIR: when set, runs are checkpointed to files here so they can be resumed
+    PFA_CHECKPOINT_STORE: class used to save checkpoints instead of files in PFA_CHECKPOINT_DIR
+    PFA_CHECKPOINT_INTERVAL: min seconds between two checkpoints of a run (default 30)
+    PFA_BATCH_CONCURRENCY: runs of a batch that are in flight at once, and the most a posted batch can ask for (default 10)
+    PFA_MAX_RUNS: runs posted to /api/run that run at once, the rest are queued (default 10)
+    PFA_MAX_RUNS_PER_FLOW: runs of a single flow that run at once, 0 for no limit (default 0)
+    PFA_RUN_QUEUE_SIZE: runs that can wait to start before new ones get a 429 (default 100)
+    PFA_RUN_HISTORY: finished runs kept so their status and results can be polled (default 1000)
+    PFA_WORKERS: when set, runs posted to /api/run go to this many worker processes
+    PFA_WORKER_RUNS: runs a worker process runs at once (default 10)
+    PFA_WORKER_FLOW_CACHE: parsed and compiled flows a worker process keeps (default 100)
+    PFA_RUN_QUEUE_PATH: when set, runs posted to /api/run are kept in a durable SQLite queue in this file
+    PFA_RUN_QUEUE_VISIBILITY: seconds a taken run is leased before it is handed out again (default 300)
+    PFA_RUN_QUEUE_ATTEMPTS: times a run is handed out before it is marked failed (default 3)
+    PFA_RUN_QUEUE_BATCH: runs taken off the durable queue at once (default 10)
+    PFA_RUN_QUEUE_POLL: seconds between checks of an idle durable queue (default 0.5)
+    PFA_RUN_QUEUE_RETRY_DELAY: seconds before a run whose worker died is tried again, doubled each attempt (default 1)
+    PFA_PROCESS_POOL_SIZE: processes that run nodes with "executor": "process" (defaults to the cpu count)
+    PFA_PRELOAD_MODULES: comma separated modules every process of that pool imports when it starts
+    PFA_SHM_THRESHOLD: bytes args and results at least this large go to and from that pool through shared memory (default 1048576)
+    PFA_LOG_BATCH_SIZE: records a flow's log url is sent at once (default 100)
+    PFA_LOG_FLUSH_INTERVAL: seconds between sends of a log url's partial batch (default 1)
+    PFA_LOG_BUFFER_SIZE: records waiting for a log url past which the oldest are dropped (default 10000)
+    PFA_LOG_RETRIES: times a batch a log url failed to take is sent again (default 3)
+    PFA_LOG_QUEUE_SIZE: records waiting for the log worker past which they are dropped (default 10000)
+    PFA_LOG_DROP_POLICY: drop_oldest, or drop_debug to drop records below INFO first (default drop_oldest)
+    PFA_LOGGER_CACHE: loggers, one per flow and log configuration, kept for later runs (default 1000)
+    PFA_METRIC_PUSH_INTERVAL: seconds between pushes of the metrics to a flow's parameters.metric.url (default 10)
+    PFA_METRIC_URLS: comma separated urls a flow's parameters.metric.url may push the metrics to (default none)
+    PFA_LATENCY_MAX_SERIES: flow and function pairs whose latencies are kept, later ones aren't recorded (default 10000)
 """
 parser.epilog = examples
 args = parser.parse_args()
 
 if args.script:
-    results = run_from_file(args.script)
+    results = run_from_file(args.script, checkpoint_id=args.resume)
     if args.out:
         with open(args.out, "w") as f:
             f.write(json.dumps(results, indent=4))
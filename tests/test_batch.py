@@ -0,0 +1,55 @@
+import asyncio
+from app.models import Flow
+from app.utils.batch import read_lines, run_batch
+from tests.test_constants import add_flow
+
+
+async def collect(flow: Flow, inputs, max_concurrency: int = None):
+    return [result async for result in run_batch(flow, inputs, max_concurrency)]
+
+
+def test_run_batch():
+    flow = add_flow()
+    results = asyncio.run(collect(flow, [{"x": i} for i in range(20)], 4))
+    assert sorted(result["index"] for result in results) == list(range(20))
+    for result in results:
+        assert result["variables"] == {"x": result["index"], "add": result["index"] + 1}
+    assert flow.variables == {"x": 0}
+
+
+def test_run_batch_reads_inputs_as_runs_finish():
+    started = []
+
+    async def inputs():
+        for x in (1, "a", 3):
+            started.append(x)
+            yield {"x": x}
+
+    async def run():
+        results = []
+        async for result in run_batch(add_flow(), inputs(), max_concurrency=1):
+            results.append((len(started), result))
+        return results
+
+    results = asyncio.run(run())
+    assert [read for read, _ in results] == [1, 2, 3]
+    assert "error" in results[1][1]
+    assert results[2][1]["variables"]["add"] == 4
+
+
+def test_read_lines_across_chunks():
+    async def chunks():
+        for chunk in (b'{"x"', b': 1}\n\n{"x": 2}\n{', b'"x"', b": 3}"):
+            yield chunk
+
+    async def read():
+        return [line async for line in read_lines(chunks())]
+
+    assert asyncio.run(read()) == [b'{"x": 1}', b'{"x": 2}', b'{"x": 3}']
+
+
+def test_run_batch_reports_bad_inputs():
+    inputs = [{"x": 1}, ValueError("not json"), {"x": 2}]
+    results = sorted(asyncio.run(collect(add_flow(), inputs)), key=lambda result: result["index"])
+    assert results[1] == {"index": 1, "error": "not json"}
+    assert [results[0]["variables"]["add"], results[2]["variables"]["add"]] == [2, 3]
@@ -0,0 +1,60 @@
+import time
+from app.utils.cache import MISSING, MemoryBackend, ResultCache
+
+
+def test_memory_backend_lru():
+    backend = MemoryBackend(maxsize=2)
+    backend.set("a", 1)
+    backend.set("b", 2)
+    assert backend.get("a") == 1
+    backend.set("c", 3)
+    assert backend.get("b") is None
+    assert backend.get("a") == 1 and backend.get("c") == 3
+    assert len(backend) == 2
+
+
+def test_memory_backend_ttl():
+    backend = MemoryBackend()
+    backend.set("a", 1, ttl=0.05)
+    backend.set("b", 2)
+    time.sleep(0.1)
+    assert backend.get("a", MISSING) is MISSING
+    assert backend.get("b") == 2
+
+
+def test_memory_backend_returns_copies():
+    backend = MemoryBackend()
+    value = {"items": [1]}
+    backend.set("a", value)
+    value["items"].append(2)
+    backend.get("a")["items"].append(3)
+    assert backend.get("a") == {"items": [1]}
+
+
+def test_result_cache():
+    cache = ResultCache(MemoryBackend(), ttl=60)
+    key = cache.key("operator.add", [1, 2], {})
+    assert key != cache.key("operator.add", [2, 1], {})
+    assert cache.key("f", [], {"a": 1, "b": 2}) == cache.key("f", [], {"b": 2, "a": 1})
+    assert cache.get(key) is MISSING
+    cache.set(key, 3)
+    assert cache.get(key) == 3
+    assert cache.metrics() == {"hits": 1, "misses": 1, "size": 1}
+    cache.clear()
+    assert cache.metrics() == {"hits": 0, "misses": 0, "size": 0}
+
+
+def test_result_cache_skips_args_without_a_key():
+    cache = ResultCache(MemoryBackend(), ttl=0)
+    # each of these would share its encoding with another call
+    assert cache.key("f", [(1, 2)], {}) is None
+    assert cache.key("f", [{1: "a"}], {}) is None
+    assert cache.key("f", [object()], {}) is None
+    assert cache.key("f", [], {"a": {1, 2}}) is None
+    assert cache.get(None) is MISSING
+    assert cache.metrics() == {"hits": 0, "misses": 1, "size": 0}
+    key = cache.key("f", [[1, 2], {"a": None}, 1.5, True], {})
+    # a ttl of 0 never expires
+    cache.set(key, 1)
+    assert cache.backend._entries[key][0] == 0.0
+    assert cache.get(key) == 1
@@ -0,0 +1,90 @@
+import os
+import asyncio
+import pytest
+from app.utils import Process
+from app.utils.checkpoint import FileCheckpointStore
+from app.utils.exceptions import ProcessRunError
+from tests.test_constants import calls, fail_on, loop_flow, reset
+
+
+def test_file_store_writes_changed_values_only(tmp_path):
+    store = FileCheckpointStore(str(tmp_path))
+    state = {"node": "a", "loops": {}, "variables": {"big": list(range(1000)), "small": 1}}
+    store.save("run", state)
+    path = store._path("run")
+    before = {name: os.stat(os.path.join(path, name)).st_mtime_ns for name in os.listdir(path)}
+
+    # only the variables written since are passed to the next save
+    store.save("run", {"node": "b", "loops": {}, "variables": {"small": 2}})
+    after = {name: os.stat(os.path.join(path, name)).st_mtime_ns for name in os.listdir(path)}
+
+    unchanged = [name for name in before if after.get(name) == before[name]]
+    assert len(unchanged) == 1 and len(after) == 3
+    state["variables"]["small"] = 2
+    state["node"] = "b"
+    assert store.load("run") == state
+    store.delete("run")
+    assert store.load("run") is None
+
+
+def test_process_resumes_loop(tmp_path, monkeypatch):
+    monkeypatch.setenv("PFA_CHECKPOINT_INTERVAL", "0")
+    store = FileCheckpointStore(str(tmp_path))
+    reset()
+    fail_on[:] = [3]
+    process = Process(loop_flow(), checkpoints=store)
+    with pytest.raises(ProcessRunError):
+        asyncio.run(process.run())
+    assert process.checkpoint_id == process.run_id
+    assert store.load(process.checkpoint_id)["loops"] == {"loop": 2}
+
+    fail_on.clear()
+    resumed = Process(loop_flow(), checkpoints=store, checkpoint_id=process.checkpoint_id, resume=True)
+    variables = asyncio.run(resumed.run())
+    assert calls == [1, 2, 3, 3, 4]
+    assert variables == asyncio.run(Process(loop_flow()).run())
+    assert variables["test"] == "done"
+    assert store.load(process.checkpoint_id) is None
+
+
+class RecordingStore(FileCheckpointStore):
+    def __init__(self, directory: str):
+        super().__init__(directory)
+        self.saved = []
+
+    def save(self, run_id, state):
+        self.saved.append((run_id, sorted(state["variables"])))
+        super().save(run_id, state)
+
+
+def test_checkpoints_are_per_run_and_incremental(tmp_path, monkeypatch):
+    monkeypatch.setenv("PFA_CHECKPOINT_INTERVAL", "0")
+    store = RecordingStore(str(tmp_path))
+    reset()
+    fail_on[:] = [4]
+    processes = [Process(loop_flow(), checkpoints=store) for _ in range(2)]
+    for process in processes:
+        with pytest.raises(ProcessRunError):
+            asyncio.run(process.run())
+    # the second run didn't overwrite the first one's checkpoint
+    first, second = processes
+    assert first.checkpoint_id != second.checkpoint_id
+    assert store.load(first.checkpoint_id)["loops"] == {"loop": 3}
+
+    saved = [keys for run_id, keys in store.saved if run_id == first.checkpoint_id]
+    # one save per iteration with only its result, then the one on failure
+    assert saved == [["loop__0"], ["loop__1"], ["loop__2"], []]
+    assert sorted(store.load(first.checkpoint_id)["variables"]) == ["loop__0", "loop__1", "loop__2"]
+
+
+def test_resume_without_checkpoint_fails(tmp_path):
+    store = FileCheckpointStore(str(tmp_path))
+    reset()
+    with pytest.raises(ProcessRunError, match="No checkpoint missing"):
+        asyncio.run(Process(loop_flow(), checkpoints=store, checkpoint_id="missing", resume=True).run())
+    # nothing ran and no checkpoint was left behind
+    assert calls == []
+    assert not store.exists("missing")
+    with pytest.raises(ProcessRunError, match="not enabled"):
+        asyncio.run(Process(loop_flow(), checkpoint_id="missing", resume=True).run())
+    assert calls == []
@@ -1,3 +1,9 @@
+import time
+import asyncio
+import threading
+from app.models import Flow
+from app.utils.executors import cancelled
+
 sample_flow = {
     "nodes": [
         {
@@ -711,3 +717,190 @@ sample_sequence_flow = {
     "edges": [],
     "variables": {"1": None},
 }
+
+
+# node functions the flows below call. they record what they were called with
+# in calls, and overlap and blocking_overlap how many of their calls were
+# running at once in running, so tests check ordering and concurrency rather
+# than how long a run took
+calls = []
+fail_on = []
+hang_on = []
+running = {"now": 0, "max": 0}
+_running_lock = threading.Lock()
+
+
+def reset():
+    calls.clear()
+    fail_on.clear()
+    hang_on.clear()
+    running.update(now=0, max=0)
+
+
+def _enter():
+    with _running_lock:
+        running["now"] += 1
+        running["max"] = max(running["max"], running["now"])
+
+
+def _exit():
+    with _running_lock:
+        running["now"] -= 1
+
+
+async def overlap(delay: float, value=None):
+    _enter()
+    try:
+        await asyncio.sleep(delay)
+        return value
+    except asyncio.CancelledError:
+        calls.append(("cancelled", value))
+        raise
+    finally:
+        _exit()
+
+
+def blocking_overlap(delay: float, value=None):
+    _enter()
+    try:
+        time.sleep(delay)
+        return value
+    finally:
+        _exit()
+
+
+async def record_call(name: str, *args):
+    calls.append(name)
+    await asyncio.sleep(0.01)
+    return name
+
+
+async def flaky(item: int):
+    calls.append(item)
+    if item in fail_on:
+        raise ValueError(f"failed on {item}")
+    if item in hang_on:
+        await asyncio.sleep(60)
+    return item
+
+
+def poll_cancelled(seconds: float) -> bool:
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        if cancelled():
+            calls.append("cancelled")
+            return False
+        time.sleep(0.01)
+    return True
+
+
+no_start_flow = '{"variables": {}, "edges": [], "nodes": [], "start_id": "x"}'
+
+
+def exit_flow() -> str:
+    return '{"variables": {}, "edges": [], "start_id": "exit", "nodes": [{"id": "exit", "type": "Exit", "data": {"function": "os._exit", "args": [1]}}]}'
+
+
+def add_flow() -> Flow:
+    return Flow(
+        start_id="add",
+        nodes=[{"id": "add", "type": "Add", "data": {"function": "operator.add", "args": [None, 1]}}],
+        edges=[{"id": "xa", "source": "start", "sourceHandle": "x", "target": "add", "targetHandle": "0"}],
+        variables={"x": 0},
+    )
+
+
+def sleep_flow(name: str, delay: float = 0.05) -> Flow:
+    return Flow(
+        name=name,
+        start_id="sleep",
+        nodes=[{"id": "sleep", "type": "Sleep", "data": {"function": "asyncio.sleep", "args": [delay, name]}}],
+        edges=[],
+        variables={},
+    )
+
+
+def loop_flow() -> Flow:
+    return Flow(
+        id="loop_flow",
+        start_id="loop",
+        nodes=[
+            {"id": "loop", "type": "ForEach", "data": {"function": "for_each", "args": [[1, 2, 3, 4]], "kwargs": {"next_function": "body"}}},
+            {"id": "body", "type": "Flaky", "data": {"function": "tests.test_constants.flaky", "args": [None]}},
+            {"id": "done", "type": "Set", "data": {"function": "set_variable", "kwargs": {"variable_name": "test", "value": "done"}}},
+        ],
+        edges=[
+            {"id": "lb", "source": "loop", "sourceHandle": "__ignore__", "target": "body", "targetHandle": "0"},
+            {"id": "ld", "source": "loop", "sourceHandle": "e-out", "target": "done", "targetHandle": "e-in"},
+        ],
+        variables={"test": "test"},
+    )
+
+
+def fan_in_flow(producers: int, function: str = "tests.test_constants.overlap") -> Flow:
+    nodes = [{"id": "c", "type": "Max", "data": {"function": "builtins.max", "args": [None] * producers}}]
+    edges = []
+    for i in range(producers):
+        nodes.append({"id": f"p{i}", "type": "Call", "data": {"function": function, "args": [0.05, i]}})
+        edges.append({"id": f"e{i}", "source": f"p{i}", "sourceHandle": "__ignore__", "target": "c", "targetHandle": str(i)})
+    return Flow(start_id="c", nodes=nodes, edges=edges, variables={})
+
+
+def parallel_flow(fail_fast: bool = True, failing: bool = False) -> Flow:
+    return Flow(
+        start_id="p",
+        nodes=[
+            {"id": "p", "type": "Parallel", "data": {"function": "parallel", "kwargs": {"array": ["a", "b", "c"], "fail_fast": fail_fast}}},
+            {"id": "a", "type": "Call", "data": {"function": "tests.test_constants.overlap", "args": [0.05, "A"]}},
+            {"id": "b", "type": "Call", "data": {"function": "tests.test_constants.overlap", "args": [0.05, "B"]}},
+            {"id": "c", "type": "Call", "data": {"function": "tests.test_constants.overlap" if not failing else "operator.truediv", "args": [0.05, 0]}},
+            {"id": "d", "type": "Set", "data": {"function": "set_variable", "kwargs": {"variable_name": "branch", "value": "a"}}},
+        ],
+        edges=[
+            {"id": "ad", "source": "a", "sourceHandle": "e-out", "target": "d", "targetHandle": "e-in"},
+        ],
+        variables={"branch": None},
+    )
+
+
+def for_each_flow(max_concurrency: int = None) -> Flow:
+    return Flow(
+        start_id="loop",
+        nodes=[
+            {"id": "loop", "type": "ForEach", "data": {"function": "for_each", "kwargs": {"array": [1, 2, 3], "next_function": "body", "max_concurrency": max_concurrency}}},
+            {"id": "body", "type": "Call", "data": {"function": "tests.test_constants.overlap", "args": [0.05, None]}},
+            {"id": "mul", "type": "Mul", "data": {"function": "operator.mul", "args": [None, 3]}},
+            {"id": "set", "type": "Set", "data": {"function": "set_variable", "kwargs": {"variable_name": "test", "value": "success"}}},
+        ],
+        edges=[
+            {"id": "lb", "source": "loop", "sourceHandle": "__ignore__", "target": "body", "targetHandle": "1"},
+            {"id": "bm", "source": "body", "sourceHandle": "e-out", "target": "mul", "targetHandle": "e-in"},
+            {"id": "bm0", "source": "body", "sourceHandle": "__ignore__", "target": "mul", "targetHandle": "0"},
+            {"id": "ms", "source": "mul", "sourceHandle": "e-out", "target": "set", "targetHandle": "e-in"},
+        ],
+        variables={"test": "test"},
+    )
+
+
+def timeout_flow(function: str, args: list, timeout_edge: bool = False, **parameters) -> Flow:
+    nodes = [
+        {"id": "slow", "type": "Slow", "data": {"function": function, "args": args, "timeout": 0.1}},
+        {"id": "set", "type": "Set", "data": {"function": "set_variable", "kwargs": {"variable_name": "test", "value": "timed out"}}},
+    ]
+    edges = []
+    if timeout_edge:
+        edges.append({"id": "st", "source": "slow", "sourceHandle": "__timeout__", "target": "set", "targetHandle": "e-in"})
+    return Flow(start_id="slow", nodes=nodes, edges=edges, variables={}, parameters=parameters or None)
+
+
+def branch_flow() -> Flow:
+    return Flow(
+        start_id="check",
+        nodes=[
+            {"id": "check", "type": "Branch", "data": {"function": "branch", "args": [None, "yes", "no"], "timeout": 5}},
+            {"id": "yes", "type": "Call", "data": {"function": "tests.test_constants.record_call", "args": ["yes"]}},
+            {"id": "no", "type": "Call", "data": {"function": "tests.test_constants.record_call", "args": ["no"]}},
+        ],
+        edges=[{"id": "fc", "source": "flag", "sourceHandle": "flag", "target": "check", "targetHandle": "0"}],
+        variables={},
+    )
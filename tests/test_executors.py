@@ -0,0 +1,74 @@
+import os
+import time
+import zlib
+import asyncio
+import multiprocessing
+import pytest
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from app.utils.executors import SHM_THRESHOLD, is_inline, run_in_process, run_in_thread
+
+
+def test_is_inline():
+    assert is_inline("operator.add")
+    assert is_inline("builtins.print")
+    assert not is_inline("requests.get")
+    assert is_inline("requests.get", ["requests.*"])
+    assert not is_inline("operator.add", [])
+
+
+def test_run_in_thread_reports_queue_wait():
+    async def run():
+        executor = ThreadPoolExecutor(max_workers=1)
+        first, second = await asyncio.gather(
+            run_in_thread(time.sleep, [0.1], {}, executor),
+            run_in_thread(time.sleep, [0.1], {}, executor),
+        )
+        executor.shutdown()
+        return first, second
+
+    first, second = asyncio.run(run())
+    assert first[0] is None and second[0] is None
+    assert min(first[1], second[1]) < 0.05
+    assert max(first[1], second[1]) >= 0.09
+    assert first[2] >= 0.09 and second[2] >= 0.09
+
+
+def test_run_in_process_shared_memory():
+    data = os.urandom(1024) * (SHM_THRESHOLD // 1024 + 1)
+    shm = set(os.listdir("/dev/shm"))
+
+    async def run():
+        with ProcessPoolExecutor(1, mp_context=multiprocessing.get_context("spawn")) as executor:
+            crc = await run_in_process("zlib.crc32", [data], {}, executor)
+            decompressed = await run_in_process("zlib.decompress", [zlib.compress(data)], {}, executor)
+            with pytest.raises(ZeroDivisionError):
+                await run_in_process("operator.truediv", [1, 0], {}, executor)
+        return crc, decompressed
+
+    crc, decompressed = asyncio.run(run())
+    assert crc[0] == zlib.crc32(data)
+    assert decompressed[0] == data
+    assert crc[1] >= 0 and crc[2] >= 0
+    # every block was unlinked once it was read
+    assert set(os.listdir("/dev/shm")) == shm
+
+
+def slow_echo(data: bytes) -> bytes:
+    time.sleep(0.5)
+    return data
+
+
+def test_run_in_process_cancelled_unlinks_shared_memory():
+    data = os.urandom(1024) * (SHM_THRESHOLD // 1024 + 1)
+    shm = set(os.listdir("/dev/shm"))
+
+    async def run(executor):
+        # started before it is cancelled, the worker goes on reading the arg
+        # and writes its result to a block of its own
+        await run_in_process("os.getpid", [], {}, executor)
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(run_in_process("tests.test_executors.slow_echo", [data], {}, executor), 0.2)
+
+    with ProcessPoolExecutor(1, mp_context=multiprocessing.get_context("spawn")) as executor:
+        asyncio.run(run(executor))
+    assert set(os.listdir("/dev/shm")) == shm
@@ -0,0 +1,59 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+
+from app import custom
+from app.utils.http import HttpClient, read_response
+
+
+class EchoHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if self.path == "/text":
+            body = b"plain"
+        self.send_response(500 if self.path == "/fail" else 200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), EchoHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+def test_connections_are_reused(server):
+    client = HttpClient(pool_size=2)
+    for i in range(5):
+        response = client.request("POST", f"{server}/echo", json={"i": i})
+        assert read_response(response) == {"i": i}
+    metrics = client.metrics()[server]
+    assert metrics["requests"] == 5
+    assert metrics["errors"] == 0
+    assert metrics["connections"] == 1
+    client.close()
+
+
+def test_read_response(server):
+    client = HttpClient()
+    assert read_response(client.request("POST", f"{server}/text")) == "plain"
+    with pytest.raises(requests.HTTPError):
+        read_response(client.request("POST", f"{server}/fail"))
+    client.close()
+
+
+def test_http_post(server):
+    assert custom.http_post(f"{server}/echo", json=[1, 2]) == [1, 2]
+    with pytest.raises(requests.HTTPError, match="'http_request' exception"):
+        custom.http_post(f"{server}/fail")
@@ -0,0 +1,221 @@
+import gzip
+import time
+import asyncio
+import logging
+import threading
+from logging import DEBUG, ERROR, INFO
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from app.models import Flow, Parameters
+from app.utils import Process
+from app.utils.logs import Capped, CustomHandler, Lazy, LogQueue, ProcessLogQueueHandler, log_queue
+
+
+def test_capped_limits_rendering():
+    assert str(Capped("short")) == "short"
+    assert str(Capped("x" * 50, 10)) == "xxxxxxxxxx...(50 chars)"
+    assert len(str(Capped(list(range(100000))))) < 200
+    assert str(Capped({"a": 1})) == "{'a': 1}"
+
+
+def test_lazy_defers_until_formatted():
+    calls = []
+
+    def build():
+        calls.append(1)
+        return "built"
+
+    value = Lazy(build)
+    assert calls == []
+    assert str(value) == "built"
+    assert calls == [1]
+
+
+def test_disabled_levels_are_not_queued():
+    ProcessLogQueueHandler.create_logger("ProcessLogger.test_logs", None)
+    logger = ProcessLogQueueHandler.loggers["ProcessLogger.test_logs"]
+    logger.setLevel(INFO)
+    calls = []
+
+    log_queue.join()
+    ProcessLogQueueHandler.log(
+        "ProcessLogger.test_logs", "debug", "%s", Lazy(lambda: calls.append(1))
+    )
+    assert log_queue.unfinished_tasks == 0
+    assert not ProcessLogQueueHandler.is_enabled("ProcessLogger.test_logs", "debug")
+    assert ProcessLogQueueHandler.is_enabled("ProcessLogger.test_logs", "info")
+    log_queue.join()
+    assert calls == []
+
+
+def test_capped_values_are_rendered_when_queued():
+    key = ProcessLogQueueHandler.create_logger("ProcessLogger.test_logs_queued", None)
+    logger = ProcessLogQueueHandler.loggers[key]
+    logger.setLevel(DEBUG)
+    messages = []
+    handler = logging.Handler()
+    handler.emit = lambda record: messages.append(record.getMessage())
+    logger.logger.addHandler(handler)
+
+    args = ["s", ["a"]]
+    ProcessLogQueueHandler.log(key, "debug", "Got args for s: %s", Capped(args))
+    # the run goes on changing what it logged
+    args[1].append("b")
+    log_queue.join()
+    logger.logger.removeHandler(handler)
+    ProcessLogQueueHandler.delete_logger(key)
+    assert messages == ["Got args for s: ['s', ['a']]"]
+
+
+def test_runs_share_a_cached_logger():
+    flow = Flow(
+        name="test_logs",
+        start_id="a",
+        nodes=[{"id": "a", "type": "Add", "data": {"function": "operator.add", "args": [1, 2]}}],
+        edges=[],
+        variables={},
+    )
+    live = set(ProcessLogQueueHandler.loggers)
+    processes = [Process(flow) for _ in range(3)]
+    adapters = [ProcessLogQueueHandler.loggers[p.logger_name] for p in processes]
+    assert len({id(adapter.logger) for adapter in adapters}) == 1
+    assert adapters[0].logger.handlers == [ProcessLogQueueHandler._stream_handler]
+    assert adapters[0].extra == {"flow": "ProcessLogger.test_logs.None", "run_id": processes[0].run_id}
+
+    for process in processes:
+        asyncio.run(process.run())
+    # released once each run finishes
+    assert set(ProcessLogQueueHandler.loggers) == live
+    Process(flow)
+    # and when a process that never ran is dropped
+    assert set(ProcessLogQueueHandler.loggers) == live
+
+
+def test_unused_loggers_are_evicted(monkeypatch, collector):
+    # loggers other tests still hold can't be evicted, room is left for two more
+    in_use = sum(1 for key in ProcessLogQueueHandler._cached if ProcessLogQueueHandler._in_use[key])
+    monkeypatch.setattr(ProcessLogQueueHandler, "cache_size", in_use + 2)
+    parameters = Parameters(log={"url": collector})
+    keys = [ProcessLogQueueHandler.create_logger(f"evict.{i}", parameters, run_id="run") for i in range(3)]
+    handler = ProcessLogQueueHandler.loggers[keys[0]].logger.handlers[1]
+    assert isinstance(handler, CustomHandler)
+    # every logger is in use, none can go
+    assert len([k for k in ProcessLogQueueHandler._cached if k[0].startswith("evict.")]) == 3
+    for key in keys:
+        ProcessLogQueueHandler.delete_logger(key)
+    assert len(ProcessLogQueueHandler._cached) <= in_use + 2
+    # closing waits on the handler's last batch, the caller doesn't
+    release = threading.Event()
+    close = handler.close
+    monkeypatch.setattr(handler, "close", lambda: release.wait(5) and close())
+    ProcessLogQueueHandler.create_logger("evict.other", None)
+    ProcessLogQueueHandler.create_logger("evict.more", None)
+    # the configuration with the url is no longer used by any cached logger
+    assert not [k for k in ProcessLogQueueHandler._cached if k[0].startswith("evict.") and k[1]]
+    assert not handler._closed
+    release.set()
+    handler._shipper.join(5)
+    assert handler._closed
+
+
+def test_log_queue_drop_oldest():
+    queue = LogQueue(maxsize=2)
+    for i in range(4):
+        assert queue.put(("logger", "info", f"record {i}"))
+    assert queue.get() == ("logger", "info", "record 2")
+    assert queue.get() == ("logger", "info", "record 3")
+    metrics = queue.metrics()
+    assert metrics["queued"] == 4 and metrics["dropped"] == 2 and metrics["waiting"] == 0
+
+
+def test_log_queue_drop_debug():
+    queue = LogQueue(maxsize=3, policy="drop_debug")
+    queue.put(("logger", "debug", "debug 0"), DEBUG)
+    queue.put(("logger", "info", "info 0"), INFO)
+    queue.put(("logger", "debug", "debug 1"), DEBUG)
+    # debug records make room for info ones, oldest first
+    assert queue.put(("logger", "error", "error 0"), ERROR)
+    assert queue.put(("logger", "info", "info 1"), INFO)
+    # with only info and above waiting, a new debug record is the one dropped
+    assert not queue.put(("logger", "debug", "debug 2"), DEBUG)
+    assert queue.put(("logger", "info", "info 2"), INFO)
+    assert [queue.get()[2] for _ in range(3)] == ["error 0", "info 1", "info 2"]
+    assert queue.metrics()["dropped_debug"] == 3
+    for _ in range(3):
+        queue.task_done()
+    # dropped records never need a task_done
+    queue.join()
+
+    with pytest.raises(ValueError):
+        LogQueue(policy="drop_everything")
+
+
+class CollectorHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    batches = []
+    failures = 0
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        status = 200
+        if CollectorHandler.failures:
+            CollectorHandler.failures -= 1
+            status = 503
+        else:
+            assert self.headers["Content-Encoding"] == "gzip"
+            CollectorHandler.batches.append(gzip.decompress(body).decode().splitlines())
+        self.send_response(status)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def collector():
+    CollectorHandler.batches = []
+    CollectorHandler.failures = 0
+    server = ThreadingHTTPServer(("127.0.0.1", 0), CollectorHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_address[1]}/log"
+    server.shutdown()
+    server.server_close()
+
+
+def record(message: str) -> logging.LogRecord:
+    return logging.LogRecord("test", INFO, __file__, 0, message, None, None)
+
+
+def test_custom_handler_batches(collector):
+    handler = CustomHandler(collector, batch_size=10, flush_interval=5)
+    for i in range(25):
+        handler.emit(record(f"record {i}"))
+    time.sleep(0.2)
+    # two full batches go out right away, the rest waits for the interval
+    assert [len(batch) for batch in CollectorHandler.batches] == [10, 10]
+    handler.flush()
+    assert sum(CollectorHandler.batches, []) == [f"record {i}" for i in range(25)]
+    assert handler.metrics() == {"sent": 25, "batches": 3, "retries": 0, "dropped": 0, "buffered": 0}
+    handler.close()
+
+
+def test_custom_handler_retries_and_bounds(collector):
+    CollectorHandler.failures = 1
+    handler = CustomHandler(collector, batch_size=2, flush_interval=5, max_buffered=3, retries=1)
+    for i in range(2):
+        handler.emit(record(f"record {i}"))
+    # emit doesn't wait on the collector while the first batch backs off
+    time.sleep(0.1)
+    for i in range(2, 7):
+        handler.emit(record(f"record {i}"))
+    # the retry is still half a second away, so nothing was shipped yet
+    assert CollectorHandler.batches == []
+    handler.flush()
+    metrics = handler.metrics()
+    assert metrics["retries"] == 1
+    assert metrics["dropped"] == 2
+    assert sum(CollectorHandler.batches, []) == [f"record {i}" for i in (0, 1, 4, 5, 6)]
+    handler.close()
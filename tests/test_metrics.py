@@ -0,0 +1,213 @@
+import time
+import random
+import asyncio
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from app.models import Flow
+from app.utils import Process
+from app.utils.exceptions import ProcessRunError
+from app.utils.metrics import (
+    LatencyHistogram,
+    LatencyRecorder,
+    MetricsRegistry,
+    latency,
+    node_duration,
+    node_errors,
+    run_duration,
+    runs,
+)
+
+
+def test_counter_and_histogram_render():
+    registry = MetricsRegistry()
+    counter = registry.counter("test_total", "A counter.", ("kind",))
+    counter.inc("a")
+    counter.inc("a", amount=2)
+    histogram = registry.histogram("test_seconds", "A histogram.", ("kind",), buckets=(0.1, 1))
+    for value in (0.05, 0.5, 5):
+        histogram.observe(value, "b")
+    assert registry.render().splitlines() == [
+        "# HELP test_total A counter.",
+        "# TYPE test_total counter",
+        'test_total{kind="a"} 3',
+        "# HELP test_seconds A histogram.",
+        "# TYPE test_seconds histogram",
+        'test_seconds_bucket{kind="b",le="0.1"} 1',
+        'test_seconds_bucket{kind="b",le="1"} 2',
+        'test_seconds_bucket{kind="b",le="+Inf"} 3',
+        'test_seconds_sum{kind="b"} 5.55',
+        'test_seconds_count{kind="b"} 3',
+    ]
+    assert registry.counter("test_total", "A counter.") is counter
+    with pytest.raises(ValueError):
+        registry.histogram("test_total", "Not a counter.")
+
+
+def test_drained_metrics_merge():
+    worker, server = MetricsRegistry(), MetricsRegistry()
+    for registry in (worker, server):
+        registry.counter("test_total", "A counter.", ("kind",))
+        registry.histogram("test_seconds", "A histogram.", ("kind",), buckets=(0.1, 1))
+    worker._metrics["test_total"].inc("a", amount=2)
+    worker._metrics["test_seconds"].observe(0.5, "b")
+    server.merge(worker.drain())
+    worker._metrics["test_total"].inc("a")
+    worker._metrics["test_seconds"].observe(5, "b")
+    server.merge(worker.drain())
+    # nothing new, nothing drained
+    assert worker.drain() == {"test_total": {}, "test_seconds": {}}
+    # the worker keeps its totals, the server holds the same ones
+    assert server.render() == worker.render()
+    assert server._metrics["test_total"].value("a") == 3
+    assert server._metrics["test_seconds"].count("b") == 2
+
+
+def test_process_records_metrics():
+    flow = Flow(
+        name="test_metrics",
+        start_id="add",
+        nodes=[
+            {"id": "add", "type": "Add", "data": {"function": "operator.add", "args": [1, 2]}},
+            {"id": "div", "type": "Div", "data": {"function": "operator.truediv", "args": [1, 0]}},
+        ],
+        edges=[{"id": "ad", "source": "add", "sourceHandle": "e-out", "target": "div", "targetHandle": "e-in"}],
+        variables={},
+    )
+    added = node_duration.count("operator.add")
+    errors = node_errors.value("operator.truediv", "ZeroDivisionError")
+    with pytest.raises(ProcessRunError):
+        asyncio.run(Process(flow).run())
+    flow.start_id = "add"
+    flow.edges = []
+    asyncio.run(Process(flow).run())
+    assert node_duration.count("operator.add") == added + 2
+    assert node_errors.value("operator.truediv", "ZeroDivisionError") == errors + 1
+    assert runs.value("test_metrics", "failed") == 1
+    assert runs.value("test_metrics", "completed") == 1
+    assert run_duration.count("test_metrics") == 2
+
+
+def test_latency_histogram_percentiles():
+    rng = random.Random(1)
+    values = sorted(int(rng.lognormvariate(13, 1.5)) for _ in range(20000))
+    histogram = LatencyHistogram()
+    for value in values:
+        histogram.record(value)
+    assert histogram.count == len(values)
+    for q in (50, 90, 99, 99.9):
+        exact = values[round(q / 100 * len(values)) - 1]
+        assert abs(histogram.percentile(q) - exact) / exact < 0.07
+    assert histogram.percentile(100) == values[-1]
+    for index in range(histogram.SIZE - 1):
+        lower, upper = histogram.bounds(index)
+        assert histogram.bounds(index + 1)[0] == upper
+
+
+def test_latency_recorder_query():
+    recorder = LatencyRecorder(max_series=3)
+    for ns in (1_000_000, 2_000_000, 3_000_000):
+        recorder.record("a", "requests.get", ns)
+    recorder.record("b", "requests.get", 10_000_000)
+    recorder.record("a", "operator.add", 1_000)
+    recorder.record("c", "operator.add", 1_000)
+    assert recorder.dropped == 1
+
+    rows = recorder.query()
+    assert [(row["flow"], row["function"], row["count"]) for row in rows] == [
+        ("*", "requests.get", 4),
+        ("*", "operator.add", 1),
+    ]
+    assert rows[0]["max_ms"] == 10.0
+    rows = recorder.query(flow="a", sort="count", limit=1)
+    assert [(row["function"], row["count"]) for row in rows] == [("requests.get", 3)]
+    exported = {(row["flow"], row["function"]): row for row in recorder.export()}
+    assert exported[("a", "requests.get")]["total_ns"] == 6_000_000
+    assert sum(exported[("a", "requests.get")]["buckets"].values()) == 3
+
+
+def test_drained_latencies_merge():
+    worker, server = LatencyRecorder(), LatencyRecorder(max_series=1)
+    worker.record("a", "f", 1000)
+    worker.record("a", "f", 3000)
+    server.merge(*worker.drain())
+    worker.record("a", "f", 2000)
+    worker.record("b", "f", 1000)
+    server.merge(*worker.drain())
+    assert worker.drain() == ({}, 0)
+    assert server.get("a", "f").count == 3
+    assert server.get("a", "f").max == 3000
+    # past max_series the server counts what it can't keep as dropped
+    assert server.get("b", "f") is None and server.dropped == 1
+
+
+def test_process_records_latency():
+    flow = Flow(
+        name="test_latency",
+        start_id="sleep",
+        nodes=[{"id": "sleep", "type": "Sleep", "data": {"function": "time.sleep", "args": [0.01]}}],
+        edges=[],
+        variables={},
+    )
+    for _ in range(3):
+        asyncio.run(Process(flow).run())
+    histogram = latency.get("test_latency", "time.sleep")
+    assert histogram.count == 3
+    assert histogram.min >= 10_000_000
+
+
+class SinkHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    bodies = []
+
+    def do_POST(self):
+        SinkHandler.bodies.append(self.rfile.read(int(self.headers["Content-Length"])).decode())
+        self.send_response(200)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+def test_metrics_are_pushed():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), SinkHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}/metrics"
+    registry = MetricsRegistry(allowed_urls=[url])
+    registry.counter("pushed_total", "Pushed.").inc()
+    pusher = registry.push_to(url)
+    assert registry.push_to(pusher.url) is pusher
+    # only urls the server allows are pushed to
+    assert registry.push_to("http://127.0.0.1:1/elsewhere") is None
+    pusher.push()
+    registry.close()
+    server.shutdown()
+    server.server_close()
+    assert pusher.pushes >= 2
+    assert "pushed_total 1" in SinkHandler.bodies[0]
+
+
+def test_unused_pushers_stop(monkeypatch):
+    monkeypatch.setenv("PFA_METRIC_PUSH_INTERVAL", "0.05")
+    server = ThreadingHTTPServer(("127.0.0.1", 0), SinkHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}/metrics"
+    registry = MetricsRegistry(allowed_urls=[url])
+    first = registry.push_to(url)
+    second = registry.push_to(url)
+    registry.release(first)
+    time.sleep(0.2)
+    assert first._thread.is_alive()
+    registry.release(second)
+    first._thread.join(5)
+    server.shutdown()
+    server.server_close()
+    assert not first._thread.is_alive()
+    assert registry._pushers == {}
+    # a later run starts a new one
+    pusher = registry.push_to(url)
+    assert pusher is not first
+    registry.close()
@@ -1,5 +1,5 @@
 import pytest
-from app.models import Flow
+from app.models import Flow, CompiledFlow
 from tests.test_constants import (
     sample_flow,
     exec_edges,
@@ -87,3 +87,39 @@ def test_get_kwarg_edges_by_target():
     flow = Flow(**sample_flow)
     kwarg_edge = flow.get_kwarg_edges_by_target("59697")[0]
     assert kwarg_edge.id == "xyflow__edge-88179__ignore__-59697condition"
+
+
+def test_compile():
+    flow = Flow(**sample_flow)
+    compiled = flow.compile()
+
+    assert isinstance(compiled, CompiledFlow)
+    assert compiled.start_id == "93043"
+    assert compiled.next_functions == {
+        edge["source"]: edge["target"] for edge in exec_edges
+    }
+    # compiling must not convert the handles of the flow's own edges
+    assert [e.model_dump() for e in flow.arg_edges] == arg_edges
+
+
+def test_compiled_lookups_match_flow():
+    flow = Flow(**sample_flow)
+    compiled = flow.compile()
+
+    for node in flow.nodes:
+        assert compiled.get_node(node.id).next == flow.get_node(node.id).next
+        assert [e.id for e in compiled.get_except_edges_by_source(node.id)] == [
+            e.id for e in flow.get_except_edges_by_source(node.id)
+        ]
+        assert [
+            (e.id, e.targetHandle) for e in compiled.get_arg_edges_by_target(node.id)
+        ] == [(e.id, e.targetHandle) for e in flow.get_arg_edges_by_target(node.id)]
+        assert [e.id for e in compiled.get_kwarg_edges_by_target(node.id)] == [
+            e.id for e in flow.get_kwarg_edges_by_target(node.id)
+        ]
+
+
+def test_compiled_get_node_not_found():
+    compiled = Flow(**sample_flow).compile()
+    assert not compiled.get_node("not_found")
+    assert compiled.get_arg_edges_by_target("not_found") == []
@@ -1,8 +1,28 @@
+import os
+import sys
+import time
+import asyncio
+import multiprocessing
 import pytest
+from concurrent.futures import ProcessPoolExecutor
 from app.utils import Process
 from app.models import Flow
 from app.utils.exceptions import ProcessRunError, FunctionRunError
-from tests.test_constants import sample_flow, sample_two_flow, sample_fail_flow
+from app.utils.cache import MemoryBackend, ResultCache
+from benchmarks.bench_engine import chain_flow
+from tests.test_constants import (
+    sample_flow,
+    sample_two_flow,
+    sample_fail_flow,
+    branch_flow,
+    calls,
+    fan_in_flow,
+    for_each_flow,
+    parallel_flow,
+    reset,
+    running,
+    timeout_flow,
+)
 
 
 def test_process():
@@ -97,3 +117,232 @@ def test_process_call_function():
     process = Process(Flow(**sample_two_flow))
     response = process._call_function("2", "operator.add", [3, 3], {})
     assert response == 6
+
+
+def test_process_long_chain_does_not_recurse():
+    steps = sys.getrecursionlimit() * 2
+    process = Process(chain_flow(steps))
+    variables = asyncio.run(process.run())
+    assert variables[str(steps - 1)] == steps
+
+
+def test_process_circular_dependency():
+    flow = Flow(
+        start_id="1",
+        nodes=[
+            {"id": "1", "type": "Add", "data": {"function": "operator.add", "args": [None, 1]}},
+            {"id": "2", "type": "Add", "data": {"function": "operator.add", "args": [None, 1]}},
+        ],
+        edges=[
+            {"id": "a", "source": "2", "sourceHandle": "__ignore__", "target": "1", "targetHandle": "0"},
+            {"id": "b", "source": "1", "sourceHandle": "__ignore__", "target": "2", "targetHandle": "0"},
+        ],
+        variables={},
+    )
+    with pytest.raises(ProcessRunError):
+        asyncio.run(Process(flow).run())
+
+
+def test_process_concurrent_producers():
+    reset()
+    variables = asyncio.run(Process(fan_in_flow(5)).run())
+    # independent producers run at once, unless the process allows one call
+    assert running["max"] == 5
+    reset()
+    assert variables == asyncio.run(Process(fan_in_flow(5), max_concurrency=1).run())
+    assert running["max"] == 1
+    assert variables["c"] == 4
+
+
+def test_process_concurrent_producers_share_dependency():
+    reset()
+    flow = Flow(
+        start_id="c",
+        nodes=[
+            {"id": "c", "type": "Pair", "data": {"function": "operator.add", "args": [None, None]}},
+            {"id": "x", "type": "Call", "data": {"function": "tests.test_constants.record_call", "args": ["x", None]}},
+            {"id": "y", "type": "Call", "data": {"function": "tests.test_constants.record_call", "args": ["y", None]}},
+            {"id": "z", "type": "Call", "data": {"function": "tests.test_constants.record_call", "args": ["z"]}},
+        ],
+        edges=[
+            {"id": "xc", "source": "x", "sourceHandle": "__ignore__", "target": "c", "targetHandle": "0"},
+            {"id": "yc", "source": "y", "sourceHandle": "__ignore__", "target": "c", "targetHandle": "1"},
+            {"id": "zx", "source": "z", "sourceHandle": "__ignore__", "target": "x", "targetHandle": "1"},
+            {"id": "zy", "source": "z", "sourceHandle": "__ignore__", "target": "y", "targetHandle": "1"},
+        ],
+        variables={},
+    )
+    variables = asyncio.run(Process(flow).run())
+    assert variables["c"] == "xy"
+    assert calls.count("z") == 1
+
+
+def test_process_sync_functions_run_off_loop():
+    reset()
+    flow = fan_in_flow(5, "tests.test_constants.blocking_overlap")
+    flow.nodes[0].data.function = "builtins.print"
+    variables = asyncio.run(Process(flow).run())
+    # each blocking call had a thread of its own
+    assert running["max"] == 5
+    assert variables == {"p0": 0, "p1": 1, "p2": 2, "p3": 3, "p4": 4, "c": None}
+
+
+def test_process_parallel():
+    reset()
+    variables = asyncio.run(Process(parallel_flow()).run())
+    assert running["max"] == 3
+    assert variables == {"branch": "a", "a": "A", "b": "B", "c": 0, "d": "a", "p": "Completed"}
+
+
+def test_process_parallel_fail_fast():
+    reset()
+    process = Process(parallel_flow(failing=True))
+    with pytest.raises(ProcessRunError):
+        asyncio.run(process.run())
+    # the branches still running were cancelled, not waited on
+    assert sorted(calls) == [("cancelled", "A"), ("cancelled", "B")]
+    assert process._variables == {"branch": None}
+
+
+def test_process_parallel_collect_all():
+    reset()
+    process = Process(parallel_flow(fail_fast=False, failing=True))
+    with pytest.raises(ProcessRunError):
+        asyncio.run(process.run())
+    assert calls == []
+    assert process._variables == {"branch": "a", "a": "A", "b": "B", "d": "a"}
+
+
+def test_process_for_each_concurrent():
+    reset()
+    variables = asyncio.run(Process(for_each_flow(max_concurrency=3)).run())
+    assert running["max"] == 3
+    assert variables == {
+        "test": "success",
+        "loop__0": {"loop": 1, "body": 1, "mul": 3, "set": "success"},
+        "loop__1": {"loop": 2, "body": 2, "mul": 6, "set": "success"},
+        "loop__2": {"loop": 3, "body": 3, "mul": 9, "set": "success"},
+        "loop": "Completed",
+    }
+    assert list(variables)[1:4] == ["loop__0", "loop__1", "loop__2"]
+
+    reset()
+    flow = for_each_flow()
+    assert asyncio.run(Process(flow).run()) == variables
+    assert running["max"] == 1
+    assert flow.variables == {"test": "test"}
+
+
+def test_process_for_each_not_capped_by_process_limit():
+    reset()
+    flow = for_each_flow(max_concurrency=30)
+    flow.nodes[0].data.kwargs["array"] = list(range(30))
+    variables = asyncio.run(Process(flow, max_concurrency=2).run())
+    assert running["max"] == 30
+    assert variables["loop__29"]["mul"] == 87
+
+    reset()
+    asyncio.run(Process(parallel_flow(), max_concurrency=1).run())
+    assert running["max"] == 3
+
+
+def test_process_cached_node():
+    reset()
+    flow = Flow(
+        start_id="x",
+        nodes=[
+            {"id": "x", "type": "Call", "data": {"function": "tests.test_constants.record_call", "args": ["x", 1], "cache": True}},
+            {"id": "y", "type": "Call", "data": {"function": "tests.test_constants.record_call", "args": ["y", 1]}},
+        ],
+        edges=[{"id": "xy", "source": "x", "sourceHandle": "e-out", "target": "y", "targetHandle": "e-in"}],
+        variables={},
+    )
+    cache = ResultCache(MemoryBackend())
+    for _ in range(3):
+        assert asyncio.run(Process(flow, cache=cache).run()) == {"x": "x", "y": "y"}
+    assert calls == ["x", "y", "y", "y"]
+    assert cache.metrics() == {"hits": 2, "misses": 1, "size": 1}
+
+
+def test_process_executor_process():
+    flow = Flow(
+        start_id="pid",
+        nodes=[
+            {"id": "pid", "type": "Pid", "data": {"function": "os.getpid", "executor": "process"}},
+            {"id": "div", "type": "Div", "data": {"function": "operator.truediv", "args": [1, 0], "executor": "process"}},
+        ],
+        edges=[],
+        variables={},
+    )
+    with ProcessPoolExecutor(1, mp_context=multiprocessing.get_context("spawn")) as executor:
+        variables = asyncio.run(Process(flow, process_executor=executor).run())
+        assert variables["pid"] != os.getpid()
+
+        flow.start_id = "div"
+        with pytest.raises(ProcessRunError, match="ZeroDivisionError"):
+            asyncio.run(Process(flow, process_executor=executor).run())
+
+
+def test_process_node_timeout():
+    reset()
+    with pytest.raises(ProcessRunError, match=r"NodeTimeoutError\('Function slow timed out after 0.1s"):
+        asyncio.run(Process(timeout_flow("tests.test_constants.overlap", [5, "slow"])).run())
+    # the call was cancelled rather than waited on
+    assert calls == [("cancelled", "slow")]
+
+    variables = asyncio.run(Process(timeout_flow("asyncio.sleep", [5], timeout_edge=True)).run())
+    assert variables["slow"] == "Function slow timed out after 0.1s"
+    assert variables["test"] == "timed out"
+
+
+def test_process_node_timeout_cancels_thread():
+    reset()
+    with pytest.raises(ProcessRunError):
+        asyncio.run(Process(timeout_flow("tests.test_constants.poll_cancelled", [2])).run())
+    time.sleep(0.1)
+    assert calls == ["cancelled"]
+
+
+def test_process_flow_timeout():
+    flow = timeout_flow("asyncio.sleep", [5], timeout=0.05)
+    flow.nodes[0].data.timeout = None
+    with pytest.raises(ProcessRunError, match="did not complete within 0.05s"):
+        asyncio.run(Process(flow).run())
+
+    flow = timeout_flow("asyncio.sleep", [5], timeout_edge=True, node_timeout=0.1)
+    flow.nodes[0].data.timeout = None
+    assert asyncio.run(Process(flow).run())["test"] == "timed out"
+
+
+def test_process_concurrent_branches():
+    flow = branch_flow()
+    graph = flow.compile()
+
+    async def run():
+        return await asyncio.gather(
+            *(Process(flow, variables={"flag": i % 2 == 0}, graph=graph).run() for i in range(4))
+        )
+
+    # each run follows the branch it took, whatever the others took
+    results = asyncio.run(run())
+    assert [("yes" in variables, "no" in variables) for variables in results] == [
+        (True, False), (False, True), (True, False), (False, True)
+    ]
+
+
+def test_process_allow_list_checked_before_resolving():
+    flow = Flow(
+        start_id="a",
+        nodes=[
+            {"id": "a", "type": "Add", "data": {"function": "operator.add", "args": [1, 2]}},
+            {"id": "b", "type": "Set", "data": {"function": "set_variable", "kwargs": {"variable_name": "x", "value": 1}}},
+        ],
+        edges=[{"id": "ab", "source": "a", "sourceHandle": "e-out", "target": "b", "targetHandle": "e-in"}],
+        variables={},
+    )
+    assert asyncio.run(Process(flow, allow_list=["operator.add"]).run())["x"] == 1
+
+    # never imported, it isn't allowed
+    flow.nodes[0].data.function = "tests.no_such_module.f"
+    with pytest.raises(ProcessRunError, match="not in allow list"):
+        asyncio.run(Process(flow, allow_list=["operator.add"]).run())
@@ -0,0 +1,59 @@
+import sys
+import types
+import asyncio
+import operator
+import pytest
+from app.models import Flow
+from app.utils import Process
+from app.utils.exceptions import ProcessRunError
+from app.utils.resolver import resolve, invalidate, _functions
+
+side_effects = []
+
+
+def side_effect():
+    side_effects.append("ran")
+    return "ran"
+
+
+def test_resolve_caches():
+    resolved = resolve("operator.mul")
+    assert resolved.func is operator.mul
+    assert not resolved.is_async
+    assert resolved.module is operator
+    assert resolve("operator.mul") is resolved
+
+    assert resolve("asyncio.sleep").is_async
+    assert resolve("custom.json_parse").module.__name__ == "app.custom"
+
+
+def test_resolve_picks_up_reloaded_module():
+    module = types.ModuleType("pfa_reloaded")
+    module.func = lambda: 1
+    sys.modules["pfa_reloaded"] = module
+    try:
+        assert resolve("pfa_reloaded.func").func() == 1
+        module.func = lambda: 2
+        assert resolve("pfa_reloaded.func").func() == 2
+    finally:
+        sys.modules.pop("pfa_reloaded")
+        invalidate("pfa_reloaded")
+    assert "pfa_reloaded.func" not in _functions
+
+
+def test_bad_function_fails_before_any_node_runs():
+    side_effects.clear()
+    flow = Flow(
+        start_id="1",
+        nodes=[
+            {"id": "1", "type": "Call", "data": {"function": "tests.test_resolver.side_effect"}},
+            {"id": "2", "type": "Call", "data": {"function": "operator.not_a_function"}},
+        ],
+        edges=[
+            {"id": "12", "source": "1", "sourceHandle": "e-out", "target": "2", "targetHandle": "e-in"},
+        ],
+        variables={},
+    )
+    with pytest.raises(ProcessRunError):
+        asyncio.run(Process(flow).run())
+    assert side_effects == []
@@ -0,0 +1,150 @@
+import time
+import asyncio
+from app.models import Flow
+from app.utils import Process
+from app.utils.run_queue import RunQueue, RunQueueConsumer
+from app.utils.exceptions import WorkerExitError
+from app.utils.checkpoint import FileCheckpointStore
+from app.main import run_queued
+from benchmarks.bench_engine import chain_flow
+from tests.test_constants import calls, hang_on, loop_flow, no_start_flow, reset
+
+
+def test_put_is_idempotent(tmp_path):
+    queue = RunQueue(str(tmp_path / "runs.db"))
+    run_id, added = queue.put("{}", idempotency_key="a")
+    assert added
+    assert queue.put("{}", idempotency_key="a") == (run_id, False)
+    assert queue.put("{}")[1] and queue.put("{}")[1]
+    assert queue.metrics()["queued"] == 3
+
+
+def test_take_in_batches_by_priority(tmp_path):
+    queue = RunQueue(str(tmp_path / "runs.db"))
+    low = queue.put("{}")[0]
+    high = queue.put("{}", priority=5)[0]
+    other = queue.put("{}", variables={"x": 1})[0]
+    runs = queue.take(2)
+    assert [run["id"] for run in runs] == [high, low]
+    assert [run["id"] for run in queue.take(5)] == [other]
+    assert queue.take(5) == []
+    assert queue.metrics()["running"] == 3
+
+
+def test_lease_runs_out_and_is_redelivered(tmp_path):
+    queue = RunQueue(str(tmp_path / "runs.db"), visibility_timeout=0.05, max_attempts=2)
+    run_id = queue.put("{}")[0]
+    first = queue.take()[0]
+    time.sleep(0.1)
+    second = queue.take()[0]
+    assert second["id"] == run_id and second["attempts"] == 2
+    assert not queue.ack(run_id, first["receipt"])
+    assert queue.ack(run_id, second["receipt"], {"done": True})
+    assert queue.get(run_id)["result"] == {"done": True}
+
+    run_id = queue.put("{}")[0]
+    queue.take()
+    time.sleep(0.1)
+    queue.take()
+    time.sleep(0.1)
+    assert queue.take() == []
+    assert queue.get(run_id)["status"] == "failed"
+
+
+def test_nack_and_survive_restart(tmp_path):
+    path = str(tmp_path / "runs.db")
+    queue = RunQueue(path, max_attempts=2)
+    run_id = queue.put("{}")[0]
+    run = queue.take()[0]
+    assert queue.nack(run_id, run["receipt"], "boom")
+    queue.close()
+
+    queue = RunQueue(path, max_attempts=2)
+    run = queue.take()[0]
+    assert run["id"] == run_id
+    assert queue.nack(run_id, run["receipt"], "boom again")
+    assert queue.get(run_id)["status"] == "failed"
+    assert queue.get(run_id)["error"] == "boom again"
+    assert queue.purge(-1) == 1 and queue.get(run_id) is None
+
+
+def test_consumer(tmp_path):
+    queue = RunQueue(str(tmp_path / "runs.db"), max_attempts=3)
+
+    async def runner(run: dict):
+        flow = Flow.model_validate_json(run["flow"])
+        return await Process(flow, variables=run["variables"]).run()
+
+    async def consume():
+        good = [queue.put(chain_flow(3).model_dump_json(), {"i": i})[0] for i in range(5)]
+        bad = queue.put(no_start_flow)[0]
+        consumer = RunQueueConsumer(queue, runner, max_runs=2, batch_size=2, poll_interval=0.01)
+        task = asyncio.create_task(consumer.serve())
+        while queue.metrics()["queued"] or queue.metrics()["running"]:
+            await asyncio.sleep(0.01)
+        await consumer.stop()
+        await task
+        return good, bad
+
+    good, bad = asyncio.run(consume())
+    for i, run_id in enumerate(good):
+        assert queue.get(run_id)["result"] == {"i": i, "0": 1, "1": 2, "2": 3}
+    assert queue.get(bad)["status"] == "failed"
+    assert "not found in flow" in queue.get(bad)["error"]
+    # a run that failed isn't handed out again
+    assert queue.get(bad)["attempts"] == 1
+
+
+def test_consumer_retries_only_retry_on(tmp_path):
+    queue = RunQueue(str(tmp_path / "runs.db"), max_attempts=3)
+    attempts = []
+
+    async def runner(run: dict):
+        attempts.append(run["attempts"])
+        if run["attempts"] == 1:
+            raise WorkerExitError("Worker exited with code 1.")
+        return {"attempts": run["attempts"]}
+
+    async def consume():
+        run_id = queue.put("{}")[0]
+        consumer = RunQueueConsumer(
+            queue, runner, poll_interval=0.01, retry_on=(WorkerExitError,), retry_delay=0.05
+        )
+        task = asyncio.create_task(consumer.serve())
+        while queue.get(run_id)["status"] != "completed":
+            await asyncio.sleep(0.01)
+        await consumer.stop()
+        await task
+        return run_id
+
+    run_id = asyncio.run(consume())
+    assert attempts == [1, 2]
+    assert queue.get(run_id)["result"] == {"attempts": 2}
+
+
+def test_redelivered_run_resumes_from_its_checkpoint(tmp_path, monkeypatch):
+    monkeypatch.setenv("PFA_CHECKPOINT_INTERVAL", "0")
+    store = FileCheckpointStore(str(tmp_path / "checkpoints"))
+    queue = RunQueue(str(tmp_path / "runs.db"), visibility_timeout=0.05)
+    run_id = queue.put(loop_flow().model_dump_json())[0]
+    reset()
+    hang_on[:] = [3]
+
+    async def crash():
+        # the server dies on the third item, the run is never acked
+        task = asyncio.create_task(run_queued(queue.take()[0], checkpoints=store))
+        while 3 not in calls:
+            await asyncio.sleep(0.01)
+        task.cancel()
+
+    asyncio.run(crash())
+    assert store.load(run_id)["loops"] == {"loop": 2}
+    time.sleep(0.1)
+    hang_on.clear()
+    run = queue.take()[0]
+    assert run["id"] == run_id and run["attempts"] == 2
+    variables = asyncio.run(run_queued(run, checkpoints=store))
+    assert calls == [1, 2, 3, 3, 4]
+    assert variables["loop__3"] == {"body": 4, "loop": 4}
+    assert variables["test"] == "done"
+    assert not store.exists(run_id)
@@ -0,0 +1,67 @@
+import asyncio
+import pytest
+from app.utils import Process
+from app.utils.scheduler import RunScheduler
+from app.utils.exceptions import RunQueueFullError
+from tests.test_constants import sleep_flow
+
+
+def submit(scheduler: RunScheduler, name: str, priority: int = 0, delay: float = 0.05):
+    flow = sleep_flow(name, delay)
+    return scheduler.submit(Process(flow), flow.name, priority)
+
+
+async def wait_idle(scheduler: RunScheduler):
+    while scheduler.metrics()["queued"] or scheduler.metrics()["running"]:
+        await asyncio.sleep(0.01)
+
+
+def test_scheduler_runs_by_priority_and_limits():
+    async def run():
+        scheduler = RunScheduler(max_runs=1, max_queued=10)
+        runs = [submit(scheduler, "first"), submit(scheduler, "low"), submit(scheduler, "high", priority=5)]
+        assert [run.status for run in runs] == ["running", "queued", "queued"]
+        # clients can match a run to what its process logged
+        assert all(run.id == run.process.run_id for run in runs)
+        await wait_idle(scheduler)
+        return runs, scheduler
+
+    runs, scheduler = asyncio.run(run())
+    first, low, high = runs
+    assert all(run.status == "completed" for run in runs)
+    assert high.started < low.started
+    assert scheduler.get(low.id).result == {"sleep": "low"}
+    metrics = scheduler.metrics()
+    assert metrics["completed"] == 3 and metrics["wait_seconds_max"] > 0
+
+
+def test_scheduler_per_flow_limit():
+    async def run():
+        scheduler = RunScheduler(max_runs=3, max_queued=10, max_runs_per_flow=1)
+        a1, a2, b = submit(scheduler, "a"), submit(scheduler, "a"), submit(scheduler, "b")
+        statuses = [a1.status, a2.status, b.status]
+        await wait_idle(scheduler)
+        return statuses, a1, a2
+
+    statuses, a1, a2 = asyncio.run(run())
+    assert statuses == ["running", "queued", "running"]
+    assert a2.started >= a1.finished
+
+
+def test_scheduler_rejects_and_cancels():
+    async def run():
+        scheduler = RunScheduler(max_runs=1, max_queued=2)
+        running = submit(scheduler, "running", delay=5)
+        queued = submit(scheduler, "queued")
+        submit(scheduler, "queued")
+        with pytest.raises(RunQueueFullError):
+            submit(scheduler, "rejected")
+        scheduler.cancel(queued.id)
+        scheduler.cancel(running.id)
+        await wait_idle(scheduler)
+        return scheduler, running, queued
+
+    scheduler, running, queued = asyncio.run(run())
+    assert running.status == "cancelled" and queued.status == "cancelled"
+    metrics = scheduler.metrics()
+    assert metrics["rejected"] == 1 and metrics["cancelled"] == 2 and metrics["completed"] == 1
@@ -0,0 +1,57 @@
+import json
+import asyncio
+import pytest
+from app.models import Flow
+from app.utils import Process
+from app.utils.exceptions import ProcessRunError
+from app.utils.snapshot import failure_snapshot, snapshot_value
+from tests.test_constants import sample_fail_flow
+
+
+def test_snapshot_value():
+    assert snapshot_value("a", 1) == 1
+    assert snapshot_value("a", None) is None
+    assert snapshot_value("a", "small") == "small"
+    assert snapshot_value("a", [1, 2]) == "[1, 2]"
+
+    ref = snapshot_value("big", "x" * 5000, 100)
+    assert ref == {"$ref": "big", "type": "str", "size": 5000, "preview": "x" * 100}
+
+    ref = snapshot_value("big", list(range(100000)), 100)
+    assert ref["$ref"] == "big" and ref["size"] == 100000
+    assert len(ref["preview"]) <= 100
+
+
+def test_failure_snapshot_is_bounded():
+    flow = Flow(**sample_fail_flow)
+    variables = {f"v{i}": "x" * 1000 for i in range(1000)}
+    snapshot = failure_snapshot(ValueError("boom"), flow, variables, value_limit=100, limit=10000)
+
+    assert snapshot["error"] == "ValueError('boom')"
+    assert snapshot["dump"]["flow"]["nodes"] == 2
+    assert len(json.dumps(snapshot)) < 20000
+    assert snapshot["dump"]["variables"]["__omitted__"] > 0
+
+
+def test_failure_snapshot_writes_full_dump(tmp_path):
+    flow = Flow(**sample_fail_flow)
+    variables = {"big": "x" * 5000}
+    snapshot = failure_snapshot(ValueError("boom"), flow, variables, value_limit=100, dump_dir=str(tmp_path))
+
+    from app.utils import snapshot as snapshot_module
+
+    snapshot_module._dump_writer.submit(lambda: None).result()
+    with open(snapshot["dump"]["file"]) as f:
+        dump = json.load(f)
+    assert dump["dump"]["variables"]["big"] == "x" * 5000
+    assert dump["dump"]["flow"]["start_id"] == "1"
+
+
+def test_process_failure_raises_snapshot():
+    flow = Flow(**sample_fail_flow)
+    flow.variables = {"big": "x" * 1000000}
+    with pytest.raises(ProcessRunError) as e:
+        asyncio.run(Process(flow).run())
+    error = e.value.args[0]
+    assert error["dump"]["variables"]["big"]["$ref"] == "big"
+    assert len(json.dumps(error)) < 10000
@@ -0,0 +1,110 @@
+import asyncio
+from app.utils import Process
+from app.utils.updates import UpdateChannel
+from benchmarks.bench_engine import chain_flow
+
+
+def test_update_channel_sends_in_order():
+    sent = []
+
+    async def send(update):
+        sent.append(update)
+
+    async def run():
+        channel = UpdateChannel(send).start()
+        for i in range(10):
+            await channel.put({"function_id": str(i)})
+        await channel.put("done")
+        await channel.close()
+
+    asyncio.run(run())
+    assert sent == [{"function_id": str(i)} for i in range(10)] + ["done"]
+
+
+def test_update_channel_backpressure():
+    sent = []
+
+    async def send(update):
+        await asyncio.sleep(0.05)
+        sent.append(update)
+
+    async def run():
+        channel = UpdateChannel(send, maxsize=2).start()
+        await channel.put(1)
+        await channel.put(2)
+        await channel.put(3)
+        # one update is being sent and two fit in the queue, none waited
+        before = list(sent)
+        for i in range(4, 7):
+            await channel.put(i)
+        # the queue was full, so the later ones waited on sends
+        during = list(sent)
+        await channel.close()
+        return before, during
+
+    before, during = asyncio.run(run())
+    assert before == []
+    assert during[:2] == [1, 2]
+    assert sent == [1, 2, 3, 4, 5, 6]
+
+
+def test_update_channel_coalesces_node_updates():
+    sent = []
+
+    async def send(update):
+        await asyncio.sleep(0.05)
+        sent.append(update)
+
+    async def run():
+        channel = UpdateChannel(send, coalesce=True).start()
+        await channel.put({"function_id": "a", "response": 0})
+        await asyncio.sleep(0)
+        for i in range(1, 5):
+            await channel.put({"function_id": "a", "response": i})
+        await channel.put("done")
+        await channel.close()
+
+    asyncio.run(run())
+    assert sent == [
+        {"function_id": "a", "response": 0},
+        {"function_id": "a", "response": 4},
+        "done",
+    ]
+
+
+def test_update_channel_stops_when_send_fails():
+    async def send(update):
+        raise ConnectionError("client gone")
+
+    async def run():
+        channel = UpdateChannel(send, maxsize=1).start()
+        for i in range(5):
+            await channel.put(i)
+        await channel.close()
+
+    asyncio.run(asyncio.wait_for(run(), 1))
+
+
+def test_process_ws_updates_do_not_sleep(monkeypatch):
+    sent = []
+    sleeps = []
+    sleep = asyncio.sleep
+
+    async def recording_sleep(delay, *args, **kwargs):
+        sleeps.append(delay)
+        return await sleep(delay, *args, **kwargs)
+
+    async def send(update):
+        sent.append(update)
+
+    async def run():
+        channel = UpdateChannel(send).start()
+        process = Process(chain_flow(50), update=channel.put, ws=True)
+        await process.run()
+        await channel.close()
+
+    monkeypatch.setattr(asyncio, "sleep", recording_sleep)
+    asyncio.run(run())
+    # nothing waits between nodes for the client to get an update
+    assert not any(sleeps)
+    assert [update["function_id"] for update in sent] == [str(i) for i in range(50)]
@@ -0,0 +1,51 @@
+import asyncio
+import pytest
+from app.utils.workers import WorkerPool, WorkerRun
+from app.utils.exceptions import WorkerRunError
+from app.utils.metrics import latency, runs
+from benchmarks.bench_engine import chain_flow
+from tests.test_constants import exit_flow, no_start_flow
+
+
+def test_worker_pool():
+    async def run(pool: WorkerPool):
+        flow_json = chain_flow(5).model_dump_json()
+        results = await asyncio.gather(*(pool.run(flow_json) for _ in range(10)))
+        worker_run = WorkerRun(pool, flow_json, {"extra": 1})
+        assert worker_run.checkpoint_id == worker_run.run_id
+        variables = await worker_run.run()
+        with pytest.raises(WorkerRunError, match="not found in flow"):
+            await pool.run(no_start_flow)
+        return results, variables
+
+    completed = lambda: sum(v for (_, status), v in runs._values.items() if status == "completed")
+    added = lambda: sum(row["count"] for row in latency.query(function="operator.add"))
+    before, before_added = completed(), added()
+    pool = WorkerPool(workers=2, max_runs=2).start()
+    try:
+        results, variables = asyncio.run(run(pool))
+    finally:
+        pool.stop()
+    assert all(result == {str(i): i + 1 for i in range(5)} for result in results)
+    assert variables["extra"] == 1 and variables["4"] == 5
+    # the runs were recorded by the workers and are served by this process
+    assert completed() - before == 11
+    assert added() - before_added == 55
+
+
+def test_worker_pool_replaces_dead_workers():
+    async def run(pool: WorkerPool):
+        flow_json = chain_flow(3).model_dump_json()
+        with pytest.raises(WorkerRunError, match="exited with code 1"):
+            await asyncio.wait_for(pool.run(exit_flow()), 30)
+        # the next run goes to the worker started in its place
+        return await asyncio.wait_for(pool.run(flow_json), 30)
+
+    pool = WorkerPool(workers=1).start()
+    pid = pool._workers[0].process.pid
+    try:
+        result = asyncio.run(run(pool))
+        assert pool._workers[0].process.pid != pid
+    finally:
+        pool.stop()
+    assert result == {str(i): i + 1 for i in range(3)}